@@ -0,0 +1,142 @@
+import bisect
+import json
+import os
+import threading
+from datetime import datetime, timezone
+
+# Where entries without a readable timestamp sort
+EARLIEST = datetime.min.replace(tzinfo=timezone.utc)
+
+
+def parse_timestamp(value):
+    """
+    A timestamp (ISO string or datetime) as a timezone-aware datetime, so
+    times written with different offsets, or none, compare by the moment they
+    name. Naive times are taken as local time; unreadable ones sort first.
+    """
+    if not isinstance(value, datetime):
+        try:
+            value = datetime.fromisoformat(value)
+        except (TypeError, ValueError):
+            return EARLIEST
+    return value.astimezone() if value.tzinfo is None else value
+
+
+class AccidentLogStore:
+    """
+    Append-only accident log kept as one JSON object per line on disk. Only
+    an index of (timestamp, sequence number) keys and line offsets lives in
+    memory, so appends cost one short write and queries by time range read
+    just the lines they return. Totals are kept up to date on append instead
+    of being recounted from the log.
+
+    Sequence numbers are the line numbers in the file and double as the
+    pagination cursor: a query continues after (or before) the entry the
+    cursor names, in timestamp order.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._keys = []        # (aware timestamp, seq), sorted
+        self._offsets = []     # seq -> byte offset of the line
+        self._timestamps = []  # seq -> aware timestamp, to find a cursor's key
+        self.accident_count = 0
+        self._load()
+        self._file = open(self.path, "ab")
+        self._reader = open(self.path, "rb")
+
+    def __len__(self):
+        return len(self._offsets)
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        offset = 0
+        with open(self.path, "rb") as f:
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break  # A write cut short by a crash
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    print(f"Skipping unreadable accident log line at byte {offset}")
+                else:
+                    self._index(entry, offset)
+                offset += len(line)
+        if offset != os.path.getsize(self.path):
+            with open(self.path, "r+b") as f:
+                f.truncate(offset)
+
+    def _index(self, entry, offset):
+        seq = len(self._offsets)
+        timestamp = parse_timestamp(entry.get("timestamp"))
+        self._offsets.append(offset)
+        self._timestamps.append(timestamp)
+        if not self._keys or self._keys[-1] <= (timestamp, seq):
+            self._keys.append((timestamp, seq))  # The usual case: entries arrive in time order
+        else:
+            bisect.insort(self._keys, (timestamp, seq))
+        if entry.get("is_accident", False):
+            self.accident_count += 1
+        return seq
+
+    def append(self, entry):
+        """Write an entry (a dict with a timestamp) to the end of the log and return its sequence number."""
+        line = (json.dumps(entry, separators=(",", ":")) + "\n").encode()
+        with self._lock:
+            offset = self._file.tell()
+            self._file.write(line)
+            self._file.flush()
+            return self._index(entry, offset)
+
+    def extend(self, entries):
+        for entry in entries:
+            self.append(entry)
+
+    def query(self, limit=100, cursor=None, since=None, until=None, newest_first=False):
+        """
+        Return (entries, next_cursor) for up to `limit` entries with since <=
+        timestamp < until, oldest first unless `newest_first`. since and until
+        are datetimes or ISO strings, compared as moments in time like the
+        entries' timestamps. next_cursor is None once there is nothing more to read.
+        """
+        since = None if since is None else parse_timestamp(since)
+        until = None if until is None else parse_timestamp(until)
+        with self._lock:
+            lo = 0 if since is None else bisect.bisect_left(self._keys, (since,))
+            hi = len(self._keys) if until is None else bisect.bisect_left(self._keys, (until,))
+            if cursor is not None:
+                key = (self._timestamps[cursor], cursor)
+                if newest_first:
+                    hi = min(hi, bisect.bisect_left(self._keys, key))
+                else:
+                    lo = max(lo, bisect.bisect_right(self._keys, key))
+            if newest_first:
+                page = self._keys[max(lo, hi - limit):hi][::-1]
+            else:
+                page = self._keys[lo:min(hi, lo + limit)]
+
+            entries = []
+            for _, seq in page:
+                self._reader.seek(self._offsets[seq])
+                entries.append(json.loads(self._reader.readline()))
+            more = hi - lo > len(page)
+        return entries, (page[-1][1] if page and more else None)
+
+    def valid_cursor(self, cursor):
+        return 0 <= cursor < len(self._offsets)
+
+    def clear(self):
+        with self._lock:
+            self._file.truncate(0)
+            self._file.seek(0)
+            self._keys, self._offsets, self._timestamps = [], [], []
+            self.accident_count = 0
+
+    def close(self):
+        with self._lock:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._file.close()
+            self._reader.close()
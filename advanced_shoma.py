@@ -9,23 +9,25 @@ from rich.panel import Panel
 from rich.layout import Layout
 from rich.live import Live
 from rich import print as rprint
+from http_client import shared_client
 
 # Configuration
 BASE_URL = "http://127.0.0.1:8000"
 console = Console()
 
 class TrafficControlClient:
-    def __init__(self, base_url=BASE_URL):
+    def __init__(self, base_url=BASE_URL, timeout=5):
         self.base_url = base_url
+        # Pooled connections, retries and a circuit breaker shared with the rest of the process
+        self.client = shared_client(base_url, timeout=(1.0, timeout))
     
     def api_request(self, method, endpoint, data=None):
         """Make an API request and handle errors"""
-        url = f"{self.base_url}/{endpoint}"
         try:
             if method.lower() == "get":
-                response = requests.get(url, timeout=5)
+                response = self.client.get(endpoint)
             elif method.lower() == "post":
-                response = requests.post(url, json=data, timeout=5)
+                response = self.client.post(endpoint, json=data)
             else:
                 console.print(f"[bold red]Invalid method: {method}")
                 return None
@@ -41,6 +43,12 @@ class TrafficControlClient:
         """Check server health status"""
         return self.api_request("get", "health")
     
+    # Everything a dashboard needs in one request
+    def get_snapshot(self, fields=None):
+        """Get a consistent snapshot of the server state, optionally only some fields"""
+        endpoint = "snapshot" if not fields else f"snapshot?fields={','.join(fields)}"
+        return self.api_request("get", endpoint)
+    
     # Lane counter operations
     def get_lane_counters(self):
         """Get current lane counters"""
@@ -96,9 +104,9 @@ class TrafficControlClient:
         }
         return self.api_request("post", "log-accident", accident)
     
-    def get_accident_logs(self):
-        """Get all accident logs"""
-        return self.api_request("get", "log-accident")
+    def get_accident_logs(self, limit=50):
+        """Get the most recent accident logs"""
+        return self.api_request("get", f"log-accident?newest_first=true&limit={limit}")
     
     # Statistics
     def get_statistics(self):
@@ -234,8 +242,11 @@ def display_dashboard(client):
     with Live(layout, refresh_per_second=1, screen=True) as live:
         try:
             while True:
+                # One request for the whole refresh
+                snapshot = client.get_snapshot(["health", "lane_counters", "traffic_lights", "statistics", "safety"]) or {}
+                
                 # Update header
-                health = client.health_check()
+                health = snapshot.get("health")
                 layout["header"].update(
                     Panel(
                         f"[bold white]Server Status:[/bold white] {'[green]Online' if health else '[red]Offline'}\n"
@@ -246,7 +257,7 @@ def display_dashboard(client):
                 )
                 
                 # Update lane counters
-                counters = client.get_lane_counters()
+                counters = snapshot.get("lane_counters")
                 if counters:
                     table = Table(title="Lane Counters")
                     table.add_column("Lane", style="cyan")
@@ -258,7 +269,7 @@ def display_dashboard(client):
                     layout["counters"].update(table)
                 
                 # Update traffic lights
-                lights = client.get_traffic_lights()
+                lights = snapshot.get("traffic_lights")
                 if lights:
                     table = Table(title="Traffic Lights")
                     table.add_column("ID", style="cyan", width=4)
@@ -279,7 +290,7 @@ def display_dashboard(client):
                     layout["lights"].update(table)
                 
                 # Update statistics
-                stats = client.get_statistics()
+                stats = snapshot.get("statistics")
                 if stats:
                     layout["statistics"].update(
                         Panel(
@@ -296,7 +307,7 @@ def display_dashboard(client):
                     )
                 
                 # Update safety status
-                accident_status = client.check_accident()
+                accident_status = snapshot.get("safety")
                 if accident_status:
                     status = "[bold red]WARNING! Potential accident detected!" if accident_status.get('is_accident', False) else "[bold green]No accidents detected"
                     message = accident_status.get('message', '')
@@ -317,6 +328,8 @@ def display_dashboard(client):
 # Command-line interface
 def main():
     parser = argparse.ArgumentParser(description='Traffic Control Client')
+    parser.add_argument('--server', default=BASE_URL, help='Traffic server URL')
+    parser.add_argument('--timeout', type=float, default=5, help='Read timeout for server requests, in seconds')
     subparsers = parser.add_subparsers(dest='command', help='Command to execute')
     
     # Health check
@@ -346,7 +359,8 @@ def main():
     
     # Accidents and safety
     subparsers.add_parser('check-accident', help='Check for potential accidents')
-    subparsers.add_parser('accident-logs', help='Get accident logs')
+    accident_logs_parser = subparsers.add_parser('accident-logs', help='Get accident logs')
+    accident_logs_parser.add_argument('--limit', type=int, default=50, help='Number of recent logs to show')
     
     log_accident_parser = subparsers.add_parser('log-accident', help='Log an accident')
     log_accident_parser.add_argument('message', help='Accident message')
@@ -363,7 +377,7 @@ def main():
     
     # Parse arguments
     args = parser.parse_args()
-    client = TrafficControlClient()
+    client = TrafficControlClient(args.server, args.timeout)
     
     # Execute command
     if args.command == 'health':
@@ -416,7 +430,7 @@ def main():
                 console.print(f"[bold green]No accidents detected")
     
     elif args.command == 'accident-logs':
-        logs = client.get_accident_logs()
+        logs = client.get_accident_logs(args.limit)
         display_accident_logs(logs)
     
     elif args.command == 'log-accident':
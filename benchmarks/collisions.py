@@ -0,0 +1,70 @@
+"""
+Frame cost of the Car.update collision pass, plain sprite group vs spatial hash.
+
+Run from the repository root:
+    python -m benchmarks.collisions
+    python -m benchmarks.collisions --counts 100 1000 10000 --frames 20
+"""
+import argparse
+import os
+import time
+
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+
+import pygame
+
+from draw_objects import Car
+from spatial_hash import SpatialHashGroup
+
+# Keep the car density constant as the count grows, so the numbers show how
+# the collision pass scales rather than how crowded the road is
+LANE_SPACING = 15
+CAR_SPACING = 30
+CARS_PER_LANE = 100
+
+
+def build_cars(group, count):
+    for i in range(count):
+        lane, slot = divmod(i, CARS_PER_LANE)
+        if lane % 2 == 0:
+            car = Car(slot * CAR_SPACING, lane * LANE_SPACING, (255, 0, 0), 2, 'horizontal', 'left-right')
+        else:
+            car = Car(slot * CAR_SPACING + 10, lane * LANE_SPACING, (0, 0, 255), -2, 'horizontal', 'right-left')
+        group.add(car)
+    return group
+
+
+def time_frames(group, frames):
+    start = time.perf_counter()
+    for _ in range(frames):
+        for car in list(group):
+            car.update(group)
+    return (time.perf_counter() - start) / frames
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the car collision pass')
+    parser.add_argument('--counts', type=int, nargs='+', default=[100, 1000, 10000], help='Car counts to test')
+    parser.add_argument('--frames', type=int, default=10, help='Frames to time per run')
+    parser.add_argument('--naive-limit', type=int, default=2000,
+                        help='Skip the plain sprite group above this many cars (it is O(n^2))')
+    args = parser.parse_args()
+
+    pygame.init()
+    pygame.display.set_mode((1, 1))
+
+    print(f"{'cars':>8} {'group':>12} {'ms/frame':>10} {'us/car':>8}")
+    for count in args.counts:
+        runs = [('spatial-hash', SpatialHashGroup())]
+        if count <= args.naive_limit:
+            runs.append(('sprite-group', pygame.sprite.Group()))
+        for name, group in runs:
+            build_cars(group, count)
+            per_frame = time_frames(group, args.frames)
+            print(f"{count:>8} {name:>12} {per_frame * 1000:>10.2f} {per_frame * 1e6 / count:>8.2f}")
+
+    pygame.quit()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,320 @@
+"""
+Load test for the traffic server. Starts server.py under uvicorn on a free
+local port (in a temporary directory, so no data files are touched) and runs
+closed-loop virtual clients against it at increasing concurrency. Each
+client repeatedly picks a request from the real traffic mix:
+
+    light poll       GET  /traffic-lights (conditional, as simulators poll)
+    counter post     POST /lane-counters/increments
+    accident post    POST /log-accident
+    dashboard poll   GET  /snapshot
+    pattern apply    POST /traffic-lights/batch
+
+weighted by how often a simulator, a dashboard and a controller send them.
+For every level it reports throughput and p50/p95/p99 latency per endpoint,
+and it names the first level where p99 goes over --slo-ms or throughput
+stops growing.
+
+Each virtual client keeps one keep-alive connection, like a simulator, and
+speaks just enough HTTP/1.1 over asyncio streams to stay cheap: on a single
+machine the load generator shares the CPU with the server, so the client and
+server CPU use of every level is reported too. A level where the client uses
+most of a core measures the load generator, not the server.
+
+Run from the repository root:
+    python -m benchmarks.load_test
+    python -m benchmarks.load_test --levels 1 8 64 256 --duration 10 --output load.json
+    python -m benchmarks.load_test --url http://127.0.0.1:8000   # against a running server
+"""
+import argparse
+import asyncio
+import json
+import math
+import os
+import platform
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from urllib.parse import urlsplit
+
+import numpy as np
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# (name, weight): relative rates of one simulator polling every frame and
+# posting per spawn, plus its share of dashboards and controllers
+TRAFFIC_MIX = (
+    ('light_poll', 60),
+    ('counter_post', 4),
+    ('accident_post', 0.1),
+    ('dashboard_poll', 1),
+    ('pattern_apply', 0.2),
+)
+
+NORTH_SOUTH = [{"id": 1, "green": True}, {"id": 3, "green": True}, {"id": 2, "red": True}, {"id": 4, "red": True}]
+EAST_WEST = [{"id": 1, "red": True}, {"id": 3, "red": True}, {"id": 2, "green": True}, {"id": 4, "green": True}]
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_server(port, workdir):
+    env = dict(os.environ, PYTHONPATH=REPO_ROOT + os.pathsep + os.environ.get("PYTHONPATH", ""))
+    command = [sys.executable, "-m", "uvicorn", "server:app", "--host", "127.0.0.1", "--port", str(port),
+               "--log-level", "warning", "--no-access-log"]
+    process = subprocess.Popen(command, cwd=workdir, env=env)
+    deadline = time.monotonic() + 20
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"Server exited with code {process.returncode}")
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=0.2):
+                return process
+        except OSError:
+            time.sleep(0.1)
+    process.terminate()
+    raise RuntimeError("Server did not start within 20 seconds")
+
+
+def process_cpu(pid):
+    """CPU seconds used so far by process `pid`, or None where /proc is not available."""
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            fields = f.read().rsplit(")", 1)[1].split()
+    except OSError:
+        return None
+    return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+
+
+class Connection:
+    """One keep-alive HTTP/1.1 connection. Only what the server's responses need: Content-Length bodies."""
+
+    def __init__(self, host, port, timeout):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.reader = self.writer = None
+
+    async def request(self, method, path, body=None, headers=None):
+        """Returns (status, headers, body); reconnects once if the server closed the connection."""
+        data = json.dumps(body).encode() if body is not None else b""
+        lines = [f"{method} {path} HTTP/1.1", f"Host: {self.host}:{self.port}", f"Content-Length: {len(data)}"]
+        if body is not None:
+            lines.append("Content-Type: application/json")
+        lines.extend(f"{name}: {value}" for name, value in (headers or {}).items())
+        message = ("\r\n".join(lines) + "\r\n\r\n").encode() + data
+        for attempt in range(2):
+            if self.writer is None:
+                self.reader, self.writer = await asyncio.wait_for(
+                    asyncio.open_connection(self.host, self.port), self.timeout)
+            try:
+                self.writer.write(message)
+                return await asyncio.wait_for(self._response(), self.timeout)
+            except (ConnectionError, asyncio.IncompleteReadError):
+                self.close()
+                if attempt:
+                    raise
+
+    async def _response(self):
+        head = await self.reader.readuntil(b"\r\n\r\n")
+        status_line, *header_lines = head.decode("latin-1").split("\r\n")
+        headers = {}
+        for line in header_lines:
+            if line:
+                name, _, value = line.partition(":")
+                headers[name.strip().lower()] = value.strip()
+        body = await self.reader.readexactly(int(headers.get("content-length", 0)))
+        if headers.get("connection", "").lower() == "close":
+            self.close()
+        return int(status_line.split()[1]), headers, body
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+        self.reader = self.writer = None
+
+
+class VirtualClient:
+    def __init__(self, connection, rng):
+        self.connection = connection
+        self.rng = rng
+        self.etag = None
+        self.north_south = True
+
+    async def light_poll(self):
+        headers = {"If-None-Match": self.etag} if self.etag else {}
+        status_code, headers, _ = await self.connection.request("GET", "/traffic-lights", headers=headers)
+        self.etag = headers.get("etag", self.etag)
+        return status_code
+
+    async def counter_post(self):
+        lane = self.rng.choice(["top", "bottom", "left", "right"])
+        status_code, _, _ = await self.connection.request("POST", "/lane-counters/increments",
+                                                          {"increments": [{lane: 1}]})
+        return status_code
+
+    async def accident_post(self):
+        status_code, _, _ = await self.connection.request("POST", "/log-accident",
+                                                          {"message": "load test", "is_accident": False})
+        return status_code
+
+    async def dashboard_poll(self):
+        status_code, _, _ = await self.connection.request("GET", "/snapshot")
+        return status_code
+
+    async def pattern_apply(self):
+        self.north_south = not self.north_south
+        lights = NORTH_SOUTH if self.north_south else EAST_WEST
+        status_code, _, _ = await self.connection.request("POST", "/traffic-lights/batch", {"lights": lights})
+        return status_code
+
+
+async def run_level(host, port, concurrency, duration, think, timeout, seed):
+    """Run `concurrency` closed-loop clients for `duration` seconds. Returns {op: [(latency, ok)]}."""
+    names = [name for name, _ in TRAFFIC_MIX]
+    weights = [weight for _, weight in TRAFFIC_MIX]
+    samples = {name: [] for name in names}
+    deadline = time.perf_counter() + duration
+
+    async def worker(index):
+        connection = Connection(host, port, timeout)
+        virtual = VirtualClient(connection, random.Random(seed * 100003 + index))
+        try:
+            while time.perf_counter() < deadline:
+                name = virtual.rng.choices(names, weights)[0]
+                start = time.perf_counter()
+                try:
+                    ok = await getattr(virtual, name)() < 400
+                except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError, ValueError):
+                    connection.close()
+                    ok = False
+                samples[name].append((time.perf_counter() - start, ok))
+                if think:
+                    await asyncio.sleep(think)
+        finally:
+            connection.close()
+
+    await asyncio.gather(*(worker(i) for i in range(concurrency)))
+    return samples
+
+
+def summarize(samples, duration):
+    endpoints = {}
+    total = errors = 0
+    all_latencies = []
+    for name, results in samples.items():
+        if not results:
+            continue
+        latencies = np.array([latency for latency, _ in results]) * 1000
+        failed = sum(1 for _, ok in results if not ok)
+        p50, p95, p99 = np.percentile(latencies, (50, 95, 99))
+        endpoints[name] = {'requests': len(results), 'errors': failed, 'throughput': len(results) / duration,
+                           'p50_ms': p50, 'p95_ms': p95, 'p99_ms': p99}
+        total += len(results)
+        errors += failed
+        all_latencies.append(latencies)
+    latencies = np.concatenate(all_latencies) if all_latencies else np.array([math.nan])
+    p50, p95, p99 = np.percentile(latencies, (50, 95, 99))
+    return {'requests': total, 'errors': errors, 'throughput': total / duration,
+            'p50_ms': p50, 'p95_ms': p95, 'p99_ms': p99, 'endpoints': endpoints}
+
+
+def find_breakdown(levels, slo_ms, min_gain):
+    """The first level whose p99 breaks the SLO, has errors, or adds less than `min_gain` throughput."""
+    previous = None
+    for level in levels:
+        if level['p99_ms'] > slo_ms:
+            return level['concurrency'], f"p99 {level['p99_ms']:.1f} ms > {slo_ms} ms"
+        if level['errors']:
+            return level['concurrency'], f"{level['errors']} failed requests"
+        if previous is not None and level['throughput'] < previous['throughput'] * (1 + min_gain):
+            return level['concurrency'], (f"throughput {level['throughput']:.0f} req/s, "
+                                          f"up less than {min_gain:.0%} from {previous['throughput']:.0f}")
+        previous = level
+    return None, "no breakdown within the tested levels"
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Load test the traffic server')
+    parser.add_argument('--levels', type=int, nargs='+', default=[1, 2, 4, 8, 16, 32, 64, 128, 256],
+                        help='Concurrent virtual clients per step')
+    parser.add_argument('--duration', type=float, default=5.0, help='Seconds per level')
+    parser.add_argument('--think', type=float, default=0.0, help='Seconds each client waits between requests')
+    parser.add_argument('--timeout', type=float, default=10.0, help='Request timeout in seconds')
+    parser.add_argument('--slo-ms', type=float, default=100.0, help='p99 latency that counts as broken down')
+    parser.add_argument('--min-gain', type=float, default=0.05,
+                        help='Throughput gain per step below which the server counts as saturated')
+    parser.add_argument('--url', help='Test a server that is already running instead of starting one')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', help='Write the JSON results here instead of stdout')
+    args = parser.parse_args()
+
+    process = None
+    workdir = tempfile.TemporaryDirectory(prefix="traffic-load-")
+    levels = []
+    try:
+        if args.url:
+            url = urlsplit(args.url)
+            host, port = url.hostname, url.port or 80
+        else:
+            host, port = "127.0.0.1", free_port()
+            process = start_server(port, workdir.name)
+
+        print(f"{'clients':>7} {'req/s':>8} {'p50 ms':>7} {'p95 ms':>7} {'p99 ms':>7} {'errors':>6} "
+              f"{'client cpu':>10} {'server cpu':>10}", file=sys.stderr)
+        for concurrency in args.levels:
+            client_start = time.process_time()
+            server_start = process_cpu(process.pid) if process else None
+            started = time.perf_counter()
+            samples = asyncio.run(run_level(host, port, concurrency, args.duration, args.think, args.timeout, args.seed))
+            elapsed = time.perf_counter() - started
+            level = dict(concurrency=concurrency, **summarize(samples, args.duration))
+            # Share of one core used during the level
+            level['client_cpu'] = (time.process_time() - client_start) / elapsed
+            server_end = process_cpu(process.pid) if server_start is not None else None
+            level['server_cpu'] = (server_end - server_start) / elapsed if server_end is not None else None
+            levels.append(level)
+            server_cpu = f"{level['server_cpu']:.0%}" if level['server_cpu'] is not None else '-'
+            print(f"{concurrency:>7} {level['throughput']:>8.0f} {level['p50_ms']:>7.2f} {level['p95_ms']:>7.2f} "
+                  f"{level['p99_ms']:>7.2f} {level['errors']:>6} {level['client_cpu']:>10.0%} {server_cpu:>10}",
+                  file=sys.stderr)
+            for name, endpoint in level['endpoints'].items():
+                print(f"{'':>7} {name:<15} {endpoint['throughput']:>8.1f} req/s  p50 {endpoint['p50_ms']:.2f}  "
+                      f"p95 {endpoint['p95_ms']:.2f}  p99 {endpoint['p99_ms']:.2f} ms", file=sys.stderr)
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait(10)
+        workdir.cleanup()
+
+    breakdown, reason = find_breakdown(levels, args.slo_ms, args.min_gain)
+    print(f"Breakdown: {breakdown if breakdown else 'none'} ({reason})", file=sys.stderr)
+
+    report = {
+        'benchmark': 'load_test',
+        'created': datetime.now().isoformat(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'settings': {'duration': args.duration, 'think': args.think, 'slo_ms': args.slo_ms,
+                     'min_gain': args.min_gain, 'mix': dict(TRAFFIC_MIX), 'external_server': bool(args.url)},
+        'breakdown': {'concurrency': breakdown, 'reason': reason},
+        'levels': levels,
+    }
+    text = json.dumps(report, indent=2, default=float)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+
+
+if __name__ == '__main__':
+    main()
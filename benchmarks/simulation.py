@@ -0,0 +1,275 @@
+"""
+Throughput of the simulation core: the spawn, light gating, update and
+cleanup pipeline that main.py runs every frame, for both engines, headless.
+
+Each scenario fills the crossroad's lanes with a number of cars, queued
+bumper to bumper at most, then times a number of ticks under a traffic light pattern (all red, alternating axes, or both
+axes green) and a spawn interval. A second, shorter run under tracemalloc
+measures peak memory, so tracing does not distort the timings. Scenarios are
+labelled with the number of cars actually placed: a count the lanes cannot
+hold is capped, and counts that cap to one already run are skipped. Results are
+written as JSON; pass a previous file as --baseline to flag regressions.
+
+Run from the repository root:
+    python -m benchmarks.simulation
+    python -m benchmarks.simulation --counts 100 1000 --engines sprite --output before.json
+    python -m benchmarks.simulation --baseline before.json --output after.json
+"""
+import argparse
+import copy
+import json
+import os
+import platform
+import random
+import sys
+import time
+import tracemalloc
+from datetime import datetime
+
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+
+import numpy as np
+import pygame
+
+import main as sim
+from draw_objects import Car, lane_position
+from lanes import MIN_GAP
+from settings import STEPS_PER_SECOND, traffic_lights
+from spatial_hash import SpatialHashGroup
+from vector_engine import VectorTraffic, SPAWN_DIRECTIONS
+
+LIGHT_PATTERNS = ('all-red', 'alternating', 'conflicting')
+# Simulated seconds each axis stays green in the alternating pattern
+PHASE_SECONDS = 10
+# Car length plus the gap kept when queued, for spacing the cars in pre-filled lanes
+LANE_SLOT = 20 + MIN_GAP + 4
+
+
+def lights_for(pattern, tick):
+    """Traffic light states for `pattern` at simulation tick `tick`."""
+    lights = copy.deepcopy(traffic_lights)
+    vertical_green = (tick // (PHASE_SECONDS * STEPS_PER_SECOND)) % 2 == 0
+    for light in lights:
+        vertical = light['direction'] in ['up', 'down']
+        if pattern == 'all-red':
+            green = False
+        elif pattern == 'conflicting':
+            green = True
+        else:
+            green = vertical == vertical_green
+        light.update(red=not green, yellow=False, green=green)
+    return lights
+
+
+def reset_world(seed, max_cars, spawn_interval):
+    """main.reset_world, with every direction spawning each `spawn_interval` ticks."""
+    sim.reset_world(seed, max_cars)
+    for direction in sim.spawn_intervals:
+        sim.spawn_intervals[direction] = spawn_interval / STEPS_PER_SECOND  # ticks to simulated seconds
+
+
+def lane_slots(direction, count):
+    """
+    Positions along the lane for the cars queued in one lane of `direction`
+    when `count` cars fill the crossroad: front-most first, one LANE_SLOT
+    apart, and no more than fit between the simulation bounds.
+    """
+    bounds = sim.simulation_bounds
+    vertical = direction in ['up-down', 'down-up']
+    low, high = (bounds['top'], bounds['bottom']) if vertical else (bounds['left'], bounds['right'])
+    n = min(count // len(sim.lanes), int((high - low) // LANE_SLOT))
+    if direction in ['up-down', 'left-right']:
+        return [high - 20 - k * LANE_SLOT for k in range(n)]
+    return [low + k * LANE_SLOT for k in range(n)]
+
+
+def initial_cars(count):
+    """How many cars a scenario for `count` cars actually starts with."""
+    return sum(len(lane_slots(direction, count)) for direction, _ in sim.lanes)
+
+
+def populate_sprites(cars, count, rng):
+    """Queue up to `count` cars along the lanes without overlaps."""
+    for (direction, lane_number), lane in sim.lanes.items():
+        vertical = direction in ['up-down', 'down-up']
+        forward = direction in ['up-down', 'left-right']
+        for position in lane_slots(direction, count):
+            color = (rng.randint(0, 255), rng.randint(0, 255), rng.randint(0, 255))
+            speed = 2 if forward else -2
+            across = lane_position(direction, lane_number)
+            if vertical:
+                car = Car(across, position, color, speed, 'vertical', direction)
+            else:
+                car = Car(position, across, color, speed, 'horizontal', direction)
+            cars.add(car)
+            lane.append(car)
+
+
+def populate_vector(traffic, count, rng):
+    """Queue up to `count` cars along the vector engine's lanes, as populate_sprites does."""
+    for direction, lane_number in sim.lanes:
+        positions = lane_slots(direction, count)
+        start = len(traffic)
+        colors = [[rng.randint(0, 255) for _ in range(3)] for _ in positions]
+        added = traffic.place_cars(direction, [lane_number] * len(positions), colors)
+        if direction in ['up-down', 'down-up']:
+            traffic.y[start:start + added] = positions[:added]
+        else:
+            traffic.x[start:start + added] = positions[:added]
+
+
+def build(engine, count, spawn_interval, seed):
+    rng = random.Random(seed)
+    reset_world(seed, count, spawn_interval)
+    cars = SpatialHashGroup()
+    traffic = None
+    if engine == 'vector':
+        traffic = VectorTraffic(sim.simulation_bounds, sim.spawn_intervals, max_cars=count)
+        populate_vector(traffic, count, rng)
+    else:
+        populate_sprites(cars, count, rng)
+    return cars, traffic
+
+
+def run_ticks(cars, traffic, pattern, ticks, tick_times=None):
+    """The headless loop from main.run_headless, with the lights driven by `pattern`. Returns mean car count."""
+    cleanup_every = max(1, int(sim.cleanup_interval * STEPS_PER_SECOND))
+    population = 0
+    for tick in range(1, ticks + 1):
+        start = time.perf_counter()
+        lights = lights_for(pattern, tick)
+        if tick % cleanup_every == 0:
+            if traffic is not None:
+                traffic.cleanup_stalled(lights)
+            else:
+                sim.cleanup_stalled_cars(cars, lights)
+        sim.simulation_step(cars, traffic, lights)
+        if tick_times is not None:
+            tick_times.append(time.perf_counter() - start)
+        population += len(traffic) if traffic is not None else len(cars)
+    return population / ticks
+
+
+def run_scenario(engine, count, pattern, spawn_interval, ticks, memory_ticks, seed):
+    cars, traffic = build(engine, count, spawn_interval, seed)
+    initial = len(traffic) if traffic is not None else len(cars)
+    tick_times = []
+    mean_cars = run_ticks(cars, traffic, pattern, ticks, tick_times)
+    final = len(traffic) if traffic is not None else len(cars)
+    moving = traffic.moving_count() if traffic is not None else sum(1 for car in cars if car.moving)
+    elapsed = sum(tick_times)
+
+    # Peak memory of building the scenario and running it, on a fresh world
+    del cars, traffic
+    tracemalloc.start()
+    cars, traffic = build(engine, count, spawn_interval, seed)
+    run_ticks(cars, traffic, pattern, memory_ticks)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        'engine': engine,
+        'cars': initial,
+        'cars_target': count,
+        'cars_mean': round(mean_cars, 1),
+        'cars_final': final,
+        'moving_final': moving,
+        'lights': pattern,
+        'spawn_interval': spawn_interval,
+        'ticks': ticks,
+        'ticks_per_second': ticks / elapsed if elapsed > 0 else float('inf'),
+        'ms_per_tick_mean': elapsed / ticks * 1000,
+        'ms_per_tick_p95': float(np.percentile(tick_times, 95) * 1000),
+        'peak_memory_bytes': peak,
+    }
+
+
+def scenario_key(result):
+    return (result['engine'], result['cars'], result['lights'], result['spawn_interval'])
+
+
+def compare(results, baseline_path, tolerance):
+    """Print scenarios whose ticks/s fell more than `tolerance` below the baseline. Returns their count."""
+    with open(baseline_path) as f:
+        baseline = {scenario_key(result): result for result in json.load(f)['results']}
+    regressions = 0
+    for result in results:
+        before = baseline.get(scenario_key(result))
+        if before is None:
+            continue
+        ratio = result['ticks_per_second'] / before['ticks_per_second']
+        if ratio < 1 - tolerance:
+            regressions += 1
+            print(f"REGRESSION {'/'.join(map(str, scenario_key(result)))}: "
+                  f"{before['ticks_per_second']:.0f} -> {result['ticks_per_second']:.0f} ticks/s ({ratio:.0%})",
+                  file=sys.stderr)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the simulation pipeline')
+    parser.add_argument('--engines', nargs='+', choices=['sprite', 'vector'], default=['sprite', 'vector'])
+    parser.add_argument('--counts', type=int, nargs='+', default=[100, 1000], help='Car counts to test; capped at what the lanes hold')
+    parser.add_argument('--lights', nargs='+', choices=LIGHT_PATTERNS, default=list(LIGHT_PATTERNS),
+                        help='Traffic light patterns to test')
+    parser.add_argument('--spawn-intervals', type=int, nargs='+', default=[60, 5],
+                        help='Frames between spawns in each direction')
+    parser.add_argument('--ticks', type=int, default=200, help='Ticks to time per scenario')
+    parser.add_argument('--memory-ticks', type=int, default=30, help='Ticks to run under tracemalloc')
+    parser.add_argument('--sprite-limit', type=int, default=1000,
+                        help='Skip the sprite engine above this many cars (one crossroad holds a few hundred)')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', help='Write the JSON results here instead of stdout')
+    parser.add_argument('--baseline', help='Earlier JSON results to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.1,
+                        help='Allowed ticks/s drop against the baseline before a scenario counts as a regression')
+    args = parser.parse_args()
+
+    pygame.init()
+    pygame.display.set_mode((1, 1))
+
+    results = []
+    print(f"{'engine':>7} {'cars':>6} {'mean':>7} {'lights':>12} {'spawn':>5} {'ticks/s':>9} {'p95 ms':>7} {'peak MB':>8}",
+          file=sys.stderr)
+    for engine in args.engines:
+        placed = set()
+        for count in args.counts:
+            if engine == 'sprite' and count > args.sprite_limit:
+                continue
+            initial = initial_cars(count)
+            if initial in placed:
+                print(f"{engine:>7} {count:>6}: skipped, the lanes only hold {initial} cars", file=sys.stderr)
+                continue
+            placed.add(initial)
+            for pattern in args.lights:
+                for spawn_interval in args.spawn_intervals:
+                    result = run_scenario(engine, count, pattern, spawn_interval, args.ticks, args.memory_ticks, args.seed)
+                    results.append(result)
+                    print(f"{engine:>7} {result['cars']:>6} {result['cars_mean']:>7.0f} {pattern:>12} {spawn_interval:>5} "
+                          f"{result['ticks_per_second']:>9.0f} {result['ms_per_tick_p95']:>7.2f} "
+                          f"{result['peak_memory_bytes'] / 1e6:>8.1f}", file=sys.stderr)
+
+    report = {
+        'benchmark': 'simulation',
+        'created': datetime.now().isoformat(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'numpy': np.__version__,
+        'pygame': pygame.version.ver,
+        'settings': {'ticks': args.ticks, 'memory_ticks': args.memory_ticks, 'seed': args.seed},
+        'results': results,
+    }
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+
+    regressions = compare(results, args.baseline, args.tolerance) if args.baseline else 0
+    pygame.quit()
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == '__main__':
+    main()
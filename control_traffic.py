@@ -6,6 +6,8 @@ import sys
 from datetime import datetime
 from typing import Dict, List, Optional, Any, Union
 from colorama import init, Fore, Style
+from http_client import shared_client, CircuitOpenError
+from settings import pattern_lights, migrate_light_ids
 
 # Initialize colorama for cross-platform colored terminal text
 init()
@@ -17,6 +19,7 @@ class TrafficControlSystem:
     def __init__(self):
         self.config_file = "traffic_config.json"
         self.load_config()
+        self.client = shared_client(self.config['server_url'], timeout=(1.0, self.config.get('timeout', 5)))
         
     def load_config(self):
         """Load configuration from file or use defaults"""
@@ -25,41 +28,28 @@ class TrafficControlSystem:
                 with open(self.config_file, 'r') as f:
                     self.config = json.load(f)
                     print(f"{Fore.GREEN}Configuration loaded from {self.config_file}{Style.RESET_ALL}")
+                # Patterns saved with the old 0..3 light numbering would be refused by the server
+                patterns = self.config.get('patterns', {})
+                migrated = {name: migrate_light_ids(lights) for name, lights in patterns.items()}
+                if any(migrated[name] is not patterns[name] for name in patterns):
+                    self.config['patterns'] = migrated
+                    self.save_config()
             else:
                 self.config = {
                     "server_url": BASE_URL,
                     "refresh_rate": 2,
+                    "timeout": 5,
                     "auto_mode": False,
                     "patterns": {
-                        "normal": [
-                            {"id": 0, "red": False, "yellow": False, "green": True},
-                            {"id": 1, "red": False, "yellow": False, "green": True},
-                            {"id": 2, "red": True, "yellow": False, "green": False},
-                            {"id": 3, "red": True, "yellow": False, "green": False}
-                        ],
-                        "north_south_priority": [
-                            {"id": 0, "red": False, "yellow": False, "green": True},
-                            {"id": 1, "red": False, "yellow": False, "green": True},
-                            {"id": 2, "red": True, "yellow": False, "green": False},
-                            {"id": 3, "red": True, "yellow": False, "green": False}
-                        ],
-                        "east_west_priority": [
-                            {"id": 0, "red": True, "yellow": False, "green": False},
-                            {"id": 1, "red": True, "yellow": False, "green": False},
-                            {"id": 2, "red": False, "yellow": False, "green": True},
-                            {"id": 3, "red": False, "yellow": False, "green": True}
-                        ],
-                        "all_red": [
-                            {"id": 0, "red": True, "yellow": False, "green": False},
-                            {"id": 1, "red": True, "yellow": False, "green": False},
-                            {"id": 2, "red": True, "yellow": False, "green": False},
-                            {"id": 3, "red": True, "yellow": False, "green": False}
-                        ]
+                        "normal": pattern_lights(('up', 'down')),
+                        "north_south_priority": pattern_lights(('up', 'down')),
+                        "east_west_priority": pattern_lights(('left', 'right')),
+                        "all_red": pattern_lights(())
                     }
                 }
         except Exception as e:
             print(f"{Fore.RED}Error loading configuration: {e}{Style.RESET_ALL}")
-            self.config = {"server_url": BASE_URL, "refresh_rate": 2, "auto_mode": False}
+            self.config = {"server_url": BASE_URL, "refresh_rate": 2, "timeout": 5, "auto_mode": False}
 
     def save_config(self):
         """Save configuration to file"""
@@ -75,15 +65,18 @@ class TrafficControlSystem:
         url = f"{self.config['server_url']}/{endpoint}"
         try:
             if method.lower() == "get":
-                response = requests.get(url, timeout=5)
+                response = self.client.get(endpoint)
             elif method.lower() == "post":
-                response = requests.post(url, json=data, timeout=5)
+                response = self.client.post(endpoint, json=data)
             else:
                 print(f"{Fore.RED}Invalid method: {method}{Style.RESET_ALL}")
                 return None
                 
             response.raise_for_status()  # Raise exception for 4XX/5XX responses
             return response.json()
+        except CircuitOpenError:
+            print(f"{Fore.RED}Server at {self.config['server_url']} is unavailable, skipping request{Style.RESET_ALL}")
+            return None
         except requests.exceptions.ConnectionError:
             print(f"{Fore.RED}Connection error: Could not connect to {url}{Style.RESET_ALL}")
             return None
@@ -102,7 +95,10 @@ class TrafficControlSystem:
 
     def get_accident_status(self) -> None:
         """Get and display the current accident status"""
-        accident_info = self.api_request("get", "check-accident")
+        self.display_accident_status(self.api_request("get", "check-accident"))
+
+    def display_accident_status(self, accident_info: Optional[Dict[str, Any]]) -> None:
+        """Format and display the accident status"""
         if accident_info:
             status = "YES - ALERT!" if accident_info["is_accident"] else "No"
             color = Fore.RED if accident_info["is_accident"] else Fore.GREEN
@@ -113,6 +109,11 @@ class TrafficControlSystem:
     def get_lane_counters(self) -> Optional[Dict[str, int]]:
         """Get the current lane counters"""
         counters = self.api_request("get", "lane-counters")
+        self.display_lane_counters(counters)
+        return counters
+
+    def display_lane_counters(self, counters: Optional[Dict[str, int]]) -> None:
+        """Format and display lane counters"""
         if counters:
             print(f"{Fore.CYAN}Lane Counters:{Style.RESET_ALL}")
             print(f"  Top: {counters['top']}")
@@ -120,7 +121,6 @@ class TrafficControlSystem:
             print(f"  Left: {counters['left']}")
             print(f"  Right: {counters['right']}")
             print(f"  Total: {sum(counters.values())}")
-        return counters
 
     def update_lane_counters(self) -> None:
         """Update lane counters with user input"""
@@ -216,8 +216,8 @@ class TrafficControlSystem:
             print(f"{Fore.RED}Invalid input. Light ID must be a number.{Style.RESET_ALL}")
 
     def log_accident(self) -> None:
-        """Get accident logs"""
-        response = self.api_request("get", "log-accident")
+        """Get the most recent accident logs"""
+        response = self.api_request("get", "log-accident?newest_first=true&limit=20")
         if response:
             print(f"\n{Fore.CYAN}Accident Logs:{Style.RESET_ALL}")
             for entry in response:
@@ -237,11 +237,11 @@ class TrafficControlSystem:
         pattern = self.config['patterns'][pattern_name]
         print(f"{Fore.YELLOW}Applying traffic pattern: {pattern_name}{Style.RESET_ALL}")
         
-        for light_config in pattern:
-            result = self.api_request("post", "traffic-lights", light_config)
-            if not result:
-                print(f"{Fore.RED}Failed to update light {light_config['id']}{Style.RESET_ALL}")
-                return
+        # One atomic update, so the simulator never sees a half-applied pattern
+        result = self.api_request("post", "traffic-lights/batch", {"lights": pattern})
+        if not result:
+            print(f"{Fore.RED}Failed to apply pattern {pattern_name}{Style.RESET_ALL}")
+            return
         
         # Verify the changes
         self.get_traffic_lights()
@@ -302,9 +302,12 @@ class TrafficControlSystem:
         print(f"  Server: {self.config['server_url']}")
         print(f"  Auto-mode: {'ON' if self.config.get('auto_mode', False) else 'OFF'}")
         
-        self.get_accident_status()
-        self.get_lane_counters()
-        self.get_traffic_lights()
+        # One consistent snapshot instead of a request per section
+        snapshot = self.api_request("get", "snapshot?fields=safety,lane_counters,traffic_lights")
+        if snapshot:
+            self.display_accident_status(snapshot["safety"])
+            self.display_lane_counters(snapshot["lane_counters"])
+            self.display_traffic_lights(snapshot["traffic_lights"])
         
         print(f"\n{Fore.CYAN}{'=' * 60}{Style.RESET_ALL}")
 
@@ -1,5 +1,30 @@
 import pygame
 from settings import *
+from lanes import idm_acceleration, STOPPED_SPEED
+
+
+# Road layout used when spawning cars: 4 lanes in total, 2 per direction
+ROAD_WIDTH = 50
+LANE_WIDTH = ROAD_WIDTH // 4
+
+
+def lane_position(direction, lane_number):
+    """
+    Cross-axis position of a lane (x for vertical traffic, y for horizontal)
+    for a spawn direction and lane number 1 or 2.
+    """
+    if direction in ['up-down', 'down-up']:
+        lane_base_left = width // 2 - ROAD_WIDTH // 2 + LANE_WIDTH * (lane_number - 1)
+        lane_base_right = width // 2 + ROAD_WIDTH // 2 - LANE_WIDTH * lane_number
+        if direction == 'up-down':
+            return lane_base_left + LANE_WIDTH // 2 - 14
+        return lane_base_right + LANE_WIDTH // 2
+    else:
+        lane_base_top = height // 2 - ROAD_WIDTH // 2 + LANE_WIDTH * (lane_number - 1)
+        lane_base_bottom = height // 2 + ROAD_WIDTH // 2 - LANE_WIDTH * lane_number
+        if direction == 'left-right':
+            return lane_base_bottom + LANE_WIDTH // 2
+        return lane_base_top + LANE_WIDTH // 2 - 10
 
 
 class Car(pygame.sprite.Sprite):
@@ -20,7 +45,102 @@ class Car(pygame.sprite.Sprite):
         self.image.fill(color)
         self.rect = self.image.get_rect(topleft=(x, y))
 
-    def update(self, cars):
+        # Car-following state, used once the car joins a Lane. Speed along the
+        # lane is in px/s, and the position along the travel axis is kept as a
+        # float so slow cars still creep forward between whole pixels.
+        self.lane = None
+        self.leader = None
+        self.follower = None
+        self.velocity = abs(speed) * STEPS_PER_SECOND
+        self.position = float(x if direction == 'horizontal' else y)
+
+    def remove_internal(self, group):
+        super().remove_internal(group)
+        # Leaving its last group means the car is gone, so close the gap in its lane
+        if self.lane is not None and not self.groups():
+            self.lane.remove(self)
+
+    def kill(self):
+        # Sprite.kill bypasses remove_internal, so unlink from the lane here too
+        super().kill()
+        if self.lane is not None:
+            self.lane.remove(self)
+
+    def length(self):
+        return self.rect.width if self.direction == 'horizontal' else self.rect.height
+
+    def front_progress(self):
+        """Leading edge along the lane, in units that grow in the direction of travel."""
+        if self.speed > 0:
+            return self.position + self.length()
+        return -self.position
+
+    def rear_progress(self):
+        """Trailing edge along the lane, in the same units as front_progress."""
+        if self.speed > 0:
+            return self.position
+        return -(self.position + self.length())
+
+    def gap_to_leader(self):
+        """Free road to the car ahead in the lane, or None if there is none."""
+        if self.leader is None:
+            return None
+        return self.leader.rear_progress() - self.front_progress()
+
+    def follow(self, cars, dt):
+        """
+        Car-following step: the Intelligent Driver Model picks an acceleration
+        from the gap to the leader or to a red stop line, whichever is closer.
+        Only the leader and the lane are looked at, so this is O(1) per car.
+        """
+        front = self.front_progress()
+        gap, approach_rate = None, 0.0
+        if self.leader is not None:
+            gap = self.leader.rear_progress() - front
+            approach_rate = self.velocity - self.leader.velocity
+        stop_line = self.lane.stop_line
+        if stop_line is not None and front <= stop_line:
+            stop_gap = stop_line - front
+            if gap is None or stop_gap < gap:
+                gap, approach_rate = stop_gap, self.velocity
+
+        acceleration = idm_acceleration(self.velocity, abs(self.speed) * STEPS_PER_SECOND, gap, approach_rate)
+        self.velocity = max(0.0, self.velocity + acceleration * dt)
+        advance = self.velocity * dt
+        if gap is not None and advance > gap:
+            # Never run into the leader or over the stop line within one tick
+            advance = max(0.0, gap)
+            self.velocity = advance / dt
+
+        original_position, original_rect = self.position, self.rect.copy()
+        self.position += advance if self.speed > 0 else -advance
+        if self.direction == 'horizontal':
+            self.rect.x = round(self.position)
+        else:
+            self.rect.y = round(self.position)
+
+        # Spacing within the lane is handled above, so only other lanes' cars can block the move
+        if self.rect != original_rect:
+            if hasattr(cars, 'colliding'):
+                blocked = [s for s in cars.colliding(self) if s.lane is not self.lane]
+            else:
+                blocked = [s for s in cars if s is not self and s.lane is not self.lane and self.rect.colliderect(s.rect)]
+            if blocked:
+                self.position, self.rect = original_position, original_rect
+                self.velocity = 0.0
+            elif hasattr(cars, 'relocate'):
+                cars.relocate(self)
+
+        self.moving = self.velocity > STOPPED_SPEED
+
+        if self.is_out_of_bounds(width, height):
+            self.kill()
+
+    def update(self, cars, dt=SIM_DT):
+        if self.lane is not None:
+            self.follow(cars, dt)
+            return
+
         if self.moving:
             original_position = self.rect.copy()
 
@@ -34,9 +154,15 @@ class Car(pygame.sprite.Sprite):
             def collided_except_self(sprite, group):
                 return [s for s in group if s != sprite and pygame.sprite.collide_rect(sprite, s)]
 
-            collision_sprites = collided_except_self(self, cars)
+            # A spatial hash group only hands back neighbouring cars
+            if hasattr(cars, 'colliding'):
+                collision_sprites = cars.colliding(self)
+            else:
+                collision_sprites = collided_except_self(self, cars)
             if collision_sprites:
                 self.rect = original_position  # Revert to the original position if collision
+            elif hasattr(cars, 'relocate'):
+                cars.relocate(self)  # Keep the grid cells in sync with the new position
             
             # Check bounds
             if self.is_out_of_bounds(width, height):
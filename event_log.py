@@ -0,0 +1,125 @@
+"""
+Recording and reading of simulation runs. A run is its settings plus every
+input that is not derived from the simulation itself: the cars spawned (lane
+and colour), the traffic light changes and the stall cleanups. Removals and a
+periodic state checksum are recorded too, so a replay can tell where it stops
+matching the original run.
+
+The log is gzip-compressed JSON lines, one event per line, with one-letter
+types in "t" like the telemetry frames. Every event but the header carries its
+simulation step ("frame") number in "f":
+
+    {"t":"H","v":1,"seed":7,"engine":"sprite","max_cars":100,"steps_per_second":60,"lights":[...]}
+    {"t":"s","f":60,"d":0,"n":2,"c":[12,200,31]}   spawn: direction code, lane number, colour
+    {"t":"L","f":95,"l":[[1,4],[2,1]]}             light change, as [id, bits] pairs
+    {"t":"c","f":300}                              stall cleanup
+    {"t":"r","f":301,"n":2}                        cars removed during the frame
+    {"t":"k","f":360,"h":2735402521}               state checksum after the frame
+    {"t":"e","f":7200}                             end of the run, after its last frame
+"""
+import gzip
+import json
+from collections import defaultdict
+
+from telemetry import light_bits, apply_light_bits
+from vector_engine import SPAWN_DIRECTIONS
+
+LOG_VERSION = 1
+# Frames between state checksums
+CHECKSUM_INTERVAL = 60
+
+
+class EventRecorder:
+    def __init__(self, path, seed, engine, max_cars, steps_per_second, lights, **settings):
+        self.file = gzip.open(path, 'wt', encoding='utf-8')
+        self.frame = 0
+        self._light_bits = {light['id']: light_bits(light) for light in lights}
+        self._write({'t': 'H', 'v': LOG_VERSION, 'seed': seed, 'engine': engine, 'max_cars': max_cars,
+                     'steps_per_second': steps_per_second, 'lights': lights, **settings})
+
+    def _write(self, event):
+        self.file.write(json.dumps(event, separators=(',', ':')) + '\n')
+
+    def start_frame(self, frame):
+        self.frame = frame
+
+    def spawn(self, direction, lane_number, color):
+        self._write({'t': 's', 'f': self.frame, 'd': SPAWN_DIRECTIONS.index(direction), 'n': lane_number,
+                     'c': [int(c) for c in color]})
+
+    def lights(self, lights):
+        """Record the lights used this frame if they differ from the last recorded ones."""
+        changed = []
+        for light in lights:
+            bits = light_bits(light)
+            if self._light_bits.get(light['id']) != bits:
+                self._light_bits[light['id']] = bits
+                changed.append([light['id'], bits])
+        if changed:
+            self._write({'t': 'L', 'f': self.frame, 'l': changed})
+
+    def cleanup(self):
+        self._write({'t': 'c', 'f': self.frame})
+
+    def removed(self, count):
+        if count:
+            self._write({'t': 'r', 'f': self.frame, 'n': count})
+
+    def checksum(self, value):
+        self._write({'t': 'k', 'f': self.frame, 'h': value})
+
+    def close(self):
+        if self.file is not None:
+            # The last frames may have no events, so the length of the run is written out
+            self._write({'t': 'e', 'f': self.frame})
+            self.file.close()
+            self.file = None
+
+
+class FrameEvents:
+    """What happened in one recorded frame."""
+
+    def __init__(self):
+        self.spawns = []  # (direction, lane number, colour)
+        self.light_changes = None
+        self.cleanup = False
+        self.removed = 0
+        self.checksum = None
+
+
+class EventLog:
+    """A recorded run, read back for replay: the header plus events grouped by frame."""
+
+    def __init__(self, path):
+        self.frames = defaultdict(FrameEvents)
+        end = None
+        with gzip.open(path, 'rt', encoding='utf-8') as f:
+            self.header = json.loads(f.readline())
+            if self.header.get('t') != 'H' or self.header.get('v') != LOG_VERSION:
+                raise ValueError(f"{path} is not a version {LOG_VERSION} simulation event log")
+            for line in f:
+                if not line.strip():
+                    continue
+                event = json.loads(line)
+                kind = event['t']
+                if kind == 'e':
+                    end = event['f']
+                    continue
+                frame = self.frames[event['f']]
+                if kind == 's':
+                    frame.spawns.append((SPAWN_DIRECTIONS[event['d']], event['n'], tuple(event['c'])))
+                elif kind == 'L':
+                    frame.light_changes = event['l']
+                elif kind == 'c':
+                    frame.cleanup = True
+                elif kind == 'r':
+                    frame.removed = event['n']
+                elif kind == 'k':
+                    frame.checksum = event['h']
+        # A log cut short (the recording process was killed) has no end record
+        self.last_frame = end if end is not None else max(self.frames, default=0)
+
+    def lights(self, lights, frame):
+        """The lights in effect during `frame`, given those of the frame before."""
+        changes = self.frames[frame].light_changes if frame in self.frames else None
+        return apply_light_bits(lights, changes) if changes else lights
@@ -0,0 +1,135 @@
+import threading
+import time
+
+import numpy as np
+
+from telemetry import GREEN
+
+# (seconds per bucket, buckets kept): 6 hours of seconds, 14 days of minutes, a year of hours
+DEFAULT_TIERS = ((1, 6 * 3600), (60, 14 * 24 * 60), (3600, 365 * 24))
+
+
+class Tier:
+    """
+    One resolution of the history: fixed-size arrays used as a ring buffer.
+    Bucket n (covering [n * resolution, (n + 1) * resolution) in epoch
+    seconds) lives in slot n % capacity, and `stamps` records which bucket a
+    slot holds, so stale slots are recognised without ever clearing them.
+    """
+
+    def __init__(self, resolution, capacity, lane_count, light_count):
+        self.resolution = resolution
+        self.capacity = capacity
+        self.stamps = np.full(capacity, -1, dtype=np.int64)
+        self.counts = np.zeros((capacity, lane_count), dtype=np.int64)
+        self.green = np.zeros((capacity, light_count), dtype=np.int32)   # seconds of green
+        self.lights = np.zeros((capacity, light_count), dtype=np.uint8)  # light bits at the last sample
+
+    def add(self, now, counts, lights, green):
+        bucket = int(now) // self.resolution
+        slot = bucket % self.capacity
+        if self.stamps[slot] != bucket:
+            self.stamps[slot] = bucket
+            self.counts[slot] = 0
+            self.green[slot] = 0
+        self.counts[slot] += counts
+        self.green[slot] += green
+        self.lights[slot] = lights
+
+    def query(self, start, end):
+        """Rows for the buckets in [start, end) that were recorded, oldest first."""
+        first = int(start) // self.resolution
+        last = -(-int(end) // self.resolution)  # ceiling division
+        first = max(first, last - self.capacity)
+        buckets = np.arange(first, last, dtype=np.int64)
+        slots = buckets % self.capacity
+        present = self.stamps[slots] == buckets
+        slots = slots[present]
+        return buckets[present] * self.resolution, self.counts[slots], self.green[slots], self.lights[slots]
+
+
+class ThroughputHistory:
+    """
+    Lane throughput and light states over time in fixed memory. Request
+    handlers call add() with the cars they count; a sampler thread closes one
+    second at a time and adds it, with the current light states, to every
+    tier, so the coarser tiers are rolled up as the data arrives rather than
+    by a later pass over raw events.
+    """
+
+    def __init__(self, lanes, light_ids, light_states, tiers=DEFAULT_TIERS):
+        self.lanes = list(lanes)
+        self.light_ids = list(light_ids)
+        self.light_states = light_states  # callable returning the light bits in light_ids order
+        self.tiers = [Tier(resolution, capacity, len(self.lanes), len(self.light_ids))
+                      for resolution, capacity in tiers]
+        self._pending = np.zeros(len(self.lanes), dtype=np.int64)
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._thread = None
+
+    def add(self, increments):
+        """Count cars, e.g. {'top': 2}, towards the current second."""
+        with self._lock:
+            for lane, count in increments.items():
+                if count:
+                    self._pending[self.lanes.index(lane)] += count
+
+    def start(self):
+        if self._thread is None:
+            self._stopping.clear()
+            self._thread = threading.Thread(target=self._run, name="history", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stopping.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.sample()
+
+    def _run(self):
+        # Wake just after each second boundary
+        while not self._stopping.wait(1.0 - time.time() % 1.0 + 0.001):
+            self.sample(time.time() - 0.5)
+
+    def sample(self, now=None):
+        """Close the current second: add its counts and the light states to every tier."""
+        now = time.time() if now is None else now
+        lights = np.array(self.light_states(), dtype=np.uint8)
+        green = (lights & GREEN != 0).astype(np.int32)
+        with self._lock:
+            counts, self._pending = self._pending, np.zeros_like(self._pending)
+            for tier in self.tiers:
+                tier.add(now, counts, lights, green)
+
+    def resolutions(self):
+        return [tier.resolution for tier in self.tiers]
+
+    def retention(self, resolution):
+        """Seconds of history kept at `resolution`."""
+        tier = self._tier(resolution)
+        return tier.resolution * tier.capacity
+
+    def _tier(self, resolution):
+        for tier in self.tiers:
+            if tier.resolution == resolution:
+                return tier
+        raise ValueError(f"No history kept at {resolution}s resolution")
+
+    def query(self, start, end, resolution):
+        """
+        Buckets between epoch seconds `start` and `end` at `resolution`
+        seconds, as columns: bucket start times, cars per lane, seconds each
+        light was green and each light's state at the end of the bucket.
+        """
+        tier = self._tier(resolution)
+        with self._lock:
+            stamps, counts, green, lights = tier.query(start, end)
+        return {
+            "resolution": resolution,
+            "timestamps": stamps.tolist(),
+            "counts": {lane: counts[:, i].tolist() for i, lane in enumerate(self.lanes)},
+            "green_seconds": {str(light_id): green[:, i].tolist() for i, light_id in enumerate(self.light_ids)},
+            "lights": {str(light_id): lights[:, i].tolist() for i, light_id in enumerate(self.light_ids)},
+        }
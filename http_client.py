@@ -0,0 +1,187 @@
+import copy
+import random
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import NewConnectionError
+
+
+class CircuitOpenError(requests.exceptions.ConnectionError):
+    """Raised instead of making a request while the circuit breaker is open."""
+
+
+class CircuitBreaker:
+    """
+    Fails fast after repeated failures. After `failure_threshold` failed calls
+    in a row the circuit opens and calls are refused for `reset_timeout`
+    seconds; then a single trial call is let through, and its result closes
+    the circuit again or re-opens it. A trial that ends without a result
+    must release its slot with end_trial(), or no call would ever be let
+    through again.
+    """
+
+    def __init__(self, failure_threshold=3, reset_timeout=5.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self.trial_in_flight = False
+        self._trial_thread = None
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        with self._lock:
+            if self.opened_at is None:
+                return "closed"
+            if time.monotonic() - self.opened_at >= self.reset_timeout:
+                return "half-open"
+            return "open"
+
+    def allow(self):
+        with self._lock:
+            if self.opened_at is None:
+                return True
+            if time.monotonic() - self.opened_at < self.reset_timeout or self.trial_in_flight:
+                return False
+            self.trial_in_flight = True
+            self._trial_thread = threading.get_ident()
+            return True
+
+    def end_trial(self):
+        """Free the trial slot if this thread's trial call is still holding it."""
+        with self._lock:
+            if self.trial_in_flight and self._trial_thread == threading.get_ident():
+                self.trial_in_flight = False
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self.trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self.trial_in_flight = False
+            if self.opened_at is not None or self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+
+
+def never_sent(error):
+    """True when a request failed before any of it could reach the server."""
+    if isinstance(error, requests.exceptions.ConnectTimeout):
+        return True
+    if not isinstance(error, requests.exceptions.ConnectionError):
+        return False
+    # requests wraps urllib3's MaxRetryError, whose reason is the underlying failure
+    for cause in (error.args[0] if error.args else None, error.__context__):
+        if isinstance(getattr(cause, 'reason', cause), NewConnectionError):
+            return True
+    return False
+
+
+class ApiClient:
+    """
+    HTTP client for the traffic server shared by the simulator and the control
+    clients: one keep-alive connection pool per server, (connect, read)
+    timeouts on every call, jittered retries for transient failures, and a
+    circuit breaker so a downed server costs nothing per call.
+    """
+
+    # Gateway errors are worth retrying; anything else is the server's final answer
+    RETRY_STATUSES = {502, 503, 504}
+
+    def __init__(self, base_url, timeout=(1.0, 5.0), retries=2, backoff=0.1, pool_size=10, breaker=None):
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.breaker = breaker or CircuitBreaker()
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def request(self, method, endpoint, json=None, timeout=None, retries=None, **kwargs):
+        """
+        Send a request and return the response. Connection failures and
+        timeouts raise the usual requests exceptions after retrying; while the
+        breaker is open, CircuitOpenError is raised without touching the network.
+        POSTs are only retried when the request never left this machine (the
+        connection was refused or timed out), so a request the server may have
+        processed is not sent twice.
+        """
+        if not self.breaker.allow():
+            raise CircuitOpenError(f"Circuit open for {self.base_url}, not sending {method.upper()} /{endpoint}")
+
+        url = f"{self.base_url}/{endpoint.lstrip('/')}"
+        attempts = 1 + (self.retries if retries is None else retries)
+        idempotent = method.lower() in ("get", "head", "options")
+        try:
+            for attempt in range(attempts):
+                last_attempt = attempt == attempts - 1
+                try:
+                    response = self.session.request(method, url, json=json, timeout=timeout or self.timeout, **kwargs)
+                except requests.exceptions.RequestException as e:
+                    if idempotent:
+                        retryable = isinstance(e, (requests.exceptions.ConnectionError, requests.exceptions.Timeout))
+                    else:
+                        retryable = never_sent(e)
+                    if last_attempt or not retryable:
+                        self.breaker.record_failure()
+                        raise
+                else:
+                    if response.status_code not in self.RETRY_STATUSES or last_attempt:
+                        if response.status_code >= 500:
+                            self.breaker.record_failure()
+                        else:
+                            self.breaker.record_success()
+                        return response
+                # Full jitter keeps many clients from retrying in lockstep
+                time.sleep(random.uniform(0, self.backoff * 2 ** attempt))
+        finally:
+            # Any other exception (a bad URL or payload, an interrupt) still ends a half-open trial
+            self.breaker.end_trial()
+
+    def with_options(self, timeout=None, retries=None, backoff=None):
+        """A client with its own timeout, retries and backoff sharing this one's connection pool and breaker."""
+        client = copy.copy(self)
+        if timeout is not None:
+            client.timeout = timeout
+        if retries is not None:
+            client.retries = retries
+        if backoff is not None:
+            client.backoff = backoff
+        return client
+
+    def get(self, endpoint, **kwargs):
+        return self.request("get", endpoint, **kwargs)
+
+    def post(self, endpoint, json=None, **kwargs):
+        return self.request("post", endpoint, json=json, **kwargs)
+
+    def close(self):
+        self.session.close()
+
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def shared_client(base_url, timeout=None, retries=None, backoff=None):
+    """
+    An ApiClient for a server that shares the process-wide connection pool
+    and circuit breaker for it, created on first use, so every caller in a
+    process shares them. Each caller's timeout, retries and backoff apply to
+    its own requests only.
+    """
+    key = base_url.rstrip("/")
+    with _clients_lock:
+        client = _clients.get(key)
+        if client is None:
+            client = _clients[key] = ApiClient(key)
+    return client.with_options(timeout=timeout, retries=retries, backoff=backoff)
@@ -0,0 +1,95 @@
+import threading
+import uuid
+from datetime import datetime
+
+
+class IncidentTracker:
+    """
+    Turns edge-triggered reports into incidents. The first "active" report of
+    a kind opens an incident; further active reports only raise its peak
+    severity. An "inactive" report starts a `debounce` second countdown, and
+    the incident is only closed (and handed to `on_close`) if it is not
+    re-activated in the meantime, so a flapping condition yields one incident
+    instead of many.
+    """
+
+    def __init__(self, on_close, debounce=2.0):
+        self.on_close = on_close  # called with the finished incident dict
+        self.debounce = debounce
+        self._lock = threading.Lock()
+        self._open = {}    # kind -> incident
+        self._timers = {}  # kind -> pending close
+
+    def report(self, kind, active, severity=1, message="", source=None):
+        """Record a state transition. Returns a copy of the affected incident, or None."""
+        now = datetime.now()
+        with self._lock:
+            incident = self._open.get(kind)
+            if active:
+                timer = self._timers.pop(kind, None)
+                if timer is not None:
+                    timer.cancel()  # Came back within the debounce window: same incident
+                if incident is None:
+                    incident = self._open[kind] = {
+                        'id': uuid.uuid4().hex[:12],
+                        'kind': kind,
+                        'message': message,
+                        'started': now.isoformat(),
+                        'ended': None,
+                        'duration': None,
+                        'peak_severity': severity,
+                        'reports': 0,
+                        'sources': [],
+                    }
+                incident['ended'] = None
+                incident['peak_severity'] = max(incident['peak_severity'], severity)
+                incident['reports'] += 1
+                if message and not incident['message']:
+                    incident['message'] = message
+            elif incident is not None and kind not in self._timers:
+                incident['ended'] = now.isoformat()
+                timer = self._timers[kind] = threading.Timer(self.debounce, lambda: self._close(kind, timer))
+                timer.daemon = True
+                timer.start()
+            if incident is None:
+                return None
+            if source and source not in incident['sources']:
+                incident['sources'].append(source)
+            return dict(incident, sources=list(incident['sources']))
+
+    def current(self):
+        """Copies of the incidents that are open or waiting out their debounce."""
+        with self._lock:
+            return [dict(incident, sources=list(incident['sources'])) for incident in self._open.values()]
+
+    def close_all(self):
+        """Close every incident now, e.g. on shutdown."""
+        with self._lock:
+            for timer in self._timers.values():
+                timer.cancel()
+            self._timers.clear()
+            kinds = list(self._open)
+        for kind in kinds:
+            self._close(kind)
+
+    def clear(self):
+        """Drop every incident without closing it, and cancel pending closes, e.g. on a reset."""
+        with self._lock:
+            for timer in self._timers.values():
+                timer.cancel()
+            self._timers.clear()
+            self._open.clear()
+
+    def _close(self, kind, timer=None):
+        with self._lock:
+            if timer is not None and self._timers.get(kind) is not timer:
+                return  # Re-activated while this timer was firing
+            self._timers.pop(kind, None)
+            incident = self._open.pop(kind, None)
+        if incident is None:
+            return
+        if incident['ended'] is None:
+            incident['ended'] = datetime.now().isoformat()
+        started = datetime.fromisoformat(incident['started'])
+        incident['duration'] = (datetime.fromisoformat(incident['ended']) - started).total_seconds()
+        self.on_close(incident)
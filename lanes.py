@@ -0,0 +1,101 @@
+from settings import STEPS_PER_SECOND
+
+# Intelligent Driver Model parameters, in pixels and seconds
+DESIRED_SPEED = 2 * STEPS_PER_SECOND  # The old fixed 2 px per step
+MAX_ACCELERATION = 120.0          # Reaches cruising speed in about a second
+COMFORTABLE_DECELERATION = 240.0
+MIN_GAP = 6.0                     # Bumper-to-bumper gap kept when stopped
+TIME_HEADWAY = 0.4                # Seconds of travel kept to the car ahead
+ACCELERATION_EXPONENT = 4
+
+# Below this speed (px/s) a car counts as stopped
+STOPPED_SPEED = 1.0
+# A car this close (px) behind its leader is held up by the queue, not stuck:
+# when a queue is released it only pulls away once the gap opens up
+QUEUED_GAP = 2 * MIN_GAP
+
+# Which traffic light gates each spawn direction
+LIGHT_FOR_DIRECTION = {'up-down': 'up', 'down-up': 'down', 'left-right': 'left', 'right-left': 'right'}
+
+
+def idm_acceleration(speed, desired_speed, gap=None, approach_rate=0.0):
+    """
+    Intelligent Driver Model acceleration for a car at `speed` with `gap`
+    pixels of free road to the obstacle ahead (None for an open road), which
+    it closes at `approach_rate` px/s.
+    """
+    free_road = 1 - (speed / desired_speed) ** ACCELERATION_EXPONENT
+    if gap is None:
+        return MAX_ACCELERATION * free_road
+    desired_gap = MIN_GAP + max(0.0, speed * TIME_HEADWAY + speed * approach_rate /
+                                (2 * (MAX_ACCELERATION * COMFORTABLE_DECELERATION) ** 0.5))
+    gap = max(gap, 0.1)
+    return MAX_ACCELERATION * (free_road - (desired_gap / gap) ** 2)
+
+
+class Lane:
+    """
+    Cars in one lane, kept in driving order as a doubly linked list: each car
+    points at its leader (the car ahead) and its follower. Positions along the
+    lane are in "progress" units that grow in the direction of travel, so the
+    same comparisons work for all four directions.
+    """
+
+    def __init__(self, direction, lane_number):
+        self.direction = direction
+        self.lane_number = lane_number
+        self.sign = 1 if direction in ['up-down', 'left-right'] else -1
+        self.head = None  # Front-most car
+        self.tail = None  # Last car to enter
+        self.count = 0
+        # Progress of the stop line while the light is not green, otherwise None
+        self.stop_line = None
+
+    def __len__(self):
+        return self.count
+
+    def __iter__(self):
+        car = self.head
+        while car is not None:
+            yield car
+            car = car.follower
+
+    def append(self, car):
+        """Add a car at the back of the queue."""
+        car.lane = self
+        car.leader = self.tail
+        car.follower = None
+        if self.tail is not None:
+            self.tail.follower = car
+        else:
+            self.head = car
+        self.tail = car
+        self.count += 1
+
+    def has_room(self, front):
+        """Whether a car whose leading edge is at `front` fits behind the last car."""
+        return self.tail is None or self.tail.rear_progress() - front >= MIN_GAP
+
+    def remove(self, car):
+        """Unlink a car, joining its follower to its leader."""
+        if car.lane is not self:
+            return
+        if car.leader is not None:
+            car.leader.follower = car.follower
+        else:
+            self.head = car.follower
+        if car.follower is not None:
+            car.follower.leader = car.leader
+        else:
+            self.tail = car.leader
+        car.lane = car.leader = car.follower = None
+        self.count -= 1
+
+    def set_light(self, light, green, stop_distance):
+        """Update the stop line from this lane's traffic light."""
+        if green or light is None:
+            self.stop_line = None
+        elif self.direction in ['up-down', 'down-up']:
+            self.stop_line = light['pos'][1] - stop_distance if self.sign > 0 else -(light['pos'][1] + stop_distance)
+        else:
+            self.stop_line = light['pos'][0] - stop_distance if self.sign > 0 else -(light['pos'][0] + stop_distance)
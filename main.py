@@ -1,20 +1,29 @@
-import requests
 import pygame
 import sys
-from settings import FPS, BLACK, width, height, traffic_lights
-from draw_objects import draw_road, draw_traffic_light, Car
+from settings import FPS, STEPS_PER_SECOND, SIM_DT, BLACK, width, height, traffic_lights
+from draw_objects import draw_road, draw_traffic_light, Car, lane_position
+from spatial_hash import SpatialHashGroup
+from lanes import Lane, LIGHT_FOR_DIRECTION, QUEUED_GAP
 import random
 import pygame
 import pytmx
 import time
+import argparse
+from vector_engine import VectorTraffic, COUNTER_FOR_DIRECTION, SPAWN_DIRECTIONS
+from road_network import GridNetwork
+from parallel_network import PartitionedGrid
+from state_sync import StateSync
+from profiler import FrameProfiler
+from event_log import EventRecorder, EventLog, FrameEvents, CHECKSUM_INTERVAL
+from renderer import DirtyRenderer
+from map_cache import cached_map_surface
+import zlib
+import numpy as np
 
-# Initialize Pygame
+# Initialize Pygame. The display itself is only opened by main(), so the
+# simulation can also run headless without a window.
 pygame.init()
 
-# Set up the display
-screen = pygame.display.set_mode((width, height))
-pygame.display.set_caption("Crossroad Simulation")
-
 # URL of the FastAPI server
 BASE_URL = "http://127.0.0.1:8000"
 
@@ -32,15 +41,23 @@ spawn_timers = {
     'left-right': 0,
     'right-left': 0
 }
-# Spawn intervals (in frames) for each direction
+# Spawn intervals (in simulated seconds) for each direction
 spawn_intervals = {
-    'up-down': 60,
-    'down-up': 70,
-    'left-right': 65,
-    'right-left': 75
+    'up-down': 1.0,
+    'down-up': 1.17,
+    'left-right': 1.08,
+    'right-left': 1.25
+}
+# Ordered vehicle queue for each lane: two lanes per spawn direction
+lanes = {
+    (direction, lane_number): Lane(direction, lane_number)
+    for direction in spawn_timers
+    for lane_number in (1, 2)
 }
+
 # Maximum number of cars (set this to a reasonable number based on your system performance)
-MAX_CARS = 100
+DEFAULT_MAX_CARS = 100
+MAX_CARS = DEFAULT_MAX_CARS
 
 # Define a larger simulation area that extends beyond the visible window
 # This will be used for car management outside the visible area
@@ -51,54 +68,73 @@ simulation_bounds = {
     'bottom': height + 200
 }
 
-# Track the last time we did a cleanup of stalled cars
-last_cleanup_time = time.time()
-cleanup_interval = 5  # seconds between cleanup checks
+cleanup_interval = 5  # simulated seconds between cleanup checks
 
-def fetch_lane_counters():
-    try:
-        response = requests.get(f"{BASE_URL}/lane-counters")
-        if response.status_code == 200:
-            return response.json()
-    except requests.exceptions.RequestException as e:
-        print(f"Failed to fetch lane counters: {e}")
-    return lane_counters  # Return the current lane_counters if the server is not available
-
-def update_lane_counters(counters):
-    try:
-        response = requests.post(f"{BASE_URL}/lane-counters", json=counters)
-        return response.status_code == 200
-    except requests.exceptions.RequestException as e:
-        print(f"Failed to update lane counters: {e}")
-    return False
+# Simulation speed multipliers selectable in the window, by key
+SPEED_KEYS = {pygame.K_1: 1, pygame.K_2: 10, pygame.K_3: 100}
+# Longest wall-clock gap a frame makes up for, so a stall (dragging the
+# window, a breakpoint) does not turn into a burst of catch-up steps
+MAX_FRAME_TIME = 0.25
 
-def fetch_traffic_lights():
-    try:
-        response = requests.get(f"{BASE_URL}/traffic-lights")
-        if response.status_code == 200:
-            return response.json()
-    except requests.exceptions.RequestException as e:
-        print(f"Failed to fetch traffic lights: {e}")
-    return traffic_lights  # Return the initialized traffic_lights if the server is not available
-
-def update_traffic_light(light_status):
-    try:
-        response = requests.post(f"{BASE_URL}/traffic-lights", json=light_status)
-        return response.status_code == 200
-    except requests.exceptions.RequestException as e:
-        print(f"Failed to update traffic light: {e}")
-    return False
+# All of the simulation's randomness (lane choice, car colours) comes from
+# here, so seeding it makes a run repeatable
+rng = random.Random()
 
-def log_accident(is_accident, message):
-    try:
-        response = requests.post(f"{BASE_URL}/log-accident", json={"message": message, "is_accident": is_accident})
-        return response.status_code == 200
-    except requests.exceptions.RequestException as e:
-        print(f"Failed to log accident: {e}")
-    return False
+def reset_world(seed=None, max_cars=None):
+    """
+    Put the global simulation state back as at startup, and seed the random
+    generator. Every run starts here, so runs in one process do not carry
+    lanes, timers, counters or a car limit over from the one before.
+    """
+    global MAX_CARS
+    rng.seed(seed)
+    MAX_CARS = max_cars if max_cars is not None else DEFAULT_MAX_CARS
+    for direction in spawn_timers:
+        spawn_timers[direction] = 0
+    for lane in lane_counters:
+        lane_counters[lane] = 0
+    for key in lanes:
+        lanes[key] = Lane(*key)
+
+def spawn_steps(direction):
+    """The spawn interval for `direction` in simulation steps."""
+    return max(1, round(spawn_intervals[direction] * STEPS_PER_SECOND))
+
+def place_car(cars, direction, lane_number, color, sync=None):
+    """Add a car entering from `direction` in lane 1 or 2 and count it."""
+    lane = lane_position(direction, lane_number)
+    if direction in ['up-down', 'down-up']:
+        if direction == 'up-down':
+            y_position = simulation_bounds['top']  # Start above the visible area
+            speed = 2
+        else:
+            y_position = simulation_bounds['bottom']  # Start below the visible area
+            speed = -2
+        car = Car(lane, y_position, color, speed, 'vertical', direction)
+    else:
+        if direction == 'left-right':
+            x_position = simulation_bounds['left']  # Start to the left of the visible area
+            speed = 2
+        else:
+            x_position = simulation_bounds['right']  # Start to the right of the visible area
+            speed = -2
+        car = Car(x_position, lane, color, speed, 'horizontal', direction)
+    lane_counters[COUNTER_FOR_DIRECTION[direction]] += 1
 
+    cars.add(car)  # Use add() instead of append()
+    lanes[(direction, lane_number)].append(car)  # Joins the back of its lane's queue
+    if sync is not None:
+        sync.add_lane_increments({COUNTER_FOR_DIRECTION[direction]: 1})
+        print(f"Added car: {direction} at: {lane} with speed {speed}")
+    return car
 
-def spawn_cars(cars):
+def spawn_cars(cars, sync=None, recorder=None):
+    """
+    Spawn a car for every direction whose spawn timer is up. Each car's lane
+    counter increment is queued on the StateSync worker `sync`; with sync=None
+    the counters are only kept locally and nothing is printed. Spawns are
+    written to the EventRecorder `recorder`, if any.
+    """
     global lane_counters, spawn_timers
     
     # If we're at capacity, don't attempt to spawn more cars
@@ -112,64 +148,57 @@ def spawn_cars(cars):
     
     # Calculate how many slots we have available
     available_slots = MAX_CARS - len(cars)
+
+    # Leading edge of a freshly spawned car, in lane progress units (see lanes.Lane)
+    entry_fronts = {
+        'up-down': simulation_bounds['top'] + 20,
+        'down-up': -simulation_bounds['bottom'],
+        'left-right': simulation_bounds['left'] + 20,
+        'right-left': -simulation_bounds['right']
+    }
     
     # Try to spawn cars for each direction if timer is up
     for direction in spawn_timers:
         if available_slots <= 0:
             break  # Stop if we're at capacity
             
-        if spawn_timers[direction] >= spawn_intervals[direction]:
+        if spawn_timers[direction] >= spawn_steps(direction):
             spawn_timers[direction] = 0  # Reset the timer
             
             # Spawn the car
-            road_width = 50  # Increased to accommodate 4 lanes in total, 2 per direction
-            lane_width = road_width // 4  # 4 lanes, each lane has a width of road_width/4
-            
-            if direction in ['up-down', 'down-up']:
-                # Choose a random lane among the two available for the direction
-                lane_number = random.choice([1, 2])  # 1 or 2 for top and bottom lanes
-                lane_base_left = width // 2 - road_width // 2 + lane_width * (lane_number - 1)
-                lane_base_right = width // 2 + road_width // 2 - lane_width * lane_number
-                
-                if direction == 'up-down':
-                    y_position = simulation_bounds['top']  # Start above the visible area
-                    speed = 2
-                    lane_position = lane_base_left + lane_width // 2 - 14
-                    lane_counters['top'] += 1
-                else:
-                    y_position = simulation_bounds['bottom']  # Start below the visible area
-                    speed = -2
-                    lane_position = lane_base_right + lane_width // 2
-                    lane_counters['bottom'] += 1
-
-                car = Car(lane_position, y_position, (random.randint(0, 255), random.randint(0, 255), random.randint(0, 255)), speed, 'vertical', direction)
-            else:
-                # Choose a random lane among the two available for the direction
-                lane_number = random.choice([1, 2])  # 1 or 2 for left and right lanes
-                lane_base_top = height // 2 - road_width // 2 + lane_width * (lane_number - 1)
-                lane_base_bottom = height // 2 + road_width // 2 - lane_width * lane_number
-                
-                if direction == 'left-right':
-                    x_position = simulation_bounds['left']  # Start to the left of the visible area
-                    speed = 2
-                    lane_position = lane_base_bottom + lane_width // 2 
-                    lane_counters['left'] += 1
-                else:
-                    x_position = simulation_bounds['right']  # Start to the right of the visible area
-                    speed = -2
-                    lane_position = lane_base_top + lane_width // 2 -10
-                    lane_counters['right'] += 1
-
-                car = Car(x_position, lane_position, (random.randint(0, 255), random.randint(0, 255), random.randint(0, 255)), speed, 'horizontal', direction)
-
-            cars.add(car)  # Use add() instead of append()
+            # Choose a random lane among the two available for the direction,
+            # falling back to the other one if its queue reaches back to the entrance
+            lane_number = rng.choice([1, 2])
+            if not lanes[(direction, lane_number)].has_room(entry_fronts[direction]):
+                lane_number = 3 - lane_number
+                if not lanes[(direction, lane_number)].has_room(entry_fronts[direction]):
+                    continue  # Both lanes are backed up, try again next interval
+            color = (rng.randint(0, 255), rng.randint(0, 255), rng.randint(0, 255))
+            place_car(cars, direction, lane_number, color, sync)
+            if recorder is not None:
+                recorder.spawn(direction, lane_number, color)
             cars_spawned += 1
             available_slots -= 1
-            update_lane_counters(lane_counters)
-            print(f"Added car: {direction} at: {lane_position} with speed {speed}")
     
     return cars_spawned
 
+def spawn_vector_cars(traffic, sync=None, recorder=None):
+    """
+    Spawn step for the vector engine. Keeps lane_counters in sync with the
+    cars it adds, the same way spawn_cars does.
+    """
+    start = len(traffic)
+    spawned = traffic.spawn(rng)
+    if recorder is not None:
+        for i, lane_number in enumerate(traffic.lane_numbers(start, len(traffic)), start):
+            recorder.spawn(SPAWN_DIRECTIONS[traffic.spawn_direction[i]], int(lane_number), traffic.color[i])
+    increments = {COUNTER_FOR_DIRECTION[direction]: count for direction, count in spawned.items()}
+    for lane, count in increments.items():
+        lane_counters[lane] += count
+    if increments and sync is not None:
+        sync.add_lane_increments(increments)
+    return sum(spawned.values())
+
 def manage_traffic_lights(cars, lights):
     """
     Manages how cars respond to traffic lights.
@@ -190,9 +219,18 @@ def manage_traffic_lights(cars, lights):
     
     # Use a fixed stop distance for all cars to be consistent
     stop_distance = 50
+
+    # Cars in a lane queue stop for the lane's stop line in Car.follow
+    for lane in lanes.values():
+        light_direction = LIGHT_FOR_DIRECTION[lane.direction]
+        light = next((light for light in lights if light['direction'] == light_direction), None)
+        lane.set_light(light, light_states[light_direction], stop_distance)
     
-    # Apply the traffic light rules to all cars
+    # Apply the traffic light rules to all other cars
     for car in cars:
+        if car.lane is not None:
+            continue
+
         # Initially assume the car can move
         car.moving = True
         
@@ -231,13 +269,18 @@ def manage_traffic_lights(cars, lights):
                             car.moving = False
                             break
 
+LANE_COUNTER_COLORS = {'top': (255, 255, 255), 'bottom': (255, 255, 255), 'left': (255, 255, 255), 'right': (255, 255, 255)}
+LANE_COUNTER_POSITIONS = {'top': (50, 50), 'bottom': (50, height - 50), 'left': (50, 100), 'right': (width - 150, 100)}
+
+def lane_counter_lines():
+    """(lane, text, colour, position) for each lane counter shown on screen."""
+    return [(lane, f'{lane.capitalize()} Lane: {count}', LANE_COUNTER_COLORS[lane], LANE_COUNTER_POSITIONS[lane])
+            for lane, count in lane_counters.items()]
+
 def draw_lane_counters(screen):
     font = pygame.font.Font(None, 20)
-    colors = {'top': (255, 255, 255), 'bottom': (255, 255, 255), 'left': (255, 255, 255), 'right': (255, 255, 255)}
-    positions = {'top': (50, 50), 'bottom': (50, height - 50), 'left': (50, 100), 'right': (width - 150, 100)}
-    for lane, count in lane_counters.items():
-        text_surface = font.render(f'{lane.capitalize()} Lane: {count}', True, colors[lane])
-        screen.blit(text_surface, positions[lane])
+    for _, text, color, position in lane_counter_lines():
+        screen.blit(font.render(text, True, color), position)
 
 def check_for_accidents(lights):
     horizontal_green = any(light['green'] for light in lights if light['direction'] in ['left', 'right'])
@@ -276,8 +319,11 @@ def cleanup_stalled_cars(cars, lights):
     at_capacity = len(cars) >= MAX_CARS * 0.9
     
     for car in cars:
-        # If the car isn't moving but should be moving based on traffic lights, it might be stuck
-        if not car.moving:
+        # If the car isn't moving but should be moving based on traffic lights, it might be stuck.
+        # A queued car waiting for the car ahead to pull away is not stuck,
+        # even once that car is moving: it only starts as the gap opens up.
+        queued = car.leader is not None and (not car.leader.moving or car.gap_to_leader() <= QUEUED_GAP)
+        if not car.moving and not queued:
             if car.direction == 'horizontal':
                 if (car.spawn_direction == 'left-right' and light_states['left']) or \
                    (car.spawn_direction == 'right-left' and light_states['right']):
@@ -311,6 +357,113 @@ def cleanup_stalled_cars(cars, lights):
             cars.remove(car)
             print(f"Removed car during cleanup. Remaining: {len(cars)}")
 
+def run_cleanup(cars, traffic, lights):
+    """Stall cleanup for either engine. Returns the number of cars removed."""
+    if traffic is not None:
+        return traffic.cleanup_stalled(lights)
+    before = len(cars)
+    cleanup_stalled_cars(cars, lights)
+    return before - len(cars)
+
+def state_checksum(cars, traffic):
+    """CRC of every car's exact position and speed, independent of the order cars are stored in."""
+    if traffic is not None:
+        n = len(traffic)
+        state = np.stack([traffic.x[:n], traffic.y[:n], traffic.spawn_direction[:n], traffic.moving[:n]], axis=1)
+    else:
+        state = np.array([(car.position, car.velocity, car.rect.x, car.rect.y) for car in cars], dtype=np.float64)
+    if len(state):
+        state = state[np.lexsort(state.T[::-1])]
+    return zlib.crc32(np.ascontiguousarray(state).tobytes())
+
+def place_spawns(cars, traffic, spawns):
+    """Add recorded spawns, (direction, lane number, colour) each, instead of spawning. Returns how many."""
+    for direction, lane_number, color in spawns:
+        if traffic is not None:
+            traffic.place_cars(direction, [lane_number], [color])
+            lane_counters[COUNTER_FOR_DIRECTION[direction]] += 1
+        else:
+            place_car(cars, direction, lane_number, color)
+    return len(spawns)
+
+def simulation_step(cars, traffic, lights, sync=None, profiler=None, recorder=None, spawns=None):
+    """
+    One tick of spawning, traffic light gating and car movement, shared by the
+    windowed loop and the headless runner. `traffic` is the vector engine, or
+    None to simulate the sprites in `cars`; `sync` is the StateSync worker, or
+    None to keep everything local. With a FrameProfiler, the spawn, gating and
+    update phases are timed. Spawns go to `recorder`, an EventRecorder; a
+    replay passes the recorded `spawns` instead, to place them as they were.
+    Returns (spawned, removed).
+    """
+    if traffic is not None:
+        # Spawn, gate, move and cull as whole-array operations
+        if spawns is not None:
+            spawned = place_spawns(cars, traffic, spawns)
+        else:
+            spawned = spawn_vector_cars(traffic, sync, recorder)
+        if profiler is not None:
+            profiler.lap('spawn')
+        traffic.apply_lights(lights)
+        if profiler is not None:
+            profiler.lap('gating')
+        removed = traffic.step()
+        if profiler is not None:
+            profiler.lap('update')
+        return spawned, removed
+
+    # Spawn cars only if we're not at capacity
+    spawned = 0
+    if spawns is not None:
+        spawned = place_spawns(cars, traffic, spawns)
+    elif len(cars) < MAX_CARS:
+        spawned = spawn_cars(cars, sync, recorder)
+    if profiler is not None:
+        profiler.lap('spawn')
+
+    # Manage traffic lights for ALL cars
+    manage_traffic_lights(cars, lights)
+    if profiler is not None:
+        profiler.lap('gating')
+
+    # Update ALL cars
+    starting_car_count = len(cars)
+    for car in list(cars):  # Make a copy for safe iteration
+        car.update(cars)
+
+        # Check if car is far outside our extended bounds
+        if not is_car_in_extended_bounds(car):
+            cars.remove(car)
+    if profiler is not None:
+        profiler.lap('update')
+
+    return spawned, starting_car_count - len(cars)
+
+# Phases of a frame, in order, as timed by the frame profiler
+FRAME_PHASES = ('events', 'lights', 'cleanup', 'spawn', 'gating', 'update', 'cars', 'hud', 'draw', 'flip')
+HEADLESS_PHASES = ('lights', 'cleanup', 'spawn', 'gating', 'update')
+
+def interpolate(previous, current, alpha):
+    """A car's drawn top-left corner, `alpha` of the way from `previous` (None: not known) to `current`."""
+    if previous is None:
+        return current
+    return (round(previous[0] + alpha * (current[0] - previous[0])),
+            round(previous[1] + alpha * (current[1] - previous[1])))
+
+# Top-left corner of the debug overlay's profiler panel
+PROFILER_PANEL_POSITION = (width - 233, 127)
+
+def profiler_panel(profiler, font):
+    """Rolling p50/p95/p99 per frame phase, drawn on a panel for the debug overlay."""
+    lines = profiler.report()
+    line_height = font.get_linesize()
+    panel = pygame.Surface((225, line_height * len(lines) + 6), pygame.SRCALPHA)
+    panel.fill((0, 0, 0, 170))
+    for i, line in enumerate(lines):
+        color = (255, 80, 80) if i == 1 and profiler.percentiles()['total'][1] > 1000 / FPS else (255, 255, 0)
+        panel.blit(font.render(line, True, color), (3, 3 + i * line_height))
+    return panel
+
 # Frame rate
 clock = pygame.time.Clock()
 
@@ -337,40 +490,84 @@ def draw_map_surface(tmx_data, scale):
     
     return scaled_surface
 
-def main():
-    global last_cleanup_time
-    
-    tmx_data = load_map("map.tmx")
-    map_width = tmx_data.width * tmx_data.tilewidth
-    map_height = tmx_data.height * tmx_data.tileheight
+def map_surface(filename):
+    """The map scaled to fit the window, from the map cache or else baked from the TMX file."""
+    def bake():
+        tmx_data = load_map(filename)
+        map_width = tmx_data.width * tmx_data.tilewidth
+        map_height = tmx_data.height * tmx_data.tileheight
+        # Calculate scale factor to fit the map to the screen size
+        scale = min(width / map_width, height / map_height)  # Maintain aspect ratio by using the smaller scale factor
+        return draw_map_surface(tmx_data, scale)
+    return cached_map_surface(filename, (width, height), bake)
+
+def main(engine='sprite', max_cars=None, profile_csv=None, seed=None, record=None, speed=1):
+    """
+    The windowed simulation. The simulation advances in fixed steps of SIM_DT
+    simulated seconds, `speed` times as fast as the wall clock, so several
+    steps may run per drawn frame (or none); cars are drawn interpolated
+    between their last two steps. With `seed`, spawns are repeatable; with
+    `record`, the run is written to that event log for replay.
+    """
+    # max_cars limits the sprite engine as in headless runs; the vector engine takes it directly
+    reset_world(seed, max_cars if engine == 'sprite' else None)
+
+    # Set up the display
+    screen = pygame.display.set_mode((width, height))
+    pygame.display.set_caption("Crossroad Simulation")
     
-    # Calculate scale factor to fit the map to the screen size
-    scale_x = width / map_width
-    scale_y = height / map_height
-    scale = min(scale_x, scale_y)  # Maintain aspect ratio by using the smaller scale factor
-    scaled_map_surface = draw_map_surface(tmx_data, scale)
+    scaled_map_surface = map_surface("map.tmx")
+    # The map never changes, so it is composed once as the background and
+    # each frame only redraws the areas around what moved or changed
+    background = pygame.Surface((width, height))
+    background.fill(BLACK)
+    background.blit(scaled_map_surface, (0, 0))
+    renderer = DirtyRenderer(screen, background)
     global lane_counters  # Use the global counters
     global traffic_lights  # And the global traffic light settings
     running = True
-    cars = pygame.sprite.Group()  # This will hold all car sprites
-    lane_counters.update(fetch_lane_counters())
-    traffic_lights = fetch_traffic_lights()
+    cars = SpatialHashGroup()  # This will hold all car sprites, bucketed for collision checks
+    # The vector engine keeps car state in NumPy arrays and only builds sprites for drawn cars
+    traffic = VectorTraffic(simulation_bounds, spawn_intervals, max_cars=max_cars or MAX_CARS) if engine == 'vector' else None
+    car_limit = traffic.max_cars if traffic is not None else MAX_CARS
+
+    # All server traffic goes through the background worker, so a slow or
+    # missing server never stalls a frame
+    sync = StateSync(BASE_URL, traffic_lights)
+    lane_counters.update(sync.fetch_lane_counters() or {})
+    sync.start()
 
     # Font for displaying stats
     font = pygame.font.Font(None, 24)
+    lane_font = pygame.font.Font(None, 20)
+    profiler_font = pygame.font.SysFont('monospace', 13)
     debug_mode = False  # Toggle for showing debug info
-    
+    # Per-phase frame timings for the debug overlay, and optionally a CSV file
+    profiler = FrameProfiler(FRAME_PHASES, csv_path=profile_csv)
+    recorder = None
+    if record:
+        recorder = EventRecorder(record, seed, engine, car_limit, STEPS_PER_SECOND, traffic_lights)
+
     # Track statistics
     cars_spawned_this_frame = 0
     cars_removed_this_frame = 0
+    # Cleanup runs on simulated time (steps), so a run does not depend on the frame rate
+    cleanup_every = max(1, int(cleanup_interval * STEPS_PER_SECOND))
+    force_cleanup = False
+    step = 0
+    # Simulated time owed to the simulation, in seconds
+    accumulator = 0.0
+    frame_time = 1 / FPS
+    # Car positions before the latest step, for interpolation; None draws cars where they are
+    previous = None
+    effective_speed = speed
+    dirty_rects = []
 
     while running:
-        frame_start_car_count = len(cars)
+        profiler.start_frame()
         cars_spawned_this_frame = 0
         cars_removed_this_frame = 0
         
-        screen.fill(BLACK)
-        
         for event in pygame.event.get():
             if event.type == pygame.QUIT:
                 running = False
@@ -378,83 +575,394 @@ def main():
                 if event.key == pygame.K_d:  # Press 'D' to toggle debug mode
                     debug_mode = not debug_mode
                 elif event.key == pygame.K_c:  # Press 'C' to force cleanup
-                    pre_cleanup_count = len(cars)
-                    cleanup_stalled_cars(cars, traffic_lights)
-                    post_cleanup_count = len(cars)
-                    print(f"Manual cleanup removed {pre_cleanup_count - post_cleanup_count} cars")
+                    force_cleanup = True
+                elif event.key in SPEED_KEYS:  # Press '1', '2' or '3' for 1x, 10x or 100x
+                    speed = SPEED_KEYS[event.key]
+        profiler.lap('events')
 
-        # Fetch latest traffic light states
-        traffic_lights = fetch_traffic_lights()
-        
-        # Regular cleanup check on timer
-        current_time = time.time()
-        if current_time - last_cleanup_time >= cleanup_interval:
-            cleanup_stalled_cars(cars, traffic_lights)
-            last_cleanup_time = current_time
-        
-        # Spawn cars only if we're not at capacity
-        if len(cars) < MAX_CARS:
-            cars_spawned_this_frame = spawn_cars(cars)
-        
-        # Manage traffic lights for ALL cars
-        manage_traffic_lights(cars, traffic_lights)
-        
-        if check_for_accidents(traffic_lights):
-            log_accident(True, "Warning: Potential accident! Both vertical and horizontal lanes have green lights!")
-        
-        # Update ALL cars
-        starting_car_count = len(cars)
-        for car in list(cars):  # Make a copy for safe iteration
-            car.update(cars)
-            
-            # Check if car is far outside our extended bounds
-            if not is_car_in_extended_bounds(car):
-                cars.remove(car)
-                cars_removed_this_frame += 1
-        
-        # Calculate how many cars were removed during update
-        cars_removed_this_frame = starting_car_count - len(cars) + cars_spawned_this_frame
-    
-        # Draw the map
-        screen.blit(scaled_map_surface, (0, 0))
-        
-        # Only draw cars that would be visible on screen for efficiency
-        for car in cars:
-            if car.rect.colliderect(pygame.Rect(0, 0, width, height)):
-                screen.blit(car.image, car.rect)
+        # Latest traffic light snapshot from the sync worker
+        traffic_lights = sync.lights()
+        profiler.lap('lights')
+
+        # Run the steps that fall due in this frame's share of simulated time.
+        # Steps get most of a frame's wall time; what they cannot catch up on
+        # is dropped, so the window stays responsive and the speed just drops.
+        accumulator += min(frame_time, MAX_FRAME_TIME) * speed
+        deadline = time.perf_counter() + 0.8 / FPS
+        steps_run = 0
+        dropped = False
+        while accumulator >= SIM_DT:
+            if steps_run and time.perf_counter() > deadline:
+                accumulator = 0.0
+                previous = None
+                dropped = True
+                break
+            if accumulator < 2 * SIM_DT:
+                # The frame's last step: keep where the cars were before it
+                previous = traffic.positions() if traffic is not None else {car: car.rect.topleft for car in cars}
+            step += 1
+            steps_run += 1
+            accumulator -= SIM_DT
+            if recorder is not None:
+                recorder.start_frame(step)
+                recorder.lights(traffic_lights)
+
+            # Regular cleanup check, or a forced one
+            cleaned_up = 0
+            if force_cleanup or step % cleanup_every == 0:
+                cleaned_up = run_cleanup(cars, traffic, traffic_lights)
+                if force_cleanup:
+                    print(f"Manual cleanup removed {cleaned_up} cars")
+                force_cleanup = False
+                if recorder is not None:
+                    recorder.cleanup()
+            profiler.lap('cleanup')
+
+            spawned, removed = simulation_step(cars, traffic, traffic_lights, sync, profiler, recorder)
+            cars_spawned_this_frame += spawned
+            cars_removed_this_frame += cleaned_up + removed
+            if recorder is not None:
+                recorder.removed(cleaned_up + removed)
+                if step % CHECKSUM_INTERVAL == 0:
+                    recorder.checksum(state_checksum(cars, traffic))
+        effective_speed = steps_run * SIM_DT / frame_time if dropped else speed
+        # How far the simulation is between its last step and the next one
+        alpha = accumulator / SIM_DT
+
+        if traffic is not None:
+            drawn_cars = traffic.visible_sprites(previous, alpha)
+            drawn_positions = [car.rect.topleft for car in drawn_cars]
+        else:
+            # Only draw cars that would be visible on screen for efficiency
+            drawn_cars = [car for car in cars if car.rect.colliderect(pygame.Rect(0, 0, width, height))]
+            drawn_positions = [interpolate(previous.get(car) if previous else None, car.rect.topleft, alpha)
+                               for car in drawn_cars]
+
+        renderer.place_cars(drawn_cars, drawn_positions)
+        profiler.lap('cars')
         
-        # Draw traffic lights
+        # Traffic lights
         for light in traffic_lights:
-            draw_traffic_light(screen, light['pos'], light['red'], light['yellow'], light['green'], light['direction'])
+            renderer.place_light(light)
         
-        # Display lane counters and stats
-        draw_lane_counters(screen)
+        # Lane counters and stats
+        for lane, text, color, position in lane_counter_lines():
+            renderer.place_text(('lane', lane), lane_font, text, color, position)
         
         # Always show car count
-        cars_text = font.render(f"Cars: {len(cars)}/{MAX_CARS}", True, (255, 255, 255))
-        screen.blit(cars_text, (width - 150, 20))
+        total_cars = len(traffic) if traffic is not None else len(cars)
+        renderer.place_text('cars', font, f"Cars: {total_cars}/{car_limit}", (255, 255, 255), (width - 150, 20))
+
+        # How old the light snapshot is, so a lost server connection is visible
+        staleness = sync.staleness()
+        if staleness is None:
+            sync_text, sync_color = "Lights: local", (255, 255, 0)
+        elif staleness > 2:  # Long polls confirm the lights about once a second
+            sync_text, sync_color = f"Lights: {int(staleness)}s old", (255, 80, 80)
+        else:
+            sync_text, sync_color = "Lights: live", (255, 255, 255)
+        renderer.place_text('sync', font, sync_text, sync_color, (width - 150, 45))
+
+        # Simulation speed, and the speed actually reached when steps cannot keep up
+        speed_text = f"Speed: {speed}x" if effective_speed >= speed else f"Speed: {speed}x ({effective_speed:.0f}x)"
+        renderer.place_text('speed', font, speed_text, (255, 255, 255), (width - 150, 70))
         
         # Debug information if enabled
         if debug_mode:
-            visible_cars = sum(1 for car in cars if car.rect.colliderect(pygame.Rect(0, 0, width, height)))
-            moving_cars = sum(1 for car in cars if car.moving)
+            visible_cars = len(drawn_cars)
+            moving_cars = traffic.moving_count() if traffic is not None else sum(1 for car in cars if car.moving)
             
             debug_text = [
                 f"FPS: {int(clock.get_fps())}",
                 f"Visible cars: {visible_cars}",
-                f"Total cars: {len(cars)}",
+                f"Total cars: {total_cars}",
                 f"Moving cars: {moving_cars}",
                 f"Spawned this frame: {cars_spawned_this_frame}",
                 f"Removed this frame: {cars_removed_this_frame}",
-                f"Next cleanup in: {int(cleanup_interval - (time.time() - last_cleanup_time))}s"
+                f"Redrawn: {sum(rect.w * rect.h for rect in dirty_rects) * 100 // (width * height)}% of the window",
+                f"Sim time: {step * SIM_DT:.0f}s",
+                f"Next cleanup in: {(cleanup_every - step % cleanup_every) * SIM_DT:.0f}s"
             ]
             
             for i, text in enumerate(debug_text):
-                debug_surface = font.render(text, True, (255, 255, 0))
-                screen.blit(debug_surface, (10, height - 30 - i * 25))
-        
-        pygame.display.flip()
-        clock.tick(FPS)
+                renderer.place_text(('debug', i), font, text, (255, 255, 0), (10, height - 30 - i * 25))
+
+            if profiler.frames:
+                renderer.place('profiler', profiler_panel(profiler, profiler_font), PROFILER_PANEL_POSITION)
+        profiler.lap('hud')
+
+        dirty_rects = renderer.draw()
+        profiler.lap('draw')
+        pygame.display.update(dirty_rects)
+        profiler.lap('flip')
+        profiler.end_frame()
+        frame_time = clock.tick(FPS) / 1000
+        # Frame time without the FPS cap's sleep, for the server's /metrics
+        sync.set_gauges({'frame_time_seconds': clock.get_rawtime() / 1000, 'cars': total_cars, 'fps': clock.get_fps()})
+
+    sync.stop()
+    profiler.close()
+    if recorder is not None:
+        recorder.close()
+
+def run_headless(steps=None, sim_seconds=None, engine='sprite', max_cars=None, offline=False, profile_csv=None,
+                 seed=None, record=None):
+    """
+    Run the simulation without a window and without an FPS cap. Each step
+    stands for SIM_DT simulated seconds, as in the window; stop after `steps`
+    steps or once `sim_seconds` of simulated time has passed. With offline=True
+    the local traffic light settings are used and nothing is sent to the server.
+    With `profile_csv`, per-phase step timings are written there and their
+    percentiles printed. An offline run with a `seed` is exactly repeatable;
+    `record` writes the run to an event log. Returns a summary dict, which is
+    also printed.
+    """
+    if steps is None:
+        steps = int(round((sim_seconds if sim_seconds is not None else 60) * STEPS_PER_SECOND))
+    reset_world(seed, max_cars if engine == 'sprite' else None)
+
+    cars = SpatialHashGroup()
+    traffic = VectorTraffic(simulation_bounds, spawn_intervals, max_cars=max_cars or MAX_CARS) if engine == 'vector' else None
+    sync = None
+    if not offline:
+        sync = StateSync(BASE_URL, traffic_lights)
+        lane_counters.update(sync.fetch_lane_counters() or {})
+        sync.start()
+    lights = traffic_lights
+    profiler = FrameProfiler(HEADLESS_PHASES, csv_path=profile_csv) if profile_csv else None
+    car_limit = traffic.max_cars if traffic is not None else MAX_CARS
+    recorder = EventRecorder(record, seed, engine, car_limit, STEPS_PER_SECOND, lights) if record else None
+
+    # Stall cleanup runs on simulated time here, not on the wall clock
+    cleanup_every = max(1, int(cleanup_interval * STEPS_PER_SECOND))
+    total_spawned = total_removed = 0
+
+    start = step_start = time.perf_counter()
+    for step in range(1, steps + 1):
+        if profiler is not None:
+            profiler.start_frame()
+        if recorder is not None:
+            recorder.start_frame(step)
+        if sync is not None:
+            lights = sync.lights()
+            if recorder is not None:
+                recorder.lights(lights)
+        if profiler is not None:
+            profiler.lap('lights')
+
+        cleaned_up = 0
+        if step % cleanup_every == 0:
+            cleaned_up = run_cleanup(cars, traffic, lights)
+            if recorder is not None:
+                recorder.cleanup()
+        if profiler is not None:
+            profiler.lap('cleanup')
+
+        spawned, removed = simulation_step(cars, traffic, lights, sync, profiler, recorder)
+        total_spawned += spawned
+        total_removed += cleaned_up + removed
+        if recorder is not None:
+            recorder.removed(cleaned_up + removed)
+            if step % CHECKSUM_INTERVAL == 0:
+                recorder.checksum(state_checksum(cars, traffic))
+        if profiler is not None:
+            profiler.end_frame()
+        if sync is not None:
+            now = time.perf_counter()
+            sync.set_gauges({'frame_time_seconds': now - step_start,
+                             'cars': len(traffic) if traffic is not None else len(cars)})
+            step_start = now
+    elapsed = time.perf_counter() - start
+    if sync is not None:
+        sync.stop()
+    if recorder is not None:
+        recorder.close()
+
+    summary = {
+        'engine': engine,
+        'steps': steps,
+        'sim_seconds': steps * SIM_DT,
+        'wall_seconds': elapsed,
+        'steps_per_second': steps / elapsed if elapsed > 0 else float('inf'),
+        'cars': len(traffic) if traffic is not None else len(cars),
+        'spawned': total_spawned,
+        'removed': total_removed,
+        'checksum': state_checksum(cars, traffic),
+    }
+    print(f"Headless {engine} run: {steps} steps ({summary['sim_seconds']:.1f} sim s) in {elapsed:.2f} s "
+          f"-> {summary['steps_per_second']:.0f} steps/s, {summary['cars']} cars on the road, "
+          f"state {summary['checksum']:08x}")
+    if profiler is not None:
+        print("\n".join(profiler.report()))
+        profiler.close()
+    return summary
+
+def run_replay(path, frame=None, show=False):
+    """
+    Rebuild a recorded run from its event log: the recorded spawns, light
+    changes and cleanups are fed through the simulation headless, as fast as
+    it goes, up to `frame` (default: the last recorded one). Removals and
+    checksums are compared with the recording on the way, and the first frame
+    where the replay differs is reported. With show=True the rebuilt frame is
+    then drawn in a window. Returns a summary dict, which is also printed.
+    """
+    log = EventLog(path)
+    header = log.header
+    engine = header['engine']
+    reset_world(header.get('seed'), header['max_cars'] if engine == 'sprite' else None)
+    cars = SpatialHashGroup()
+    traffic = VectorTraffic(simulation_bounds, spawn_intervals, max_cars=header['max_cars']) if engine == 'vector' else None
+    lights = header['lights']
+    last = log.last_frame if frame is None else frame
+    if not 0 <= last <= log.last_frame:
+        raise ValueError(f"{path} records frames 1 to {log.last_frame}, not frame {frame}")
+    no_events = FrameEvents()
+    diverged = None
+
+    start = time.perf_counter()
+    for step in range(1, last + 1):
+        events = log.frames.get(step, no_events)
+        lights = log.lights(lights, step)
+        cleaned_up = run_cleanup(cars, traffic, lights) if events.cleanup else 0
+        _, removed = simulation_step(cars, traffic, lights, spawns=events.spawns)
+        if diverged is None:
+            if cleaned_up + removed != events.removed:
+                diverged = (step, f"{cleaned_up + removed} cars removed, {events.removed} in the recording")
+            elif events.checksum is not None and state_checksum(cars, traffic) != events.checksum:
+                diverged = (step, "car positions differ from the recording")
+    elapsed = time.perf_counter() - start
+
+    summary = {
+        'engine': engine,
+        'frames': last,
+        'sim_seconds': last * SIM_DT,
+        'wall_seconds': elapsed,
+        'speedup': last * SIM_DT / elapsed if elapsed > 0 else float('inf'),
+        'cars': len(traffic) if traffic is not None else len(cars),
+        'checksum': state_checksum(cars, traffic),
+        'diverged_frame': diverged[0] if diverged else None,
+    }
+    print(f"Replayed {last} frames ({summary['sim_seconds']:.1f} sim s) of {path} in {elapsed:.2f} s "
+          f"({summary['speedup']:.0f}x real time), {summary['cars']} cars, state {summary['checksum']:08x}")
+    if diverged:
+        print(f"Replay differs from the recording from frame {diverged[0]}: {diverged[1]}")
+    if show:
+        show_frame(cars, traffic, lights, last)
+    return summary
+
+def show_frame(cars, traffic, lights, frame):
+    """Draw one rebuilt frame in a window and keep it up until the window is closed."""
+    screen = pygame.display.set_mode((width, height))
+    pygame.display.set_caption(f"Crossroad Simulation - replay frame {frame}")
+    screen.blit(map_surface("map.tmx"), (0, 0))
+    drawn_cars = traffic.visible_sprites() if traffic is not None else cars
+    for car in drawn_cars:
+        screen.blit(car.image, car.rect)
+    for light in lights:
+        draw_traffic_light(screen, light['pos'], light['red'], light['yellow'], light['green'], light['direction'])
+    draw_lane_counters(screen)
+    font = pygame.font.Font(None, 24)
+    screen.blit(font.render(f"Replay frame {frame} ({frame * SIM_DT:.1f} s)", True, (255, 255, 0)), (width - 230, 20))
+    pygame.display.flip()
+    while not any(event.type == pygame.QUIT for event in pygame.event.get()):
+        clock.tick(30)
+
+def run_grid(rows, cols, steps=None, sim_seconds=None, max_cars=None, spawn_interval=None, workers=1):
+    """
+    Run a rows x cols grid of intersections headless, on fixed-time lights,
+    for `steps` steps or `sim_seconds` of simulated time. With workers > 1 the
+    grid is split into bands of rows, one worker process each. Nothing is
+    sent to the server, which only knows the one crossroad. Returns a summary
+    dict, which is also printed.
+    """
+    if steps is None:
+        steps = int(round((sim_seconds if sim_seconds is not None else 60) * STEPS_PER_SECOND))
+    options = dict(spawn_interval=spawn_interval or spawn_steps('up-down'), max_cars=max_cars or 1_000_000, seed=0)
+
+    if workers > 1:
+        with PartitionedGrid(rows, cols, workers=workers, **options) as network:
+            start = time.perf_counter()
+            stats = network.run(steps)
+            elapsed = time.perf_counter() - start
+            workers = network.workers
+    else:
+        network = GridNetwork(rows, cols, **options)
+        start = time.perf_counter()
+        for step in range(steps):
+            network.fixed_time(step)
+            network.step()
+        elapsed = time.perf_counter() - start
+        stats = {'cars': len(network), 'moving': network.moving, 'spawned': network.spawned,
+                 'exited': network.exited, 'crossings': int(network.crossed.sum())}
+
+    summary = {
+        'engine': 'grid',
+        'intersections': rows * cols,
+        'workers': workers,
+        'steps': steps,
+        'sim_seconds': steps * SIM_DT,
+        'wall_seconds': elapsed,
+        'steps_per_second': steps / elapsed if elapsed > 0 else float('inf'),
+        'cars': stats['cars'],
+        'moving': stats['moving'],
+        'spawned': stats['spawned'],
+        'removed': stats['exited'],
+        'crossings': stats['crossings'],
+    }
+    print(f"Headless {rows}x{cols} grid run on {workers} process(es): {steps} steps "
+          f"({summary['sim_seconds']:.1f} sim s) in {elapsed:.2f} s "
+          f"-> {summary['steps_per_second']:.0f} steps/s, {summary['cars']} cars on the road, "
+          f"{summary['crossings']} intersection crossings")
+    return summary
+
+def grid_size(text):
+    try:
+        rows, cols = (int(n) for n in text.lower().split('x'))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected ROWSxCOLS, e.g. 32x32, not {text!r}")
+    if rows < 1 or cols < 1:
+        raise argparse.ArgumentTypeError("the grid needs at least one row and one column")
+    return rows, cols
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Crossroad traffic simulation')
+    parser.add_argument('--engine', choices=['sprite', 'vector'], default='sprite',
+                        help='sprite: one pygame sprite per car; vector: NumPy struct-of-arrays engine')
+    parser.add_argument('--max-cars', type=int, default=None, help=f'Car limit (default {DEFAULT_MAX_CARS})')
+    parser.add_argument('--headless', action='store_true', help='Run without a window and without an FPS cap')
+    budget = parser.add_mutually_exclusive_group()
+    budget.add_argument('--steps', type=int, default=None, help='Headless: number of simulation steps to run')
+    budget.add_argument('--sim-seconds', type=float, default=None, help='Headless: simulated time to run, in seconds')
+    parser.add_argument('--offline', action='store_true',
+                        help='Headless: use the local traffic light settings and do not talk to the server')
+    parser.add_argument('--profile-csv', default=None, metavar='PATH',
+                        help='Write per-phase frame timings (ms) to PATH, one row per frame')
+    parser.add_argument('--grid', type=grid_size, default=None, metavar='ROWSxCOLS',
+                        help='Headless, offline: simulate a grid of intersections instead of the one crossroad')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='Grid: worker processes, each simulating a band of rows (default 1)')
+    parser.add_argument('--seed', type=int, default=None,
+                        help='Seed for spawn lanes and car colours; offline headless runs repeat exactly')
+    parser.add_argument('--record', default=None, metavar='LOG',
+                        help='Write spawns, light changes and removals to LOG (gzip JSON lines) for replay')
+    parser.add_argument('--replay', default=None, metavar='LOG',
+                        help='Rebuild a recorded run and show its last frame (or --frame); with --headless, only check it')
+    parser.add_argument('--frame', type=int, default=None, help='Replay: frame to rebuild (default: the last)')
+    parser.add_argument('--speed', type=int, default=1,
+                        help='Window: simulated seconds per wall-clock second (default 1; keys 1/2/3 switch to 1x/10x/100x)')
+    return parser.parse_args()
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    args = parse_args()
+    if args.replay:
+        run_replay(args.replay, frame=args.frame, show=not args.headless)
+    elif args.grid:
+        run_grid(*args.grid, steps=args.steps, sim_seconds=args.sim_seconds, max_cars=args.max_cars,
+                 workers=args.workers)
+    elif args.headless:
+        run_headless(steps=args.steps, sim_seconds=args.sim_seconds, engine=args.engine,
+                     max_cars=args.max_cars, offline=args.offline, profile_csv=args.profile_csv,
+                     seed=args.seed, record=args.record)
+    else:
+        main(engine=args.engine, max_cars=args.max_cars, profile_csv=args.profile_csv, seed=args.seed,
+             record=args.record, speed=args.speed)
\ No newline at end of file
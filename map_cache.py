@@ -0,0 +1,76 @@
+"""
+On-disk cache of the baked map. Parsing a TMX map and blitting its tiles one
+by one takes a while at every start, so the finished, scaled surface is saved
+as a PNG under .map_cache/ next to the map and loaded directly on later runs.
+A cache file is named after a hash of the map, the tilesets and tile images
+it uses and the target size, so editing any of them bakes the map afresh.
+"""
+import hashlib
+import os
+import xml.etree.ElementTree as ET
+
+import pygame
+
+CACHE_DIR = '.map_cache'
+# Bump when the way the map is baked changes, to invalidate old cache files
+CACHE_VERSION = 1
+
+
+def map_sources(filename):
+    """The map file followed by every external tileset and tile image it uses."""
+    sources = [filename]
+    pending = [filename]
+    while pending:
+        path = pending.pop(0)
+        base = os.path.dirname(path)
+        root = ET.parse(path).getroot()
+        for element in root.iter():
+            source = element.get('source')
+            if source is None or element.tag not in ('tileset', 'image'):
+                continue
+            source = os.path.normpath(os.path.join(base, source))
+            if source not in sources:
+                sources.append(source)
+                if element.tag == 'tileset':
+                    pending.append(source)
+    return sources
+
+
+def cache_key(filename, size):
+    digest = hashlib.sha256(f'{CACHE_VERSION}:{size[0]}x{size[1]}'.encode())
+    for source in map_sources(filename):
+        digest.update(os.path.basename(source).encode() + b'\0')
+        with open(source, 'rb') as f:
+            digest.update(f.read())
+    return digest.hexdigest()
+
+
+def cached_map_surface(filename, size, bake):
+    """
+    The map in `filename` baked for a window of `size`: loaded from the cache
+    if there, otherwise made by calling `bake()` and stored for next time.
+    A missing or unreadable cache file is never an error, only a slower start.
+    """
+    cache_dir = os.path.join(os.path.dirname(os.path.abspath(filename)), CACHE_DIR)
+    prefix = f'{os.path.splitext(os.path.basename(filename))[0]}-{size[0]}x{size[1]}-'
+    path = os.path.join(cache_dir, prefix + cache_key(filename, size)[:16] + '.png')
+    if os.path.exists(path):
+        try:
+            return pygame.image.load(path)
+        except pygame.error:
+            pass  # Damaged; bake it again
+
+    surface = bake()
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        # Write under a temporary name first, so a concurrent start never reads half a file
+        temporary = f'{path[:-4]}.{os.getpid()}.png'
+        pygame.image.save(surface, temporary)
+        os.replace(temporary, path)
+        # Drop cache files of earlier versions of this map at this size
+        for name in os.listdir(cache_dir):
+            if name.startswith(prefix) and os.path.join(cache_dir, name) != path and name.count('.') == 1:
+                os.remove(os.path.join(cache_dir, name))
+    except (OSError, pygame.error) as e:
+        print(f"Could not cache the map in {cache_dir}: {e}")
+    return surface
@@ -0,0 +1,178 @@
+import multiprocessing
+import os
+
+import numpy as np
+
+from road_network import GridNetwork, NO_CAR
+
+
+class SharedState:
+    """
+    Arrays in shared memory, indexed by global segment number, through which
+    neighbouring bands exchange cars. Each is double-buffered by tick parity:
+    during tick t a band writes buffer t % 2 and reads what its neighbours
+    wrote in buffer (t - 1) % 2, so one barrier per tick is enough.
+    """
+
+    def __init__(self, context, links, intersections, workers):
+        self.links = links
+        self.intersections = intersections
+        self.workers = workers
+        self._inbox_pos = context.RawArray('q', 2 * links)  # front position of a car handed over, -1 if none
+        self._inbox_id = context.RawArray('q', 2 * links)
+        self._tails = context.RawArray('q', 2 * links)  # rearmost car on each boundary segment after the tick
+        self._crossed = context.RawArray('q', intersections * 4)
+        self._stats = context.RawArray('q', workers * 4)
+        self.attach()
+        self.inbox_pos[:] = -1
+        self.tails[:] = NO_CAR
+
+    def attach(self):
+        self.inbox_pos = np.frombuffer(self._inbox_pos, dtype=np.int64).reshape(2, self.links)
+        self.inbox_id = np.frombuffer(self._inbox_id, dtype=np.int64).reshape(2, self.links)
+        self.tails = np.frombuffer(self._tails, dtype=np.int64).reshape(2, self.links)
+        self.crossed = np.frombuffer(self._crossed, dtype=np.int64).reshape(self.intersections, 4)
+        self.stats = np.frombuffer(self._stats, dtype=np.int64).reshape(self.workers, 4)
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        for name in ('inbox_pos', 'inbox_id', 'tails', 'crossed', 'stats'):
+            del state[name]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.attach()
+
+
+def run_band(index, band, rows, cols, options, shared, barrier, connection):
+    """Worker process: simulate one band of rows, exchanging boundary cars with its neighbours every tick."""
+    network = GridNetwork(rows, cols, band=band, **options)
+    network.next_id = index << 40  # car ids stay unique across bands
+    first = network.first_link
+    incoming = network.boundary_entries + first  # global numbers of the segments fed by other bands
+    targets = network.global_downstream[network.handoff_links]
+    target_slot = {int(link): slot for slot, link in enumerate(targets)}
+    # Front position of the car handed to each target on the previous tick, not yet in the neighbour's tails
+    in_flight = np.full(len(targets), NO_CAR, dtype=np.int64)
+    tick = 0
+
+    while True:
+        command, argument = connection.recv()
+        if command == 'stop':
+            break
+        if command == 'cars':
+            n = network.count
+            connection.send((network.link[:n] + first, network.pos[:n].copy(), network.car_id[:n].copy()))
+            continue
+
+        for _ in range(argument):
+            now, previous = tick % 2, (tick - 1) % 2
+            positions = shared.inbox_pos[previous, incoming]
+            arrived = positions >= 0
+            if arrived.any():
+                links = incoming[arrived]
+                network.receive(links, positions[arrived], shared.inbox_id[previous, links])
+                shared.inbox_pos[previous, links] = -1
+            network.external_tail[network.handoff_links] = np.minimum(shared.tails[previous, targets], in_flight)
+
+            network.fixed_time(tick)
+            network.step()
+
+            in_flight[:] = NO_CAR
+            if network.outbox is not None:
+                links, positions, car_ids = network.outbox
+                shared.inbox_pos[now, links] = positions
+                shared.inbox_id[now, links] = car_ids
+                in_flight[[target_slot[int(link)] for link in links]] = positions
+            shared.tails[now, incoming] = network.tails[network.boundary_entries]
+            tick += 1
+            barrier.wait()
+
+        start = network.first_intersection
+        shared.crossed[start:start + network.intersections] = network.crossed
+        shared.stats[index] = (network.count, network.spawned, network.exited, network.moving)
+        connection.send(tick)
+
+
+class PartitionedGrid:
+    """
+    A GridNetwork split into bands of rows, each simulated by its own worker
+    process on fixed-time lights. Cars crossing into the next band are handed
+    over through shared memory at the end of every tick, together with the
+    rearmost car on each boundary segment, so queues spill back across bands
+    exactly as in one process. Results are merged on request for metrics and
+    drawing. `max_cars` is a global cap split evenly between the bands, each
+    enforcing its share on its own, so a run gives the same traffic as
+    GridNetwork with the same options only as long as no band reaches its
+    share of the cap.
+    """
+
+    def __init__(self, rows, cols, workers=None, **options):
+        workers = min(workers or os.cpu_count() or 1, rows)
+        self.rows = rows
+        self.cols = cols
+        self.workers = workers
+        self.ticks = 0
+        if 'max_cars' in options:
+            options['max_cars'] = max(1, options['max_cars'] // workers)
+        # fork where available, so workers start without re-importing pygame
+        methods = multiprocessing.get_all_start_methods()
+        context = multiprocessing.get_context('fork' if 'fork' in methods else 'spawn')
+        self.shared = SharedState(context, rows * cols * 4, rows * cols, workers)
+        self.barrier = context.Barrier(workers)
+
+        self.bands = [(int(band[0]), int(band[-1]) + 1) for band in np.array_split(np.arange(rows), workers)]
+        self.connections = []
+        self.processes = []
+        for index, band in enumerate(self.bands):
+            parent, child = context.Pipe()
+            process = context.Process(target=run_band, name=f'grid-band-{index}', daemon=True,
+                                      args=(index, band, rows, cols, options, self.shared, self.barrier, child))
+            process.start()
+            child.close()
+            self.connections.append(parent)
+            self.processes.append(process)
+
+    def run(self, steps):
+        """Advance every band by `steps` ticks. Returns the merged stats."""
+        for connection in self.connections:
+            connection.send(('run', steps))
+        try:
+            for connection in self.connections:
+                self.ticks = connection.recv()
+        except EOFError:
+            # A band died; release the others from the tick barrier
+            self.barrier.abort()
+            raise RuntimeError("A grid band worker exited unexpectedly")
+        return self.stats()
+
+    def stats(self):
+        count, spawned, exited, moving = self.shared.stats.sum(axis=0)
+        return {'cars': int(count), 'spawned': int(spawned), 'exited': int(exited), 'moving': int(moving),
+                'crossings': int(self.shared.crossed.sum())}
+
+    @property
+    def crossed(self):
+        """Cars that crossed each intersection per approach, as of the end of the last run()."""
+        return self.shared.crossed.copy()
+
+    def cars(self):
+        """Every car as (global segment, front position, car id) arrays, merged across bands."""
+        for connection in self.connections:
+            connection.send(('cars', None))
+        parts = [connection.recv() for connection in self.connections]
+        return tuple(np.concatenate(column) for column in zip(*parts))
+
+    def close(self):
+        for connection, process in zip(self.connections, self.processes):
+            if process.is_alive():
+                connection.send(('stop', None))
+            process.join()
+        self.processes = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,99 @@
+import json
+import os
+import stat
+import tempfile
+import threading
+import time
+
+
+class WriteBehindStore:
+    """
+    Write-behind persistence for the server's in-memory state. Request handlers
+    only call mark_dirty(); a background thread writes a snapshot at most once
+    every `interval` seconds, and stop() writes a final one on shutdown.
+
+    Each write goes to a temporary file in the same directory, is fsynced and
+    then renamed over the data file, so a crash mid-write leaves the previous
+    snapshot intact instead of a truncated file.
+    """
+
+    def __init__(self, path, snapshot, interval=1.0):
+        self.path = path
+        self.snapshot = snapshot  # callable returning the JSON-serialisable state
+        self.interval = interval
+        self.dirty = False
+        self.flush_count = 0
+        self.last_flush_duration = 0.0
+        self._lock = threading.Lock()  # one writer at a time
+        self._stopping = threading.Event()
+        self._thread = None
+
+    def mark_dirty(self):
+        self.dirty = True
+
+    def start(self):
+        if self._thread is None:
+            self._stopping.clear()
+            self._thread = threading.Thread(target=self._run, name="write-behind", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        """Stop the flush thread and write any unsaved changes."""
+        self._stopping.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.flush()
+
+    def _run(self):
+        while not self._stopping.wait(self.interval):
+            self.flush()
+
+    def flush(self, force=False):
+        """Write a snapshot if anything changed since the last one. Returns True if a file was written."""
+        with self._lock:
+            if not (self.dirty or force):
+                return False
+            # Clear first: a change made while we write marks the store dirty again
+            self.dirty = False
+            start = time.perf_counter()
+            try:
+                self._write_atomic(self._take_snapshot())
+            except Exception as e:
+                self.dirty = True
+                print(f"Error saving data: {e}")
+                return False
+            self.last_flush_duration = time.perf_counter() - start
+            self.flush_count += 1
+            return True
+
+    def _take_snapshot(self):
+        # Handlers may mutate the state while we copy it; just try again
+        for _ in range(3):
+            try:
+                return self.snapshot()
+            except RuntimeError:
+                continue
+        return self.snapshot()
+
+    def _write_atomic(self, data):
+        directory = os.path.dirname(os.path.abspath(self.path))
+        fd, tmp_path = tempfile.mkstemp(prefix=".tmp-", suffix=".json", dir=directory)
+        try:
+            with os.fdopen(fd, "w") as f:
+                json.dump(data, f, separators=(",", ":"))
+                f.flush()
+                os.fsync(f.fileno())
+            # mkstemp creates the file as 0600; keep the data file's mode across the replace
+            try:
+                mode = stat.S_IMODE(os.stat(self.path).st_mode)
+            except FileNotFoundError:
+                mode = 0o644
+            os.chmod(tmp_path, mode)
+            os.replace(tmp_path, self.path)
+        except BaseException:
+            try:
+                os.unlink(tmp_path)
+            except OSError:
+                pass
+            raise
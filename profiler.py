@@ -0,0 +1,78 @@
+import csv
+import time
+
+import numpy as np
+
+
+class FrameProfiler:
+    """
+    Per-phase frame timings with rolling percentiles. Each frame is timed as
+    laps: start_frame() starts the clock and lap(phase) charges the time since
+    the previous lap to `phase`, so timing a phase costs one perf_counter()
+    call. The last `window` frames are kept in a fixed array; percentiles are
+    only computed when asked for. With `csv_path`, every frame is also
+    written as a row of milliseconds per phase.
+    """
+
+    def __init__(self, phases, window=300, csv_path=None):
+        self.phases = list(phases)
+        self.index = {phase: i for i, phase in enumerate(self.phases)}
+        self.window = window
+        self.samples = np.zeros((window, len(self.phases) + 1))  # seconds; last column is the frame total
+        self.frames = 0
+        self.current = [0.0] * len(self.phases)
+        self._frame_start = self._last = time.perf_counter()
+        self._stats = None
+        self._stats_frame = -1
+
+        self._csv_file = None
+        if csv_path:
+            self._csv_file = open(csv_path, 'w', newline='')
+            self._csv = csv.writer(self._csv_file)
+            self._csv.writerow(['frame'] + [f'{phase}_ms' for phase in self.phases] + ['total_ms'])
+
+    def start_frame(self):
+        self.current = [0.0] * len(self.phases)
+        self._frame_start = self._last = time.perf_counter()
+
+    def lap(self, phase):
+        now = time.perf_counter()
+        self.current[self.index[phase]] += now - self._last
+        self._last = now
+
+    def end_frame(self):
+        total = self._last - self._frame_start
+        row = self.samples[self.frames % self.window]
+        row[:-1] = self.current
+        row[-1] = total
+        if self._csv_file is not None:
+            self._csv.writerow([self.frames] + [f'{t * 1000:.3f}' for t in self.current] + [f'{total * 1000:.3f}'])
+        self.frames += 1
+
+    def percentiles(self, refresh=15):
+        """
+        {phase: (p50, p95, p99)} in milliseconds over the recent frames, plus
+        'total' for the whole frame. Recomputed at most every `refresh` frames.
+        """
+        if self._stats is None or self.frames - self._stats_frame >= refresh:
+            recent = self.samples[:min(self.frames, self.window)]
+            if len(recent) == 0:
+                return {}
+            p50, p95, p99 = np.percentile(recent, (50, 95, 99), axis=0) * 1000
+            names = self.phases + ['total']
+            self._stats = {name: (p50[i], p95[i], p99[i]) for i, name in enumerate(names)}
+            self._stats_frame = self.frames
+        return self._stats
+
+    def report(self):
+        """The percentiles as printable lines, slowest phase (by p95) first."""
+        stats = self.percentiles(refresh=0)
+        lines = [f"{'phase':<12} {'p50':>7} {'p95':>7} {'p99':>7}  ms"]
+        for name, (p50, p95, p99) in sorted(stats.items(), key=lambda item: -item[1][1]):
+            lines.append(f"{name:<12} {p50:7.2f} {p95:7.2f} {p99:7.2f}")
+        return lines
+
+    def close(self):
+        if self._csv_file is not None:
+            self._csv_file.close()
+            self._csv_file = None
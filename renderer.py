@@ -0,0 +1,117 @@
+import pygame
+
+from draw_objects import draw_traffic_light
+
+CAR_LAYER = 0
+LIGHT_LAYER = 1
+HUD_LAYER = 2
+
+
+class PlacedSprite(pygame.sprite.DirtySprite):
+    """An image at a position on screen, marked dirty only when either changes."""
+
+    def __init__(self, image, position, layer):
+        super().__init__()
+        self._layer = layer
+        self.image = image
+        self.rect = image.get_rect(topleft=position)
+        self.key = None  # What the image was drawn from, to skip redrawing it unchanged
+
+    def place(self, image, position):
+        if image is not self.image:
+            self.image = image
+            self.rect = image.get_rect(topleft=position)
+            self.dirty = 1
+        elif self.rect.topleft != position:
+            self.rect.topleft = position
+            self.dirty = 1
+
+
+class DirtyRenderer:
+    """
+    Draws the window as layers of dirty sprites over a static background
+    (the map) composed once. Each frame, the caller places the cars, lights
+    and HUD text it wants shown; a sprite is only redrawn when its image or
+    position changed, and draw() erases and redraws just those areas, so only
+    the rectangles it returns need pushing to the display. Cars are drawn through
+    proxy sprites, so the simulation's own sprite groups are left alone.
+    Anything not placed again in a frame is removed from the screen.
+    """
+
+    def __init__(self, screen, background):
+        self.screen = screen
+        self.background = background.convert()
+        self.group = pygame.sprite.LayeredDirty()
+        self.group.clear(screen, self.background)
+        self.cars = {}      # car -> PlacedSprite
+        self.overlays = {}  # name -> PlacedSprite
+        self._placed = set()
+        self._text = {}     # (font, text, color) -> rendered surface, for the current frame and the last
+        self._last_text = {}
+        screen.blit(self.background, (0, 0))
+        pygame.display.flip()
+
+    def place_cars(self, cars, positions):
+        """Show exactly these cars this frame, each car's image at its position."""
+        placed = {}
+        for car, position in zip(cars, positions):
+            sprite = self.cars.pop(car, None)
+            if sprite is None:
+                sprite = PlacedSprite(car.image, position, CAR_LAYER)
+                self.group.add(sprite)
+            else:
+                sprite.place(car.image, position)
+            placed[car] = sprite
+        for sprite in self.cars.values():
+            sprite.kill()
+        self.cars = placed
+
+    def place(self, name, image, position, layer=HUD_LAYER, key=None):
+        """
+        Show `image` at `position` under `name` this frame. With a `key`, the
+        image is only taken when the key differs from the last frame's, so
+        callers can skip drawing an unchanged image by passing a cached one.
+        """
+        self._placed.add(name)
+        sprite = self.overlays.get(name)
+        if sprite is None:
+            sprite = self.overlays[name] = PlacedSprite(image, position, layer)
+            sprite.key = key
+            self.group.add(sprite)
+        elif key is None or key != sprite.key:
+            sprite.place(image, position)
+            sprite.key = key
+            sprite.dirty = 1  # A new image of the same size still needs drawing
+        else:
+            sprite.place(sprite.image, position)
+
+    def place_light(self, light):
+        """Show a traffic light, redrawing its image only when its lamps change."""
+        name = ('light', light['id'])
+        key = (light['red'], light['yellow'], light['green'])
+        sprite = self.overlays.get(name)
+        image = None
+        if sprite is None or sprite.key != key:
+            vertical = light['direction'] in ['left', 'right']
+            image = pygame.Surface((20, 60) if vertical else (60, 20), pygame.SRCALPHA)
+            draw_traffic_light(image, (0, 0), light['red'], light['yellow'], light['green'], light['direction'])
+        self.place(name, image, light['pos'], LIGHT_LAYER, key)
+
+    def place_text(self, name, font, text, color, position):
+        """Show a line of text, rendering it only when it differs from the last frame's."""
+        key = (font, text, color)
+        image = self._text.get(key) or self._last_text.get(key)
+        if image is None:
+            image = font.render(text, True, color)
+        self._text[key] = image
+        self.place(name, image, position, HUD_LAYER, key)
+
+    def draw(self):
+        """Erase and redraw what changed this frame. Returns the changed areas, for pygame.display.update()."""
+        for name in list(self.overlays):
+            if name not in self._placed:
+                self.overlays.pop(name).kill()
+        self._placed = set()
+        self._last_text, self._text = self._text, {}
+
+        return self.group.draw(self.screen, self.background)
@@ -0,0 +1,262 @@
+import numpy as np
+
+from settings import STEPS_PER_SECOND
+from telemetry import RED, YELLOW, GREEN
+from lanes import LIGHT_FOR_DIRECTION
+from vector_engine import SPAWN_DIRECTIONS, COUNTER_FOR_DIRECTION, UP_DOWN, DOWN_UP, LEFT_RIGHT, RIGHT_LEFT
+
+# Light order within an intersection; ids follow settings.traffic_lights (1..4 for the first junction)
+LIGHT_DIRECTIONS = ('up', 'left', 'down', 'right')
+# Index into LIGHT_DIRECTIONS of the light gating each approach, by spawn direction code
+APPROACH_LIGHT = np.array([LIGHT_DIRECTIONS.index(LIGHT_FOR_DIRECTION[d]) for d in SPAWN_DIRECTIONS])
+VERTICAL_LIGHTS = [LIGHT_DIRECTIONS.index('up'), LIGHT_DIRECTIONS.index('down')]
+HORIZONTAL_LIGHTS = [LIGHT_DIRECTIONS.index('left'), LIGHT_DIRECTIONS.index('right')]
+
+CAR_LENGTH = 20
+MIN_GAP = 6
+# Positions are packed below the link index into one sort key
+POSITION_BITS = 20
+NO_CAR = np.iinfo(np.int32).max
+# Downstream of a segment: the grid edge, or a segment simulated by another partition
+EXIT, HANDOFF = -1, -2
+
+
+class GridNetwork:
+    """
+    A rows x cols grid of intersections, each with its own four lights,
+    joined by single-lane road segments. Every segment is the approach of one
+    intersection from one direction, so link = intersection * 4 + spawn
+    direction code, and a car crossing an intersection continues on the same
+    direction's approach of the next one. Approaches on the edge of the grid
+    are where cars enter, and crossing an edge intersection outward leaves the
+    network.
+
+    Cars are rows in NumPy arrays (segment and position of the front bumper
+    along it), kept sorted by segment and position so the car ahead is the
+    next row. A tick moves every car by its speed unless that would close the
+    gap to the car ahead, pass a stop line that is not green, or enter a next
+    segment that is full, so queues spill back through the grid.
+
+    With `band=(first_row, end_row)` only those rows of the grid are
+    simulated, as one partition of a parallel_network.PartitionedGrid. Segments are
+    then numbered locally from the band's first one; cars crossing into
+    another band are left in `outbox` instead, and the rearmost car on each
+    segment they would enter is given in `external_tail`.
+    """
+
+    def __init__(self, rows, cols, block_length=200, speed=2, spawn_interval=60, max_cars=1_000_000,
+                 capacity=1024, seed=None, band=None):
+        self.rows = rows
+        self.cols = cols
+        first_row, end_row = band or (0, rows)
+        self.first_intersection = first_row * cols
+        self.intersections = (end_row - first_row) * cols
+        self.block_length = block_length
+        self.speed = speed
+        self.spawn_interval = spawn_interval
+        self.max_cars = max_cars
+
+        # The layout of the whole grid, cut down to the band below, so that
+        # every band sees the same segment numbers and spawn timers
+        row, col = np.divmod(np.arange(rows * cols), cols)
+        # Next intersection straight ahead for each spawn direction, or -1 at the edge
+        ahead = np.full((rows * cols, len(SPAWN_DIRECTIONS)), -1, dtype=np.int64)
+        ahead[:, UP_DOWN] = np.where(row + 1 < rows, (row + 1) * cols + col, -1)
+        ahead[:, DOWN_UP] = np.where(row > 0, (row - 1) * cols + col, -1)
+        ahead[:, LEFT_RIGHT] = np.where(col + 1 < cols, row * cols + col + 1, -1)
+        ahead[:, RIGHT_LEFT] = np.where(col > 0, row * cols + col - 1, -1)
+        codes = np.arange(len(SPAWN_DIRECTIONS))
+        downstream = np.where(ahead >= 0, ahead * 4 + codes, EXIT).ravel()
+        # Entry segments: no segment feeds them
+        fed = np.zeros(len(downstream), dtype=bool)
+        fed[downstream[downstream >= 0]] = True
+        entries = np.flatnonzero(~fed)
+        # Stagger the entry timers so the edges do not all spawn on the same tick
+        rng = np.random.default_rng(seed)
+        spawn_timers = rng.integers(0, max(spawn_interval, 1), len(entries))
+
+        self.first_link = self.first_intersection * 4
+        self.links = self.intersections * 4
+        end_link = self.first_link + self.links
+        # Global number of the segment each one feeds, for handing cars to another band
+        self.global_downstream = downstream[self.first_link:end_link]
+        inside = (self.global_downstream >= self.first_link) & (self.global_downstream < end_link)
+        self.downstream = np.where(inside, self.global_downstream - self.first_link,
+                                   np.where(self.global_downstream == EXIT, EXIT, HANDOFF))
+        self.handoff_links = np.flatnonzero(self.downstream == HANDOFF)
+        # Segments fed from another band
+        fed_here = np.zeros(self.links, dtype=bool)
+        fed_here[self.downstream[inside]] = True
+        self.boundary_entries = np.flatnonzero(fed[self.first_link:end_link] & ~fed_here)
+        in_band = (entries >= self.first_link) & (entries < end_link)
+        self.entries = entries[in_band] - self.first_link
+        self.spawn_timers = spawn_timers[in_band]
+        self.external_tail = np.full(self.links, NO_CAR, dtype=np.int64)
+        self.outbox = None
+        # Index into the flattened light array of the light at the end of each segment
+        self.link_light = (np.arange(self.intersections)[:, None] * 4 + APPROACH_LIGHT[codes]).ravel()
+
+        self.light_bits = np.full((self.intersections, len(LIGHT_DIRECTIONS)), RED, dtype=np.uint8)
+        # Cars that crossed each intersection, per approach
+        self.crossed = np.zeros((self.intersections, len(SPAWN_DIRECTIONS)), dtype=np.int64)
+        # Front position of the rearmost car per segment after the last tick
+        self.tails = np.full(self.links, NO_CAR, dtype=np.int64)
+        self.spawned = 0
+        self.exited = 0
+        self.moving = 0  # cars that advanced on the last tick
+
+        self.count = 0
+        self.next_id = 0
+        self.link = np.zeros(capacity, dtype=np.int32)
+        self.pos = np.zeros(capacity, dtype=np.int32)
+        self.car_id = np.zeros(capacity, dtype=np.int64)
+
+    def __len__(self):
+        return self.count
+
+    def _grow(self, needed):
+        capacity = len(self.link)
+        if needed <= capacity:
+            return
+        while capacity < needed:
+            capacity *= 2
+        for name in ('link', 'pos', 'car_id'):
+            old = getattr(self, name)
+            new = np.zeros(capacity, dtype=old.dtype)
+            new[:self.count] = old[:self.count]
+            setattr(self, name, new)
+
+    def light_id(self, intersection, direction):
+        return (self.first_intersection + intersection) * len(LIGHT_DIRECTIONS) + LIGHT_DIRECTIONS.index(direction) + 1
+
+    def lights(self, intersection):
+        """One intersection's lights as dicts like settings.traffic_lights, without positions."""
+        return [{'id': self.light_id(intersection, direction), 'direction': direction,
+                 'red': bool(bits & RED), 'yellow': bool(bits & YELLOW), 'green': bool(bits & GREEN)}
+                for direction, bits in zip(LIGHT_DIRECTIONS, self.light_bits[intersection])]
+
+    def set_lights(self, intersection, lights):
+        """Set an intersection's lights from dicts with 'direction' and red/yellow/green flags."""
+        for light in lights:
+            bits = (RED if light.get('red') else 0) | (YELLOW if light.get('yellow') else 0) | (GREEN if light.get('green') else 0)
+            self.light_bits[intersection, LIGHT_DIRECTIONS.index(light['direction'])] = bits
+
+    def fixed_time(self, tick, green=10 * STEPS_PER_SECOND, yellow=2 * STEPS_PER_SECOND, offsets=0):
+        """
+        Run every intersection on a two-phase fixed-time plan: vertical green,
+        vertical yellow, horizontal green, horizontal yellow. `offsets` (ticks,
+        a scalar or one per intersection) shifts each plan, e.g. for a green wave.
+        """
+        phase = (tick + np.broadcast_to(offsets, (self.intersections,))) % (2 * (green + yellow))
+        vertical = np.where(phase < green, GREEN, np.where(phase < green + yellow, YELLOW, RED))
+        phase = phase - (green + yellow)
+        horizontal = np.where((phase >= 0) & (phase < green), GREEN,
+                              np.where((phase >= green) & (phase < green + yellow), YELLOW, RED))
+        self.light_bits[:, VERTICAL_LIGHTS] = vertical[:, None]
+        self.light_bits[:, HORIZONTAL_LIGHTS] = horizontal[:, None]
+
+    def conflicts(self):
+        """Intersections with green lights on both axes, the grid version of main.check_for_accidents."""
+        green = (self.light_bits & GREEN) != 0
+        return np.flatnonzero(green[:, VERTICAL_LIGHTS].any(axis=1) & green[:, HORIZONTAL_LIGHTS].any(axis=1))
+
+    def lane_counters(self, intersection):
+        """Cars that crossed one intersection, keyed like main.lane_counters."""
+        return {COUNTER_FOR_DIRECTION[d]: int(self.crossed[intersection, code]) for code, d in enumerate(SPAWN_DIRECTIONS)}
+
+    def receive(self, links, positions, car_ids):
+        """Add cars handed over by another band, on global segment numbers."""
+        added = len(links)
+        self._grow(self.count + added)
+        start, end = self.count, self.count + added
+        self.link[start:end] = links - self.first_link
+        self.pos[start:end] = positions
+        self.car_id[start:end] = car_ids
+        self.count = end
+
+    def step(self):
+        """
+        Advance one tick: move cars, hand those crossing an intersection to
+        the next segment, drop those leaving the grid, then spawn on entry
+        segments whose timer is due and that have room. Returns (spawned, exited).
+        """
+        n = self.count
+        length = self.block_length
+        tail = np.full(self.links, NO_CAR, dtype=np.int64)  # rearmost car's front position per segment
+        self.tails = np.full(self.links, NO_CAR, dtype=np.int64)
+        self.outbox = None
+        exited = 0
+        if n:
+            # Nearly sorted from the previous tick, which the stable sort handles in close to linear time
+            order = np.argsort((self.link[:n].astype(np.int64) << POSITION_BITS) | self.pos[:n], kind='stable')
+            link = self.link[:n][order]
+            pos = self.pos[:n][order].astype(np.int64)
+            self.car_id[:n] = self.car_id[:n][order]
+
+            new_link = np.ones(n, dtype=bool)
+            new_link[1:] = link[1:] != link[:-1]
+            head = np.ones(n, dtype=bool)
+            head[:-1] = new_link[1:]
+            tail[link[new_link]] = pos[new_link]
+
+            # Furthest each car may go: behind the car ahead, or for the front
+            # car the stop line, or if green, behind the next segment's last car
+            limit = np.empty(n, dtype=np.int64)
+            limit[:-1] = pos[1:] - CAR_LENGTH - MIN_GAP
+            front = link[head]
+            down = self.downstream[front]
+            rear = np.where(down >= 0, tail[down], np.where(down == HANDOFF, self.external_tail[front], NO_CAR))
+            room = rear + length - CAR_LENGTH - MIN_GAP
+            green = (self.light_bits.ravel()[self.link_light[front]] & GREEN) != 0
+            limit[head] = np.where(green, room, length)
+            new_pos = np.maximum(np.minimum(pos + self.speed, limit), pos)
+            self.moving = int((new_pos > pos).sum())
+
+            crossing = new_pos > length
+            # Cars keep their order on a segment, so the rearmost one stays first unless it left
+            rearmost = new_link & ~crossing
+            self.tails[link[rearmost]] = new_pos[rearmost]
+            if crossing.any():
+                crossed_links = link[crossing]
+                self.crossed += np.bincount(crossed_links, minlength=self.links).reshape(self.crossed.shape)
+                link = link.copy()
+                link[crossing] = self.downstream[crossed_links]
+                new_pos[crossing] -= length
+                # Each segment has one feeder, so at most one car arrives per segment and tick
+                arrived = np.flatnonzero(crossing & (link >= 0))
+                self.tails[link[arrived]] = np.minimum(self.tails[link[arrived]], new_pos[arrived])
+                handed = np.flatnonzero(link == HANDOFF)
+                if len(handed):
+                    self.outbox = (self.global_downstream[crossed_links[link[crossing] == HANDOFF]],
+                                   new_pos[handed], self.car_id[:n][handed])
+            keep = link >= 0
+            exited = int((link == EXIT).sum())
+            n = int(keep.sum())
+            self.link[:n] = link[keep]
+            self.pos[:n] = new_pos[keep]
+            self.car_id[:n] = self.car_id[:self.count][keep]
+            self.count = n
+            self.exited += exited
+
+        # New cars start with their rear at the segment start; the tail only moved forward this tick
+        self.spawn_timers += 1
+        due = self.spawn_timers >= self.spawn_interval
+        ready = self.entries[due & (tail[self.entries] - 2 * CAR_LENGTH >= MIN_GAP)]
+        ready = ready[:max(0, self.max_cars - self.count)]
+        self.spawn_timers[np.isin(self.entries, ready)] = 0
+        spawned = len(ready)
+        if spawned:
+            self._grow(self.count + spawned)
+            start, end = self.count, self.count + spawned
+            self.link[start:end] = ready
+            self.pos[start:end] = CAR_LENGTH
+            self.tails[ready] = CAR_LENGTH
+            self.car_id[start:end] = np.arange(self.next_id, self.next_id + spawned)
+            self.next_id += spawned
+            self.count = end
+            self.spawned += spawned
+        return spawned, exited
+
+    def cars_per_intersection(self):
+        """Cars on the approaches of each intersection."""
+        return np.bincount(self.link[:self.count] // len(SPAWN_DIRECTIONS), minlength=self.intersections)
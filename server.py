@@ -1,16 +1,43 @@
-from fastapi import FastAPI, HTTPException, Depends, status
+from fastapi import FastAPI, HTTPException, Depends, status, WebSocket, WebSocketDisconnect, Query, Response, Request
+from fastapi.responses import JSONResponse, PlainTextResponse
+from starlette.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel, Field, validator
 from typing import List, Dict, Optional, Any
 from datetime import datetime
+from contextlib import asynccontextmanager
+import asyncio
+import collections
+import copy
 import json
 import os
-from settings import width, height, traffic_lights
+import threading
+import time
+import uuid
+from settings import width, height, traffic_lights, pattern_lights, migrate_light_ids
+from telemetry import TelemetryHub, LANES, CONFLICT_INCIDENT, decode, light_bits, snapshot_message, lights_message
+from persistence import WriteBehindStore
+from accident_log import AccidentLogStore
+from incidents import IncidentTracker
+from history import ThroughputHistory
+from metrics import Registry, RequestMetrics, METRIC_NAME
+
+@asynccontextmanager
+async def lifespan(app):
+    # Write-behind persistence: flush on an interval while running and once more on shutdown
+    store.start()
+    history.start()
+    yield
+    history.stop()
+    incidents.close_all()
+    store.stop()
+    accidents.close()
 
 app = FastAPI(
     title="Traffic Control API",
     description="API for managing traffic simulation and control system",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
 # Enable CORS
@@ -22,8 +49,24 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Prometheus metrics, served at /metrics
+metrics = Registry()
+http_requests = metrics.counter("traffic_http_requests_total", "HTTP requests by route, method and status",
+                                ("route", "method", "status"))
+http_latency = metrics.histogram("traffic_http_request_duration_seconds", "HTTP request latency by route", ("route",))
+app.add_middleware(RequestMetrics, requests_total=http_requests, request_duration=http_latency)
+
 # Data persistence
 DATA_FILE = "traffic_data.json"
+# Append-only accident log, one JSON object per line
+ACCIDENT_LOG_FILE = "accident_log.jsonl"
+# Seconds between write-behind flushes of the data file
+FLUSH_INTERVAL = float(os.environ.get("TRAFFIC_FLUSH_INTERVAL", "1.0"))
+# Seconds a condition must stay clear before its incident is closed
+INCIDENT_DEBOUNCE = float(os.environ.get("TRAFFIC_INCIDENT_DEBOUNCE", "2.0"))
+
+# Guards lane_counters, which several simulators update concurrently
+counters_lock = threading.Lock()
 
 # Initial lane counters for each direction
 lane_counters = {
@@ -52,16 +95,45 @@ class LightStatus(BaseModel):
         # For complex validations involving multiple lights, use a dependency instead
         return green_value
 
+class LightBatch(BaseModel):
+    lights: List[LightStatus] = Field(..., description="New states for some or all of the lights")
+    expected_version: Optional[int] = Field(default=None, description="Only apply if the light state is still at this version")
+    allow_conflicts: bool = Field(default=False, description="Apply even if the result has green lights on both axes")
+
+class SimulationMetrics(BaseModel):
+    source: str = Field(default="simulator", description="Which simulator the values come from")
+    gauges: Dict[str, float] = Field(..., description="Gauge values by name, e.g. frame_time_seconds")
+
 class LaneCounter(BaseModel):
     top: int = Field(default=0, ge=0, description="Number of cars from top lane")
     bottom: int = Field(default=0, ge=0, description="Number of cars from bottom lane")
     left: int = Field(default=0, ge=0, description="Number of cars from left lane")
     right: int = Field(default=0, ge=0, description="Number of cars from right lane")
 
+class LaneCounterIncrement(BaseModel):
+    top: int = Field(default=0, ge=0, description="Cars to add to the top lane")
+    bottom: int = Field(default=0, ge=0, description="Cars to add to the bottom lane")
+    left: int = Field(default=0, ge=0, description="Cars to add to the left lane")
+    right: int = Field(default=0, ge=0, description="Cars to add to the right lane")
+
+class LaneCounterBatch(BaseModel):
+    increments: List[LaneCounterIncrement] = Field(..., description="Increments, e.g. one per tick, applied together")
+
 class AccidentLog(BaseModel):
     message: str = Field(..., description="Accident description")
     is_accident: bool = Field(default=True, description="Whether this is an actual accident")
     timestamp: str = Field(default_factory=lambda: datetime.now().isoformat(), description="When the accident occurred")
+    incident_id: Optional[str] = Field(default=None, description="Set when the entry records a closed incident")
+    ended: Optional[str] = Field(default=None, description="When the incident ended")
+    duration: Optional[float] = Field(default=None, description="Incident duration in seconds")
+    peak_severity: Optional[int] = Field(default=None, description="Highest severity reported during the incident")
+
+class IncidentReport(BaseModel):
+    kind: str = Field(default=CONFLICT_INCIDENT, description="What kind of condition this is")
+    active: bool = Field(..., description="True when the condition starts, False when it ends")
+    severity: int = Field(default=1, ge=0, description="How bad it is, e.g. the number of conflicting green lights")
+    message: str = Field(default="", description="Description of the condition")
+    source: Optional[str] = Field(default=None, description="Who is reporting, e.g. a simulator name")
 
 class TrafficPattern(BaseModel):
     name: str = Field(..., description="Name of the traffic pattern")
@@ -74,64 +146,210 @@ class Statistics(BaseModel):
     accidents: int
     timestamp: str
 
-# Storage for accident logs with timestamp
-accident_logs = []
+# Accident logs live on disk; only a timestamp index is kept in memory
+accidents = AccidentLogStore(ACCIDENT_LOG_FILE)
+
+incidents_closed = metrics.counter("traffic_incidents_total", "Incidents closed, by kind", ("kind",))
+
+def incident_closed(incident):
+    """Record a finished incident as a single accident log entry."""
+    incidents_closed.inc(incident['kind'])
+    accidents.append({
+        "message": f"{incident['message'] or incident['kind']} ({incident['duration']:.1f}s)",
+        "is_accident": True,
+        "timestamp": incident['started'],
+        "incident_id": incident['id'],
+        "ended": incident['ended'],
+        "duration": incident['duration'],
+        "peak_severity": incident['peak_severity']
+    })
+
+# Open incidents; clients report only when a condition starts or ends
+incidents = IncidentTracker(incident_closed, debounce=INCIDENT_DEBOUNCE)
+
+CONFLICT_MESSAGE = "WARNING: Potential accident! Conflicting green lights detected."
+
+def conflicting_greens(lights=None):
+    """Number of green lights when both axes are green at once, otherwise 0."""
+    lights = traffic_lights if lights is None else lights
+    horizontal_green = sum(1 for light in lights if light['direction'] in ['left', 'right'] and light['green'])
+    vertical_green = sum(1 for light in lights if light['direction'] in ['up', 'down'] and light['green'])
+    return horizontal_green + vertical_green if horizontal_green and vertical_green else 0
 
-# Storage for traffic patterns
+# Per-second lane throughput and light states, rolled up to minutes and hours
+history = ThroughputHistory(LANES, [light['id'] for light in traffic_lights],
+                            lambda: [light_bits(light) for light in traffic_lights])
+# Most buckets one /history response may hold
+MAX_HISTORY_POINTS = 5000
+
+# Guards traffic_lights, so a change is applied and versioned as a whole
+lights_lock = threading.Lock()
+
+# WebSocket subscribers, and a version that is bumped on every light change so
+# clients can tell which state a message describes
+hub = TelemetryHub()
+light_state_version = 0
+
+# Versions restart with the server, so ETags also carry an id for this run
+BOOT_ID = uuid.uuid4().hex[:8]
+# Recent light states by version, for "changes since version N" responses
+LIGHT_HISTORY = 256
+light_history = collections.deque(maxlen=LIGHT_HISTORY)
+# Longest a GET /traffic-lights may wait for a change, in seconds
+MAX_LONG_POLL = 30.0
+# (event loop, future) of every waiting long-poll request
+light_waiters = set()
+
+def light_states():
+    return {light['id']: (light['red'], light['yellow'], light['green']) for light in traffic_lights}
+
+def light_etag(version=None):
+    return f'"{BOOT_ID}-{light_state_version if version is None else version}"'
+
+def version_from_etag(etag):
+    """The light state version an ETag from this server run names, otherwise None."""
+    if etag and etag.startswith(f'"{BOOT_ID}-'):
+        try:
+            return int(etag.strip('"').split('-', 1)[1])
+        except ValueError:
+            pass
+    return None
+
+def release_waiter(waiter):
+    if not waiter.done():
+        waiter.set_result(None)
+
+async def wait_for_light_change(version, timeout):
+    """Wait until the light state moves past `version` or `timeout` seconds pass."""
+    loop = asyncio.get_running_loop()
+    entry = (loop, loop.create_future())
+    light_waiters.add(entry)
+    try:
+        # Checked after registering, so a change in between is not missed
+        if light_state_version == version:
+            await asyncio.wait_for(entry[1], timeout)
+    except asyncio.TimeoutError:
+        pass
+    finally:
+        light_waiters.discard(entry)
+
+def lights_changed():
+    """Bump the light state version and push the new states to WebSocket subscribers."""
+    global light_state_version
+    light_state_version += 1
+    light_history.append((light_state_version, light_states()))
+    hub.publish(lights_message(light_state_version, traffic_lights))
+    for loop, waiter in list(light_waiters):
+        try:
+            loop.call_soon_threadsafe(release_waiter, waiter)
+        except RuntimeError:
+            pass  # The event loop has shut down
+    # Light changes are the edges of the conflict condition
+    severity = conflicting_greens()
+    incidents.report(CONFLICT_INCIDENT, severity > 0, severity, CONFLICT_MESSAGE, source="server")
+
+# Storage for traffic patterns, addressing the crossroad's lights by their ids
 traffic_patterns = {
     "all_red": {
         "description": "All lights are red - emergency situation",
-        "lights": [
-            {"id": i, "red": True, "yellow": False, "green": False} for i in range(len(traffic_lights))
-        ]
+        "lights": pattern_lights(())
     },
     "north_south_flow": {
         "description": "Allow north-south traffic flow",
-        "lights": [
-            {"id": 0, "red": False, "yellow": False, "green": True},  # up direction
-            {"id": 1, "red": False, "yellow": False, "green": True},  # down direction
-            {"id": 2, "red": True, "yellow": False, "green": False},  # left direction
-            {"id": 3, "red": True, "yellow": False, "green": False}   # right direction
-        ]
+        "lights": pattern_lights(('up', 'down'))
     },
     "east_west_flow": {
         "description": "Allow east-west traffic flow",
-        "lights": [
-            {"id": 0, "red": True, "yellow": False, "green": False},  # up direction
-            {"id": 1, "red": True, "yellow": False, "green": False},  # down direction
-            {"id": 2, "red": False, "yellow": False, "green": True},  # left direction
-            {"id": 3, "red": False, "yellow": False, "green": True}   # right direction
-        ]
+        "lights": pattern_lights(('left', 'right'))
     }
 }
 
 # Function to load data from file
 def load_data():
-    global lane_counters, accident_logs, traffic_patterns
+    global lane_counters, traffic_patterns
     try:
         if os.path.exists(DATA_FILE):
             with open(DATA_FILE, 'r') as f:
                 data = json.load(f)
                 lane_counters = data.get('lane_counters', lane_counters)
-                accident_logs = data.get('accident_logs', accident_logs)
                 traffic_patterns = data.get('traffic_patterns', traffic_patterns)
+                # Patterns saved with the old 0..3 light numbering address the lights by id again
+                for pattern in traffic_patterns.values():
+                    lights = migrate_light_ids(pattern['lights'])
+                    if lights is not pattern['lights']:
+                        pattern['lights'] = lights
+                        store.mark_dirty()
+                # Older data files kept the logs inline; move them to the accident log
+                legacy_logs = data.get('accident_logs')
+                if legacy_logs:
+                    if not len(accidents):
+                        accidents.extend(legacy_logs)
+                    store.mark_dirty()
     except Exception as e:
         print(f"Error loading data: {e}")
 
-# Function to save data to file
+# Copy of the persisted state, taken by the write-behind flush thread
+def snapshot_data():
+    with counters_lock:
+        counters = dict(lane_counters)
+    return {
+        'lane_counters': counters,
+        'traffic_patterns': copy.deepcopy(traffic_patterns)
+    }
+
+store = WriteBehindStore(DATA_FILE, snapshot_data, interval=FLUSH_INTERVAL)
+
+# Function to save data to file. Handlers only mark the state dirty; the
+# store writes it out atomically in the background (see persistence.py).
 def save_data():
-    try:
-        with open(DATA_FILE, 'w') as f:
-            json.dump({
-                'lane_counters': lane_counters,
-                'accident_logs': accident_logs,
-                'traffic_patterns': traffic_patterns
-            }, f, indent=2)
-    except Exception as e:
-        print(f"Error saving data: {e}")
+    store.mark_dirty()
 
 # Load data when server starts
 load_data()
+light_history.append((light_state_version, light_states()))
+
+# State that is already kept elsewhere is read when /metrics is scraped, not on every change
+metrics.callback("traffic_lane_cars_total", "Cars counted per lane", lambda: {(lane,): count for lane, count in lane_counters.items()},
+                 ("lane",), kind="counter")
+metrics.callback("traffic_accidents_total", "Accident log entries marked as accidents", lambda: accidents.accident_count,
+                 kind="counter")
+metrics.callback("traffic_accident_log_entries", "Entries in the accident log", lambda: len(accidents))
+metrics.callback("traffic_incidents_open", "Incidents currently open", lambda: len(incidents.current()))
+metrics.callback("traffic_light_state", "Light bits per traffic light (red=1, yellow=2, green=4)",
+                 lambda: {(light['id'], light['direction']): light_bits(light) for light in traffic_lights},
+                 ("light", "direction"))
+metrics.callback("traffic_light_green", "1 while a traffic light is green",
+                 lambda: {(light['id'], light['direction']): int(light['green']) for light in traffic_lights},
+                 ("light", "direction"))
+metrics.callback("traffic_light_state_version", "Light state version", lambda: light_state_version)
+metrics.callback("traffic_persistence_flush_duration_seconds", "Duration of the last data file write",
+                 lambda: store.last_flush_duration)
+metrics.callback("traffic_persistence_flushes_total", "Data file writes", lambda: store.flush_count, kind="counter")
+metrics.callback("traffic_telemetry_subscribers", "Connected /ws clients", lambda: len(hub.subscribers))
+metrics.callback("traffic_telemetry_dropped_frames_total", "Frames dropped for slow /ws clients", lambda: hub.dropped,
+                 kind="counter")
+
+# Gauges pushed by simulators, registered on first use as traffic_simulation_<name>
+MAX_SIMULATION_GAUGES = 32
+simulation_gauges = {}
+simulation_gauges_lock = threading.Lock()
+
+def push_simulation_gauges(source, gauges):
+    """Set simulator gauges; returns the names that were rejected."""
+    rejected = []
+    for name, value in gauges.items():
+        gauge = simulation_gauges.get(name)
+        if gauge is None:
+            with simulation_gauges_lock:
+                gauge = simulation_gauges.get(name)
+                if gauge is None and len(simulation_gauges) < MAX_SIMULATION_GAUGES and METRIC_NAME.match(name):
+                    gauge = simulation_gauges[name] = metrics.gauge(f"traffic_simulation_{name}",
+                                                                    f"Simulator gauge {name}", ("source",))
+        if gauge is None:
+            rejected.append(name)
+        else:
+            gauge.set(value, source)
+    return rejected
 
 # Health check endpoint
 @app.get("/health", status_code=status.HTTP_200_OK)
@@ -154,75 +372,214 @@ def update_lane_counters(counters: LaneCounter):
     """
     Update the vehicle counts for lanes.
     """
-    lane_counters.update(counters.dict(exclude_unset=True))
+    with counters_lock:
+        new_counters = counters.dict(exclude_unset=True)
+        # Totals only grow as cars pass; the history records the difference
+        history.add({lane: count - lane_counters.get(lane, 0) for lane, count in new_counters.items()
+                     if count > lane_counters.get(lane, 0)})
+        lane_counters.update(new_counters)
     save_data()
     return lane_counters
 
+@app.post("/lane-counters/increments", response_model=LaneCounter, tags=["Traffic Data"])
+def increment_lane_counters(batch: LaneCounterBatch):
+    """
+    Add a batch of lane counter increments in one atomic update. Simulators
+    buffer the cars they spawn and send them here, instead of posting totals
+    after every car; several simulators can share the counters this way.
+    """
+    apply_lane_increments([increment.dict() for increment in batch.increments])
+    save_data()
+    return lane_counters
+
+def apply_lane_increments(increments):
+    with counters_lock:
+        for increment in increments:
+            for lane, count in increment.items():
+                lane_counters[lane] = lane_counters.get(lane, 0) + count
+            history.add(increment)
+
 @app.get("/traffic-lights", tags=["Traffic Control"])
-def get_traffic_lights():
+async def get_traffic_lights(
+    request: Request,
+    since: Optional[int] = Query(None, ge=0, description="Return only the lights that changed since this version"),
+    wait: float = Query(0, ge=0, le=MAX_LONG_POLL, description="Seconds to hold the request until the state changes")
+):
     """
-    Get the current status of all traffic lights.
+    Get the current status of all traffic lights. The ETag header names the
+    state version: send it back in If-None-Match to get 304 Not Modified while
+    nothing has changed. With `since`, the response holds only the lights that
+    changed after that version. With `wait`, a request for a state the client
+    already has is held until the lights change or the wait runs out (304).
     """
-    return traffic_lights
+    if_none_match = request.headers.get("if-none-match")
+    known_version = since if since is not None else version_from_etag(if_none_match)
+    if wait and known_version == light_state_version:
+        await wait_for_light_change(known_version, wait)
+
+    # lights_lock is held while changes are published, so it is taken on a worker thread, not the event loop
+    version, lights, changes = await run_in_threadpool(copy_light_state, since is not None)
+
+    headers = {"ETag": light_etag(version)}
+    if (since is None and if_none_match == headers["ETag"]) or since == version:
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    if since is None:
+        return JSONResponse(lights, headers=headers)
+    return JSONResponse(light_changes_since(lights, changes, since, version), headers=headers)
+
+def copy_light_state(with_history=False):
+    """(version, copy of the lights, light history if asked for), all from one moment."""
+    # Batches are applied under this lock, so this never sees half of one
+    with lights_lock:
+        return (light_state_version, copy.deepcopy(traffic_lights),
+                list(light_history) if with_history else None)
+
+def light_changes_since(lights, changes, since, version):
+    """
+    Lights that differ from their state at version `since`, given the kept
+    (version, states) changes; all of them if that version is no longer kept.
+    """
+    oldest = changes[0][0]
+    if oldest <= since < version:
+        previous = changes[since - oldest][1]
+        changed = [light for light in lights
+                   if previous.get(light['id']) != (light['red'], light['yellow'], light['green'])]
+        return {"version": version, "full": False, "traffic_lights": changed}
+    return {"version": version, "full": True, "traffic_lights": lights}
 
 @app.post("/traffic-lights", response_model=list, tags=["Traffic Control"])
 def update_traffic_lights(light_status: LightStatus):
     """
     Update the status of a specific traffic light by ID.
     """
-    for light in traffic_lights:
-        if light['id'] == light_status.id:
-            light['red'] = light_status.red
-            light['yellow'] = light_status.yellow
-            light['green'] = light_status.green
-            save_data()
-            return traffic_lights
+    with lights_lock:
+        for light in traffic_lights:
+            if light['id'] == light_status.id:
+                light['red'] = light_status.red
+                light['yellow'] = light_status.yellow
+                light['green'] = light_status.green
+                lights_changed()
+                save_data()
+                return traffic_lights
     
     raise HTTPException(
         status_code=status.HTTP_404_NOT_FOUND,
         detail=f"Traffic light with ID {light_status.id} not found"
     )
 
+@app.post("/traffic-lights/batch", tags=["Traffic Control"])
+def update_traffic_lights_batch(batch: LightBatch):
+    """
+    Apply several light states as one change: either all of them are applied
+    or none is. The resulting state is checked for conflicting greens as a
+    whole, subscribers see a single change, and the data is saved once.
+    Returns the new light state version.
+    """
+    version = apply_light_states([light.dict() for light in batch.lights],
+                                 allow_conflicts=batch.allow_conflicts,
+                                 expected_version=batch.expected_version)
+    return {"version": version, "traffic_lights": traffic_lights}
+
+def apply_light_states(states, allow_conflicts=False, expected_version=None):
+    with lights_lock:
+        if expected_version is not None and expected_version != light_state_version:
+            raise HTTPException(
+                status_code=status.HTTP_409_CONFLICT,
+                detail=f"Light state is at version {light_state_version}, not {expected_version}"
+            )
+        lights_by_id = {light['id']: light for light in traffic_lights}
+        unknown = [state['id'] for state in states if state['id'] not in lights_by_id]
+        if unknown:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail=f"Traffic lights with IDs {unknown} not found"
+            )
+
+        colors = ('red', 'yellow', 'green')
+        resulting = {light['id']: dict(light) for light in traffic_lights}
+        for state in states:
+            resulting[state['id']].update({color: state[color] for color in colors})
+        if not allow_conflicts and conflicting_greens(resulting.values()):
+            raise HTTPException(
+                status_code=status.HTTP_409_CONFLICT,
+                detail="Resulting state has green lights on both axes"
+            )
+
+        for state in states:
+            lights_by_id[state['id']].update({color: state[color] for color in colors})
+        lights_changed()
+        version = light_state_version
+    save_data()
+    return version
+
 @app.post("/log-accident", tags=["Safety"])
 def log_accident(accident: AccidentLog):
     """
     Log a traffic accident or safety incident.
     """
-    log_entry = accident.dict()
-    accident_logs.append(log_entry)
-    save_data()
+    accidents.append(accident.dict())
     return {"message": "Accident logged successfully", "is_accident": accident.is_accident}
 
 @app.get("/log-accident", response_model=List[AccidentLog], tags=["Safety"])
-def get_accident_logs():
+def get_accident_logs(
+    response: Response,
+    limit: int = Query(100, ge=1, le=1000, description="Maximum number of entries to return"),
+    cursor: Optional[int] = Query(None, ge=0, description="X-Next-Cursor value from the previous page"),
+    since: Optional[datetime] = Query(None, description="Only entries at or after this time"),
+    until: Optional[datetime] = Query(None, description="Only entries before this time"),
+    newest_first: bool = Query(False, description="Return the most recent entries first")
+):
     """
-    Retrieve all logged accidents and safety incidents.
+    Retrieve logged accidents and safety incidents, one page at a time in
+    timestamp order. When more entries match, the X-Next-Cursor response
+    header holds the cursor for the next page.
     """
-    return accident_logs
+    if cursor is not None and not accidents.valid_cursor(cursor):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Invalid cursor {cursor}"
+        )
+    entries, next_cursor = accidents.query(
+        limit=limit,
+        cursor=cursor,
+        since=since,
+        until=until,
+        newest_first=newest_first
+    )
+    if next_cursor is not None:
+        response.headers["X-Next-Cursor"] = str(next_cursor)
+    return entries
 
 @app.get("/check-accident", tags=["Safety"])
 def check_accident():
     """
     Check if there's a potential accident situation based on traffic light configuration.
+    Read-only: conflicts are recorded as incidents when the lights change.
     """
-    horizontal_green = any(light['green'] for light in traffic_lights if light['direction'] in ['left', 'right'])
-    vertical_green = any(light['green'] for light in traffic_lights if light['direction'] in ['up', 'down'])
-    is_accident = horizontal_green and vertical_green
-    
-    message = ""
-    if is_accident:
-        message = "WARNING: Potential accident! Conflicting green lights detected."
-        # Log this as an accident automatically
-        log_entry = {
-            "message": message,
-            "is_accident": True,
-            "timestamp": datetime.now().isoformat()
-        }
-        accident_logs.append(log_entry)
-        save_data()
-    
+    return accident_status()
+
+def accident_status(lights=None):
+    is_accident = conflicting_greens(lights) > 0
+    message = CONFLICT_MESSAGE if is_accident else ""
     return {"is_accident": is_accident, "message": message}
 
+@app.post("/incidents", tags=["Safety"])
+def report_incident(report: IncidentReport):
+    """
+    Report that a condition started or ended. Repeated reports of the same
+    state are harmless; an incident is closed once the condition has stayed
+    clear for the debounce period, and is then written to the accident log.
+    """
+    incident = incidents.report(report.kind, report.active, report.severity, report.message, report.source)
+    return {"active": report.active, "incident": incident}
+
+@app.get("/incidents", tags=["Safety"])
+def get_open_incidents():
+    """
+    Get the incidents that are currently open. Closed incidents are in the accident log.
+    """
+    return incidents.current()
+
 @app.get("/traffic-patterns", tags=["Traffic Control"])
 def get_traffic_patterns():
     """
@@ -245,7 +602,8 @@ def create_traffic_pattern(pattern: TrafficPattern):
 @app.post("/apply-pattern/{pattern_name}", tags=["Traffic Control"])
 def apply_traffic_pattern(pattern_name: str):
     """
-    Apply a predefined traffic pattern to the current traffic lights.
+    Apply a predefined traffic pattern to the current traffic lights. A
+    pattern that would leave both axes green is refused with 409.
     """
     if pattern_name not in traffic_patterns:
         raise HTTPException(
@@ -254,14 +612,9 @@ def apply_traffic_pattern(pattern_name: str):
         )
     
     pattern = traffic_patterns[pattern_name]
-    for light_config in pattern["lights"]:
-        for light in traffic_lights:
-            if light['id'] == light_config['id']:
-                light['red'] = light_config['red']
-                light['yellow'] = light_config['yellow']
-                light['green'] = light_config['green']
-    
-    save_data()
+    # Patterns may name lights this crossroad does not have; those are skipped
+    known_ids = {light['id'] for light in traffic_lights}
+    apply_light_states([light for light in pattern["lights"] if light['id'] in known_ids])
     return {"message": f"Applied traffic pattern: {pattern_name}", "traffic_lights": traffic_lights}
 
 @app.get("/statistics", response_model=Statistics, tags=["Analytics"])
@@ -269,32 +622,182 @@ def get_statistics():
     """
     Get traffic statistics including total car count and accident count.
     """
-    total_cars = sum(lane_counters.values())
-    accident_count = sum(1 for log in accident_logs if log.get("is_accident", False))
+    return statistics(lane_counters)
+
+def statistics(counters, open_incidents=None):
+    total_cars = sum(counters.values())
+    open_incidents = incidents.current() if open_incidents is None else open_incidents
     
     return {
         "total_cars": total_cars,
-        "cars_per_lane": lane_counters,
-        "accidents": accident_count,
+        "cars_per_lane": counters,
+        "accidents": accidents.accident_count + len(open_incidents),
         "timestamp": datetime.now().isoformat()
     }
 
+SNAPSHOT_FIELDS = ("health", "lane_counters", "traffic_lights", "statistics", "safety", "incidents")
+
+def copy_state():
+    """(light state version, copy of the lights, copy of the lane counters), all from one moment."""
+    # Copy under both locks so counters and lights come from one moment
+    with lights_lock, counters_lock:
+        return light_state_version, copy.deepcopy(traffic_lights), dict(lane_counters)
+
+@app.get("/snapshot", tags=["Analytics"])
+def get_snapshot(fields: Optional[str] = Query(None, description=f"Comma-separated subset of {', '.join(SNAPSHOT_FIELDS)}")):
+    """
+    Everything a dashboard shows in one read-only response: health, lane
+    counters, traffic lights, statistics, safety status and open incidents,
+    all taken from the same state. `version` is the light state version it
+    describes.
+    """
+    selected = SNAPSHOT_FIELDS if not fields else [field.strip() for field in fields.split(",") if field.strip()]
+    unknown = [field for field in selected if field not in SNAPSHOT_FIELDS]
+    if unknown:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Unknown snapshot fields {unknown}; choose from {list(SNAPSHOT_FIELDS)}"
+        )
+
+    version, lights, counters = copy_state()
+    open_incidents = incidents.current()
+
+    snapshot = {"version": version, "timestamp": datetime.now().isoformat()}
+    for field in selected:
+        if field == "health":
+            snapshot[field] = {"status": "healthy", "version": app.version}
+        elif field == "lane_counters":
+            snapshot[field] = counters
+        elif field == "traffic_lights":
+            snapshot[field] = lights
+        elif field == "statistics":
+            snapshot[field] = statistics(counters, open_incidents)
+        elif field == "safety":
+            snapshot[field] = accident_status(lights)
+        elif field == "incidents":
+            snapshot[field] = open_incidents
+    return snapshot
+
+@app.get("/history", tags=["Analytics"])
+def get_history(
+    start: Optional[datetime] = Query(None, description="Start of the range (default: an hour before end)"),
+    end: Optional[datetime] = Query(None, description="End of the range (default: now)"),
+    resolution: Optional[int] = Query(None, description="Seconds per bucket: 1, 60 or 3600 (default: the finest that fits)")
+):
+    """
+    Lane throughput and traffic light history. Each bucket holds the cars
+    counted per lane, the seconds each light was green, and each light's
+    state (red=1, yellow=2, green=4) at the end of the bucket. Seconds are
+    kept for 6 hours, minutes for 14 days and hours for a year.
+    """
+    end_time = end.timestamp() if end else time.time()
+    start_time = start.timestamp() if start else end_time - 3600
+    if start_time >= end_time:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="start must be before end"
+        )
+
+    if resolution is None:
+        # The finest tier that still covers the start and fits in one response
+        candidates = [r for r in history.resolutions()
+                      if start_time >= time.time() - history.retention(r)
+                      and (end_time - start_time) / r <= MAX_HISTORY_POINTS]
+        resolution = candidates[0] if candidates else history.resolutions()[-1]
+    elif resolution not in history.resolutions():
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"resolution must be one of {history.resolutions()}"
+        )
+    if (end_time - start_time) / resolution > MAX_HISTORY_POINTS:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Range holds more than {MAX_HISTORY_POINTS} buckets at {resolution}s resolution"
+        )
+    return history.query(start_time, end_time, resolution)
+
+@app.get("/metrics", response_class=PlainTextResponse, tags=["System"])
+def get_metrics():
+    """
+    Server and simulation metrics in the Prometheus text format.
+    """
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+@app.post("/metrics/simulation", tags=["System"])
+def post_simulation_metrics(report: SimulationMetrics):
+    """
+    Set simulator gauges such as frame time and car count, exported at
+    /metrics as traffic_simulation_<name>{source="..."}.
+    """
+    rejected = push_simulation_gauges(report.source, report.gauges)
+    return {"accepted": len(report.gauges) - len(rejected), "rejected": rejected}
+
 @app.post("/reset", tags=["System"])
 def reset_system():
     """
     Reset all counters and logs (but keep traffic patterns).
     """
-    global lane_counters, accident_logs
-    lane_counters = {
-        'top': 0,
-        'bottom': 0,
-        'left': 0,
-        'right': 0
-    }
-    accident_logs = []
+    # In place and under the lock, so a concurrent increment is not written to a discarded dict
+    with counters_lock:
+        lane_counters.clear()
+        lane_counters.update({
+            'top': 0,
+            'bottom': 0,
+            'left': 0,
+            'right': 0
+        })
+    # Dropped, not closed, so no incident from before the reset lands in the cleared log
+    incidents.clear()
+    accidents.clear()
     save_data()
     return {"message": "System reset successfully"}
 
+@app.websocket("/ws")
+async def telemetry_socket(websocket: WebSocket):
+    """
+    Bidirectional telemetry channel. The server sends a snapshot on connect and
+    then every light change as it happens; clients push lane counter totals,
+    accident reports and incident transitions. See telemetry.py for the message format.
+    """
+    await websocket.accept()
+    queue = hub.subscribe()
+    # Subscribed first, so no change after the snapshot is missed; the copy takes threading locks, so not on the loop
+    await websocket.send_json(snapshot_message(*await run_in_threadpool(copy_state)))
+
+    async def pump():
+        while True:
+            await websocket.send_text(await queue.get())
+
+    sender = asyncio.create_task(pump())
+    try:
+        while True:
+            try:
+                message = decode(await websocket.receive_text())
+                kind = message.get('t')
+                if kind == 'c':
+                    counters = LaneCounter(**dict(zip(LANES, message['c'])))
+                    await run_in_threadpool(update_lane_counters, counters)
+                elif kind == 'i':
+                    batch = LaneCounterBatch(increments=[dict(zip(LANES, message['c']))])
+                    await run_in_threadpool(increment_lane_counters, batch)
+                elif kind == 'a':
+                    accident = AccidentLog(message=message['m'], is_accident=bool(message.get('x', 1)))
+                    await run_in_threadpool(log_accident, accident)
+                elif kind == 'n':
+                    report = IncidentReport(kind=message['k'], active=bool(message['x']),
+                                            severity=message.get('s', 1), message=message.get('m', ''), source="ws")
+                    await run_in_threadpool(report_incident, report)
+                elif kind == 'g':
+                    push_simulation_gauges(str(message.get('s', 'ws')), {str(k): float(v) for k, v in message['g'].items()})
+            except (ValueError, KeyError, TypeError, AttributeError) as e:
+                # Pydantic's ValidationError is a ValueError; a bad frame is skipped, not fatal
+                print(f"Ignoring malformed telemetry frame: {e}")
+    except WebSocketDisconnect:
+        pass
+    finally:
+        sender.cancel()
+        hub.unsubscribe(queue)
+
 # Run the server when executed directly
 if __name__ == "__main__":
     import uvicorn
@@ -2,7 +2,11 @@
 BLACK = (0, 0, 0)
 WHITE = (255, 255, 255)
 GRAY = (200, 200, 200)
-FPS = 60
+FPS = 60  # Frames drawn per second
+# The simulation advances in fixed steps of simulated time, whatever the
+# frame rate; car speeds are in pixels per step
+STEPS_PER_SECOND = 60
+SIM_DT = 1 / STEPS_PER_SECOND
 width, height = 600, 600
 
 
@@ -12,4 +16,27 @@ traffic_lights = [
     {'id': 2, 'pos': (width // 2 - 120, height // 2 - 30), 'red': True, 'yellow': True, 'green': False, 'direction': 'left'},
     {'id': 3, 'pos': (width // 2 - 30, height // 2 + 100), 'red': True, 'yellow': False, 'green': False, 'direction': 'down'},
     {'id': 4, 'pos': (width // 2 + 100, height // 2 - 30), 'red': True, 'yellow': False, 'green': False, 'direction': 'right'}
-]
\ No newline at end of file
+]
+
+
+def pattern_lights(green_directions):
+    """Light states that turn the lights facing `green_directions` green and all others red."""
+    return [{"id": light['id'], "red": light['direction'] not in green_directions, "yellow": False,
+             "green": light['direction'] in green_directions} for light in traffic_lights]
+
+
+# Early patterns numbered the lights 0..3 in this order of directions
+LEGACY_LIGHT_DIRECTIONS = ('up', 'down', 'left', 'right')
+
+
+def migrate_light_ids(states):
+    """
+    Light states of a pattern saved with the old 0..3 light numbering,
+    renumbered to the lights' ids. Patterns already using the ids are
+    returned unchanged.
+    """
+    ids = {light['id'] for light in traffic_lights}
+    if all(state['id'] in ids for state in states) or not all(0 <= state['id'] < 4 for state in states):
+        return states
+    id_for_direction = {light['direction']: light['id'] for light in traffic_lights}
+    return [dict(state, id=id_for_direction[LEGACY_LIGHT_DIRECTIONS[state['id']]]) for state in states]
@@ -1,9 +1,10 @@
-import requests
+from http_client import ApiClient
 
 BASE_URL = "http://127.0.0.1:8000"
 
+client = ApiClient(BASE_URL)
 
-response = requests.get(f"{BASE_URL}/lane-counters")
+response = client.get("lane-counters")
 
 print(response.json())
 light_status = {
@@ -12,5 +13,5 @@ light_status = {
     "yellow": False,
     "green": False
     }
-response = requests.post(f"{BASE_URL}/traffic-lights", json=light_status)
+response = client.post("traffic-lights", json=light_status)
 
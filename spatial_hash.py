@@ -0,0 +1,70 @@
+import pygame
+
+
+class SpatialHashGroup(pygame.sprite.Group):
+    """
+    Sprite group that also buckets its sprites into a uniform grid of cells.
+    Collision checks only look at the cells a rect overlaps, so a car tests
+    its neighbours instead of every other car in the group.
+    """
+
+    def __init__(self, *sprites, cell_size=40):
+        self.cell_size = cell_size
+        self.cells = {}        # (cx, cy) -> set of sprites in that cell
+        self.sprite_cells = {}  # sprite -> tuple of cells it is registered in
+        super().__init__(*sprites)
+
+    def cells_for_rect(self, rect):
+        # Rect right/bottom are exclusive, so a car touching a cell edge
+        # is not registered in the neighbouring cell
+        size = self.cell_size
+        left = rect.left // size
+        right = (rect.right - 1) // size
+        top = rect.top // size
+        bottom = (rect.bottom - 1) // size
+        return tuple((cx, cy) for cx in range(left, right + 1) for cy in range(top, bottom + 1))
+
+    def add_internal(self, sprite, layer=None):
+        super().add_internal(sprite, layer)
+        self._insert(sprite, self.cells_for_rect(sprite.rect))
+
+    def remove_internal(self, sprite):
+        super().remove_internal(sprite)
+        self._discard(sprite)
+
+    def _insert(self, sprite, cells):
+        for cell in cells:
+            bucket = self.cells.get(cell)
+            if bucket is None:
+                bucket = self.cells[cell] = set()
+            bucket.add(sprite)
+        self.sprite_cells[sprite] = cells
+
+    def _discard(self, sprite):
+        for cell in self.sprite_cells.pop(sprite, ()):
+            bucket = self.cells[cell]
+            bucket.discard(sprite)
+            if not bucket:
+                del self.cells[cell]
+
+    def relocate(self, sprite):
+        """Re-bucket a sprite after its rect has moved."""
+        if sprite not in self.sprite_cells:
+            return
+        cells = self.cells_for_rect(sprite.rect)
+        if cells != self.sprite_cells[sprite]:
+            self._discard(sprite)
+            self._insert(sprite, cells)
+
+    def nearby(self, rect):
+        """Return the sprites registered in any cell that the rect overlaps."""
+        found = set()
+        for cell in self.cells_for_rect(rect):
+            bucket = self.cells.get(cell)
+            if bucket:
+                found.update(bucket)
+        return found
+
+    def colliding(self, sprite):
+        """Return the sprites whose rect overlaps the given sprite, excluding itself."""
+        return [s for s in self.nearby(sprite.rect) if s is not sprite and sprite.rect.colliderect(s.rect)]
@@ -0,0 +1,289 @@
+import copy
+import threading
+import time
+
+import requests
+
+from http_client import ApiClient
+from telemetry import decode, encode, apply_light_bits, increments_message, accident_message, incident_message, gauges_message
+
+try:
+    from websockets.sync.client import connect as connect_websocket
+    from websockets.exceptions import WebSocketException
+except ImportError:  # Without the websockets package the worker polls over HTTP only
+    connect_websocket = None
+    WebSocketException = Exception
+
+
+class StateSync(threading.Thread):
+    """
+    Background worker that owns all traffic between the simulator and the
+    server. It keeps a traffic light snapshot that the frame loop can read
+    without blocking, and sends queued outbound updates (lane counter
+    increments, accident logs, incident transitions) off the render thread. Counter increments are
+    coalesced and flushed every `flush_interval` seconds, or as soon as
+    `flush_threshold` cars are waiting, so counter traffic does not grow with
+    the spawn rate.
+
+    When the server's /ws telemetry channel is reachable, light changes are
+    pushed to the worker and updates go out over the socket. Otherwise it polls
+    over HTTP through an ApiClient, with timeouts and a circuit breaker, and
+    tries the socket again every `websocket_retry` seconds. Polls are
+    conditional long-polls: the server holds each one for up to `long_poll`
+    seconds and answers 304 if the lights did not change.
+    """
+
+    def __init__(self, base_url, initial_lights, poll_interval=0.1, timeout=(0.5, 2.0), max_pending=1000,
+                 use_websocket=True, websocket_retry=10.0, flush_interval=1.0, flush_threshold=50,
+                 long_poll=1.0):
+        super().__init__(name="state-sync", daemon=True)
+        self.base_url = base_url
+        self.poll_interval = poll_interval
+        self.timeout = timeout
+        self.max_pending = max_pending
+        self.flush_interval = flush_interval
+        self.flush_threshold = flush_threshold
+        self.use_websocket = use_websocket and connect_websocket is not None
+        self.websocket_retry = websocket_retry
+        self.websocket_connected = False
+        # Keep below the read timeout, and short enough not to hold back flushes
+        self.long_poll = min(long_poll, flush_interval, timeout[1] / 2)
+        # Polling runs on its own schedule, so no retries here; timeout is (connect, read) seconds
+        self.client = ApiClient(base_url, timeout=timeout, retries=0)
+
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stopping = threading.Event()
+        self._lights = copy.deepcopy(initial_lights)
+        self._lights_time = None  # monotonic time of the last successful light fetch
+        self._lights_etag = None  # ETag of the snapshot, for conditional polls
+        self._pending_increments = {}  # lane -> cars not yet reported
+        self._pending_since = None  # monotonic time the oldest unsent increment was added
+        self._pending_posts = []
+        self._gauges = None  # latest simulator gauges, sent at most once per flush_interval
+        self._gauges_sent = 0.0
+        self.online = None  # unknown until the first request completes
+
+    # Frame loop side: none of these block on the network
+
+    def lights(self):
+        """Latest traffic light snapshot (the initial lights until the first fetch succeeds)."""
+        with self._lock:
+            return self._lights
+
+    def staleness(self):
+        """Seconds since the light snapshot was last refreshed, or None if it never was."""
+        with self._lock:
+            if self._lights_time is None:
+                return None
+            return time.monotonic() - self._lights_time
+
+    def add_lane_increments(self, increments):
+        """Queue lane counter increments, e.g. {'top': 1}, to be summed with others and sent in a batch."""
+        with self._lock:
+            for lane, count in increments.items():
+                self._pending_increments[lane] = self._pending_increments.get(lane, 0) + count
+            if self._pending_since is None:
+                self._pending_since = time.monotonic()
+            full = sum(self._pending_increments.values()) >= self.flush_threshold
+        if full:
+            self._wake.set()
+
+    def log_accident(self, is_accident, message):
+        """Queue an accident log entry."""
+        with self._lock:
+            if len(self._pending_posts) >= self.max_pending:
+                self._pending_posts.pop(0)  # Drop the oldest rather than grow without bound
+            self._pending_posts.append(("log-accident", {"message": message, "is_accident": is_accident}))
+        self._wake.set()
+
+    def report_incident(self, kind, active, severity=1, message=""):
+        """Queue an incident start (active=True) or end. Call on transitions only, not every frame."""
+        with self._lock:
+            if len(self._pending_posts) >= self.max_pending:
+                self._pending_posts.pop(0)
+            self._pending_posts.append(("incidents", {"kind": kind, "active": active, "severity": severity,
+                                                      "message": message, "source": "simulator"}))
+        self._wake.set()
+
+    def set_gauges(self, gauges):
+        """Publish gauges such as frame time and car count to the server's /metrics. Only the latest values are sent."""
+        with self._lock:
+            self._gauges = gauges
+
+    def stop(self, flush_timeout=2.0):
+        """Stop the worker, giving it a moment to send what is still queued."""
+        self._stopping.set()
+        self._wake.set()
+        self.join(flush_timeout)
+
+    # Blocking calls, for startup only
+
+    def fetch_lane_counters(self):
+        """One-off fetch of the lane counters. Returns None if the server is not available."""
+        try:
+            response = self.client.get("lane-counters")
+            if response.status_code == 200:
+                return response.json()
+        except requests.exceptions.RequestException as e:
+            print(f"Failed to fetch lane counters: {e}")
+        return None
+
+    # Worker thread
+
+    def run(self):
+        next_poll = 0.0
+        next_websocket = 0.0
+        while True:
+            stopping = self._stopping.is_set()
+            if self.use_websocket and not stopping and time.monotonic() >= next_websocket:
+                self._run_websocket()  # Returns once the channel drops or the worker stops
+                next_websocket = time.monotonic() + self.websocket_retry
+                continue
+
+            self._flush()
+            if stopping:
+                break
+
+            now = time.monotonic()
+            if now >= next_poll:
+                self._poll_lights()
+                next_poll = now + self.poll_interval
+
+            self._wake.wait(max(0.0, next_poll - time.monotonic()))
+            self._wake.clear()
+        self.client.close()
+
+    def _poll_lights(self):
+        try:
+            headers = {"If-None-Match": self._lights_etag} if self._lights_etag else {}
+            response = self.client.get("traffic-lights", params={"wait": self.long_poll}, headers=headers)
+            if response.status_code == 200:
+                lights = response.json()
+                with self._lock:
+                    self._lights = lights
+                    self._lights_time = time.monotonic()
+                self._lights_etag = response.headers.get("ETag")
+                self._set_online(True)
+            elif response.status_code == 304:
+                with self._lock:
+                    self._lights_time = time.monotonic()
+                self._set_online(True)
+        except requests.exceptions.RequestException as e:
+            self._set_online(False, e)
+
+    def _run_websocket(self):
+        url = "ws" + self.base_url[len("http"):] + "/ws"
+        try:
+            with connect_websocket(url, open_timeout=self.timeout[0]) as websocket:
+                self.websocket_connected = True
+                self._set_online(True)
+                while not self._stopping.is_set():
+                    self._flush(websocket)
+                    try:
+                        self._apply_message(decode(websocket.recv(timeout=self.poll_interval)))
+                    except TimeoutError:
+                        # No light change, but the open socket means the snapshot is current
+                        with self._lock:
+                            self._lights_time = time.monotonic()
+                self._flush(websocket)
+        except (OSError, WebSocketException) as e:
+            if self.websocket_connected:
+                print(f"Telemetry socket closed, polling over HTTP: {e}")
+        finally:
+            self.websocket_connected = False
+
+    def _apply_message(self, message):
+        kind = message.get('t')
+        with self._lock:
+            if kind == 'S':
+                self._lights = message['l']
+            elif kind == 'L':
+                self._lights = apply_light_bits(self._lights, message['l'])
+            else:
+                return
+            self._lights_time = time.monotonic()
+
+    def _take_increments(self):
+        """Hand over the pending increments if they are due: old enough, numerous enough, or stopping."""
+        if self._pending_since is None:
+            return None
+        due = (
+            self._stopping.is_set()
+            or time.monotonic() - self._pending_since >= self.flush_interval
+            or sum(self._pending_increments.values()) >= self.flush_threshold
+        )
+        if not due:
+            return None
+        increments, self._pending_increments, self._pending_since = self._pending_increments, {}, None
+        return increments
+
+    def _flush(self, websocket=None):
+        with self._lock:
+            increments = self._take_increments()
+            posts, self._pending_posts = self._pending_posts, []
+            gauges = None
+            if self._gauges is not None and time.monotonic() - self._gauges_sent >= self.flush_interval:
+                gauges, self._gauges, self._gauges_sent = self._gauges, None, time.monotonic()
+
+        failed = []
+        try:
+            if increments is not None:
+                if websocket is not None:
+                    websocket.send(encode(increments_message(increments)))
+                elif not self._post("lane-counters/increments", {"increments": [increments]}):
+                    self._requeue(increments, [])
+                increments = None
+            if gauges is not None:
+                # Gauges are only current values, so a lost update is not resent
+                if websocket is not None:
+                    websocket.send(encode(gauges_message("simulator", gauges)))
+                else:
+                    self._post("metrics/simulation", {"source": "simulator", "gauges": gauges})
+            while posts:
+                endpoint, payload = posts[0]
+                if websocket is not None and endpoint == "log-accident":
+                    websocket.send(encode(accident_message(payload["is_accident"], payload["message"])))
+                elif websocket is not None and endpoint == "incidents":
+                    websocket.send(encode(incident_message(payload["kind"], payload["active"],
+                                                           payload["severity"], payload["message"])))
+                elif not self._post(endpoint, payload):
+                    failed.append(posts[0])
+                posts.pop(0)
+        except (OSError, WebSocketException):
+            # A broken socket can surface as either; whatever was not sent goes
+            # back in the queue for the HTTP fallback
+            self._requeue(increments, failed + posts)
+            raise
+        self._requeue(None, failed)
+
+    def _requeue(self, increments, posts):
+        with self._lock:
+            # Unsent increments are merged back so no car goes uncounted
+            if increments:
+                for lane, count in increments.items():
+                    self._pending_increments[lane] = self._pending_increments.get(lane, 0) + count
+                if self._pending_since is None:
+                    self._pending_since = time.monotonic()
+            if posts:
+                self._pending_posts[:0] = posts
+                del self._pending_posts[:-self.max_pending]
+
+    def _post(self, endpoint, payload):
+        try:
+            response = self.client.post(endpoint, json=payload)
+            self._set_online(True)
+            # A rejected update will not succeed on retry, so only server errors count as failures
+            return response.status_code < 500
+        except requests.exceptions.RequestException as e:
+            self._set_online(False, e)
+            return False
+
+    def _set_online(self, online, error=None):
+        # Report connection changes once instead of on every failed request
+        if online != self.online:
+            if online:
+                print("Connected to traffic server")
+            else:
+                print(f"Traffic server unavailable: {error}")
+        self.online = online
@@ -0,0 +1,119 @@
+"""
+Compact message framing for the /ws telemetry channel, plus the server-side
+hub that fans light changes out to connected subscribers.
+
+Every frame is a small JSON object with a one-letter type in "t":
+
+  server -> client
+    {"t":"S","v":7,"l":[...full light dicts...],"c":[12,9,4,3]}   snapshot on connect
+    {"t":"L","v":8,"l":[[1,4],[2,1],[3,4],[4,1]]}               light change
+  client -> server
+    {"t":"c","c":[12,9,4,3]}                                    lane counter totals
+    {"t":"i","c":[2,0,1,0]}                                     lane counter increments
+    {"t":"a","m":"message","x":1}                               accident report
+    {"t":"n","k":"conflicting-greens","x":1,"s":3,"m":"..."}    incident start (x=1) or end (x=0)
+    {"t":"g","s":"simulator","g":{"cars":120}}                  simulator gauges for /metrics
+
+Light states travel as [id, bits] with red=1, yellow=2, green=4, and counters
+as a list in LANES order, so a light change for the crossroad is ~60 bytes.
+"""
+import asyncio
+import json
+
+LANES = ('top', 'bottom', 'left', 'right')
+# Incident kind for green lights on both axes at once
+CONFLICT_INCIDENT = 'conflicting-greens'
+RED, YELLOW, GREEN = 1, 2, 4
+
+
+def encode(message):
+    return json.dumps(message, separators=(',', ':'))
+
+
+def decode(text):
+    return json.loads(text)
+
+
+def light_bits(light):
+    return (RED if light['red'] else 0) | (YELLOW if light['yellow'] else 0) | (GREEN if light['green'] else 0)
+
+
+def apply_light_bits(lights, states):
+    """Return a copy of `lights` with the [id, bits] pairs from a light change applied."""
+    bits_by_id = dict(states)
+    updated = []
+    for light in lights:
+        bits = bits_by_id.get(light['id'])
+        if bits is not None:
+            light = dict(light, red=bool(bits & RED), yellow=bool(bits & YELLOW), green=bool(bits & GREEN))
+        updated.append(light)
+    return updated
+
+
+def snapshot_message(version, lights, counters):
+    return {'t': 'S', 'v': version, 'l': lights, 'c': [counters.get(lane, 0) for lane in LANES]}
+
+
+def lights_message(version, lights):
+    return {'t': 'L', 'v': version, 'l': [[light['id'], light_bits(light)] for light in lights]}
+
+
+def counters_message(counters):
+    return {'t': 'c', 'c': [counters.get(lane, 0) for lane in LANES]}
+
+
+def increments_message(increments):
+    return {'t': 'i', 'c': [increments.get(lane, 0) for lane in LANES]}
+
+
+def accident_message(is_accident, message):
+    return {'t': 'a', 'm': message, 'x': 1 if is_accident else 0}
+
+
+def incident_message(kind, active, severity, message):
+    return {'t': 'n', 'k': kind, 'x': 1 if active else 0, 's': severity, 'm': message}
+
+
+def gauges_message(source, gauges):
+    return {'t': 'g', 's': source, 'g': gauges}
+
+
+class TelemetryHub:
+    """
+    Fans out server events to WebSocket subscribers. Each subscriber gets a
+    bounded queue; when a slow client lets it fill up, the oldest frame is
+    dropped, so one stalled connection never holds memory or other clients up.
+    publish() may be called from any thread, including FastAPI's worker threads.
+    """
+
+    def __init__(self, queue_size=32):
+        self.queue_size = queue_size
+        self.subscribers = set()
+        self.loop = None
+        self.dropped = 0
+
+    def subscribe(self):
+        # Called from the event loop, which is where queue operations must happen
+        self.loop = asyncio.get_running_loop()
+        queue = asyncio.Queue(maxsize=self.queue_size)
+        self.subscribers.add(queue)
+        return queue
+
+    def unsubscribe(self, queue):
+        self.subscribers.discard(queue)
+
+    def publish(self, message):
+        if not self.subscribers or self.loop is None:
+            return
+        frame = encode(message)
+        try:
+            self.loop.call_soon_threadsafe(self._offer_all, frame)
+        except RuntimeError:
+            pass  # The event loop has shut down
+
+    def _offer_all(self, frame):
+        for queue in list(self.subscribers):
+            if queue.full():
+                queue.get_nowait()
+                self.dropped += 1
+            queue.put_nowait(frame)
@@ -0,0 +1,25 @@
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+
+
+@pytest.fixture(scope="session")
+def server(tmp_path_factory):
+    """The server module, with its data and log files in a scratch directory."""
+    os.chdir(tmp_path_factory.mktemp("server"))
+    import server
+    return server
+
+
+@pytest.fixture(scope="session")
+def api(server):
+    """A TestClient for the server, started once for the whole session."""
+    from fastapi.testclient import TestClient
+    with TestClient(server.app) as client:
+        yield client
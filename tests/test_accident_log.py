@@ -0,0 +1,20 @@
+from datetime import datetime, timedelta, timezone
+
+from accident_log import AccidentLogStore
+
+
+def test_query_compares_times_across_offsets(tmp_path):
+    store = AccidentLogStore(str(tmp_path / "accidents.jsonl"))
+    noon = datetime(2026, 10, 17, 12, 0, tzinfo=timezone.utc)
+    # The same instants written in different forms: UTC with Z, another offset, naive local time
+    store.append({"message": "a", "timestamp": (noon - timedelta(hours=1)).isoformat().replace("+00:00", "Z")})
+    store.append({"message": "b", "timestamp": noon.astimezone(timezone(timedelta(hours=2))).isoformat()})
+    store.append({"message": "c", "timestamp": (noon + timedelta(hours=1)).astimezone().replace(tzinfo=None).isoformat()})
+
+    entries, _ = store.query(since=noon)
+    assert [entry["message"] for entry in entries] == ["b", "c"]
+    entries, _ = store.query(until=noon.isoformat())
+    assert [entry["message"] for entry in entries] == ["a"]
+    entries, _ = store.query(since="2026-10-17T13:00:00+01:00", until=noon + timedelta(minutes=30))
+    assert [entry["message"] for entry in entries] == ["b"]
+    store.close()
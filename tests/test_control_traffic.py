@@ -0,0 +1,45 @@
+import json
+
+import pytest
+
+import control_traffic
+from settings import traffic_lights
+
+
+@pytest.fixture
+def control(api, tmp_path, monkeypatch):
+    """A TrafficControlSystem with default settings, talking to the test server."""
+    monkeypatch.chdir(tmp_path)
+    system = control_traffic.TrafficControlSystem()
+    system.client = api
+    return system
+
+
+@pytest.mark.parametrize("name", ["north_south_priority", "east_west_priority", "all_red"])
+def test_default_patterns_apply(control, api, name):
+    control.apply_traffic_pattern(name)
+    lights = {light['id']: light for light in api.get("/traffic-lights").json()}
+    for state in control.config['patterns'][name]:
+        assert lights[state['id']]['green'] == state['green']
+        assert lights[state['id']]['red'] == state['red']
+
+
+def test_default_pattern_accepted_by_batch_endpoint(control, api):
+    response = api.post("/traffic-lights/batch", json={"lights": control.config['patterns']['normal']})
+    assert response.status_code == 200
+
+
+def test_legacy_light_ids_migrated(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    legacy = [{"id": i, "red": i >= 2, "yellow": False, "green": i < 2} for i in range(4)]
+    (tmp_path / "traffic_config.json").write_text(json.dumps({
+        "server_url": "http://127.0.0.1:8000", "refresh_rate": 2, "timeout": 5, "auto_mode": False,
+        "patterns": {"normal": legacy}}))
+
+    system = control_traffic.TrafficControlSystem()
+
+    direction = {light['id']: light['direction'] for light in traffic_lights}
+    green = {direction[state['id']] for state in system.config['patterns']['normal'] if state['green']}
+    assert green == {'up', 'down'}
+    saved = json.loads((tmp_path / "traffic_config.json").read_text())
+    assert saved['patterns'] == system.config['patterns']
@@ -0,0 +1,34 @@
+import copy
+
+import main as sim
+from settings import STEPS_PER_SECOND, traffic_lights
+from spatial_hash import SpatialHashGroup
+
+
+def lights_with_green(*directions):
+    lights = copy.deepcopy(traffic_lights)
+    for light in lights:
+        green = light['direction'] in directions
+        light.update(red=not green, yellow=False, green=green)
+    return lights
+
+
+def test_queue_released_at_green_is_not_cleaned_up():
+    sim.reset_world(seed=1)
+    cars = SpatialHashGroup()
+
+    # Build queues on every approach behind red lights
+    red = lights_with_green()
+    for _ in range(30 * STEPS_PER_SECOND):
+        sim.simulation_step(cars, None, red)
+    queued = [car for lane in sim.lanes.values() for car in lane if car.leader is not None]
+    assert any(not car.moving for car in queued)
+
+    # Release the vertical queues and check for stalls at every step of the discharge
+    green = lights_with_green('up', 'down')
+    removed = 0
+    for _ in range(5 * STEPS_PER_SECOND):
+        sim.simulation_step(cars, None, green)
+        removed += sim.run_cleanup(cars, None, green)
+    assert removed == 0
+    assert any(car.moving for car in queued if car.direction == 'vertical')
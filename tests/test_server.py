@@ -0,0 +1,15 @@
+import time
+
+
+def test_reset_drops_open_incidents_and_pending_closes(server, api, monkeypatch):
+    monkeypatch.setattr(server.incidents, "debounce", 0.2)
+    api.post("/incidents", json={"kind": "test-stall", "active": True, "message": "stalled"})
+    api.post("/incidents", json={"kind": "test-stall", "active": False})
+    assert any(incident['kind'] == "test-stall" for incident in api.get("/incidents").json())
+
+    assert api.post("/reset").status_code == 200
+    assert api.get("/incidents").json() == []
+
+    # The close that was pending must not log the incident after the reset
+    time.sleep(0.5)
+    assert len(server.accidents) == 0
@@ -0,0 +1,21 @@
+import pytest
+
+from settings import traffic_lights
+from state_sync import StateSync
+
+
+class BrokenSocket:
+    def send(self, message):
+        raise BrokenPipeError("connection lost")
+
+
+def test_unsent_updates_are_requeued_when_the_socket_breaks():
+    sync = StateSync("http://127.0.0.1:9", traffic_lights, flush_threshold=1)
+    sync.add_lane_increments({"top": 2})
+    sync.log_accident(True, "crash")
+
+    with pytest.raises(OSError):
+        sync._flush(BrokenSocket())
+
+    assert sync._pending_increments == {"top": 2}
+    assert sync._pending_posts == [("log-accident", {"message": "crash", "is_accident": True})]
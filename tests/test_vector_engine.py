@@ -0,0 +1,24 @@
+import numpy as np
+
+from vector_engine import lane_overlaps
+
+
+def brute_force_overlaps(cars, queries):
+    across, thickness, along, length = (np.asarray(a)[None, :] for a in cars)
+    q_across, q_thickness, q_along, q_length = (np.asarray(a)[:, None] for a in queries)
+    return (
+        (q_across < across + thickness) & (q_across + q_thickness > across)
+        & (q_along < along + length) & (q_along + q_length > along)
+    ).any(axis=1)
+
+
+def test_lane_overlaps_matches_pairwise_check():
+    rng = np.random.default_rng(3)
+    for _ in range(200):
+        n, k = rng.integers(1, 40, size=2)
+        # A few lanes of cars of mixed lengths, overlapping each other at times
+        lanes = rng.choice([240, 255, 330, 345], size=n)
+        cars = (lanes, np.full(n, 10), rng.integers(200, 400, size=n), rng.choice([10, 20, 35], size=n))
+        queries = (rng.integers(220, 360, size=k), rng.choice([10, 20], size=k),
+                   rng.integers(200, 400, size=k), rng.choice([10, 20], size=k))
+        assert (lane_overlaps(cars, queries) == brute_force_overlaps(cars, queries)).all()
@@ -0,0 +1,371 @@
+import random
+
+import numpy as np
+
+from draw_objects import Car, lane_position
+from lanes import LIGHT_FOR_DIRECTION
+from settings import width, height, STEPS_PER_SECOND
+
+# Spawn directions are stored as small integer codes in the arrays
+SPAWN_DIRECTIONS = ['up-down', 'down-up', 'left-right', 'right-left']
+UP_DOWN, DOWN_UP, LEFT_RIGHT, RIGHT_LEFT = range(4)
+
+# Car.direction as an integer code
+HORIZONTAL, VERTICAL = 0, 1
+
+# Which lane counter each spawn direction feeds (lanes.LIGHT_FOR_DIRECTION gives its light)
+COUNTER_FOR_DIRECTION = {'up-down': 'top', 'down-up': 'bottom', 'left-right': 'left', 'right-left': 'right'}
+
+# Cars whose proposed rect lands in this box are checked against crossing traffic
+INTERSECTION_MARGIN = 60
+
+
+def lane_overlaps(cars, queries):
+    """
+    Whether each query rect overlaps any of `cars`, which all travel along the
+    same axis. Both are (across, thickness, along, length) arrays in that
+    axis's frame. Cars are grouped into lanes (same across and thickness) and
+    sorted along them, so every query is answered by one binary search per lane
+    it crosses: the cost grows with cars times lanes, never cars squared.
+    """
+    car_across, car_thickness, car_along, car_length = (np.asarray(a, dtype=np.int64) for a in cars)
+    query_across, query_thickness, query_along, query_length = (np.asarray(a, dtype=np.int64) for a in queries)
+    lanes, lane_of = np.unique(np.stack([car_across, car_thickness]), axis=1, return_inverse=True)
+    lane_of = lane_of.reshape(-1)
+
+    # One sorted key per car, lane by lane: lane * span + start along the lane
+    base = min(car_along.min(), query_along.min())
+    span = max((car_along + car_length).max(), (query_along + query_length).max()) - base + 1
+    order = np.lexsort((car_along, lane_of))
+    start_key = (lane_of * span + car_along - base)[order]
+    # Furthest end reached so far in each lane; earlier lanes' keys are all smaller
+    end_key = np.maximum.accumulate((lane_of * span + car_along + car_length - base)[order])
+
+    # Every query against every lane it crosses, then against the last car in
+    # that lane starting before the query ends, and the furthest end up to it
+    query, lane = np.nonzero(
+        (query_across[:, None] < lanes[0] + lanes[1]) & (query_across[:, None] + query_thickness[:, None] > lanes[0])
+    )
+    last = np.searchsorted(start_key, lane * span + query_along[query] + query_length[query] - base) - 1
+    found = np.maximum(last, 0)
+    hit = (last >= 0) & (start_key[found] >= lane * span) & (end_key[found] > lane * span + query_along[query] - base)
+    overlaps = np.zeros(len(query_across), dtype=bool)
+    overlaps[query[hit]] = True
+    return overlaps
+
+
+class VectorTraffic:
+    """
+    Struct-of-arrays car engine. Every car is a row in a set of NumPy arrays,
+    and light gating, movement, bounds culling and stall detection each run as
+    one batched operation per tick. Car sprites are only built for the cars
+    that end up on screen.
+    """
+
+    def __init__(self, simulation_bounds, spawn_intervals, max_cars=50000, speed=2, stop_distance=50, capacity=1024):
+        self.simulation_bounds = simulation_bounds
+        # Seconds between spawns per direction, counted in simulation steps
+        self.spawn_intervals = {direction: max(1, round(seconds * STEPS_PER_SECOND))
+                                for direction, seconds in spawn_intervals.items()}
+        self.spawn_timers = {direction: 0 for direction in SPAWN_DIRECTIONS}
+        self.max_cars = max_cars
+        self.base_speed = speed
+        self.stop_distance = stop_distance
+
+        self.count = 0
+        self.next_id = 0
+        self._allocate(capacity)
+
+        # Sprite cache for the cars currently drawn, keyed by car id
+        self.sprites = {}
+
+    def _allocate(self, capacity):
+        self.x = np.zeros(capacity, dtype=np.int32)
+        self.y = np.zeros(capacity, dtype=np.int32)
+        self.w = np.zeros(capacity, dtype=np.int32)
+        self.h = np.zeros(capacity, dtype=np.int32)
+        self.speed = np.zeros(capacity, dtype=np.int32)
+        self.direction = np.zeros(capacity, dtype=np.int8)
+        self.spawn_direction = np.zeros(capacity, dtype=np.int8)
+        self.moving = np.ones(capacity, dtype=bool)
+        self.color = np.zeros((capacity, 3), dtype=np.uint8)
+        self.car_id = np.zeros(capacity, dtype=np.int64)
+
+    def _arrays(self):
+        return ('x', 'y', 'w', 'h', 'speed', 'direction', 'spawn_direction', 'moving', 'color', 'car_id')
+
+    def _grow(self, needed):
+        capacity = len(self.x)
+        if needed <= capacity:
+            return
+        while capacity < needed:
+            capacity *= 2
+        for name in self._arrays():
+            old = getattr(self, name)
+            new = np.zeros((capacity,) + old.shape[1:], dtype=old.dtype)
+            new[:self.count] = old[:self.count]
+            setattr(self, name, new)
+
+    def __len__(self):
+        return self.count
+
+    def add_cars(self, direction, count, rng=random):
+        """Append `count` cars entering from one spawn direction, each in a random lane."""
+        count = min(count, self.max_cars - self.count)
+        if count <= 0:
+            return 0
+        lane_numbers = [rng.choice([1, 2]) for _ in range(count)]
+        colors = [[rng.randint(0, 255) for _ in range(3)] for _ in range(count)]
+        return self.place_cars(direction, lane_numbers, colors)
+
+    def place_cars(self, direction, lane_numbers, colors):
+        """Append cars entering from one spawn direction in the given lanes (1 or 2) and colours."""
+        count = min(len(lane_numbers), self.max_cars - self.count)
+        if count <= 0:
+            return 0
+        self._grow(self.count + count)
+        start, end = self.count, self.count + count
+        code = SPAWN_DIRECTIONS.index(direction)
+        lanes = np.array([lane_position(direction, n) for n in lane_numbers[:count]], dtype=np.int32)
+
+        if direction in ['up-down', 'down-up']:
+            self.x[start:end] = lanes
+            self.y[start:end] = self.simulation_bounds['top'] if direction == 'up-down' else self.simulation_bounds['bottom']
+            self.w[start:end], self.h[start:end] = 10, 20
+            self.direction[start:end] = VERTICAL
+            self.speed[start:end] = self.base_speed if direction == 'up-down' else -self.base_speed
+        else:
+            self.y[start:end] = lanes
+            self.x[start:end] = self.simulation_bounds['left'] if direction == 'left-right' else self.simulation_bounds['right']
+            self.w[start:end], self.h[start:end] = 20, 10
+            self.direction[start:end] = HORIZONTAL
+            self.speed[start:end] = self.base_speed if direction == 'left-right' else -self.base_speed
+
+        self.spawn_direction[start:end] = code
+        self.moving[start:end] = True
+        self.color[start:end] = colors[:count]
+        self.car_id[start:end] = np.arange(self.next_id, self.next_id + count)
+        self.next_id += count
+        self.count = end
+        return count
+
+    def spawn(self, rng=random):
+        """
+        Advance the spawn timers by one tick and spawn a car for every direction
+        whose interval has elapsed. Returns {spawn_direction: cars_spawned}.
+        """
+        spawned = {}
+        for direction in SPAWN_DIRECTIONS:
+            self.spawn_timers[direction] += 1
+        for direction in SPAWN_DIRECTIONS:
+            if self.count >= self.max_cars:
+                break
+            if self.spawn_timers[direction] >= self.spawn_intervals[direction]:
+                self.spawn_timers[direction] = 0
+                if self.add_cars(direction, 1, rng):
+                    spawned[direction] = 1
+        return spawned
+
+    def _front(self, n):
+        """Leading edge of each car along its direction of travel."""
+        sd = self.spawn_direction[:n]
+        return np.select(
+            [sd == UP_DOWN, sd == DOWN_UP, sd == LEFT_RIGHT],
+            [self.y[:n] + self.h[:n], self.y[:n], self.x[:n] + self.w[:n]],
+            self.x[:n],
+        )
+
+    def _green_mask(self, lights, n):
+        green = np.zeros(len(SPAWN_DIRECTIONS), dtype=bool)
+        for code, direction in enumerate(SPAWN_DIRECTIONS):
+            green[code] = any(light['green'] for light in lights if light['direction'] == LIGHT_FOR_DIRECTION[direction])
+        return green[self.spawn_direction[:n]]
+
+    def apply_lights(self, lights):
+        """Batched equivalent of main.manage_traffic_lights."""
+        n = self.count
+        self.moving[:n] = True
+        if n == 0:
+            return
+
+        # Stop zone along the travel axis for each spawn direction, taken from the first matching light
+        lo = np.full(len(SPAWN_DIRECTIONS), np.iinfo(np.int32).max, dtype=np.int64)
+        hi = np.full(len(SPAWN_DIRECTIONS), np.iinfo(np.int32).min, dtype=np.int64)
+        for code, direction in enumerate(SPAWN_DIRECTIONS):
+            for light in lights:
+                if light['direction'] == LIGHT_FOR_DIRECTION[direction]:
+                    axis = 1 if direction in ['up-down', 'down-up'] else 0
+                    lo[code] = light['pos'][axis] - self.stop_distance
+                    hi[code] = light['pos'][axis] + self.stop_distance
+                    break
+
+        sd = self.spawn_direction[:n]
+        front = self._front(n)
+        # Rect right/bottom are exclusive in pygame, so the leading edge used for
+        # left-right and up-down cars is one past the last pixel, like rect.right
+        in_zone = (lo[sd] <= front) & (front < hi[sd])
+        self.moving[:n] = ~(in_zone & ~self._green_mask(lights, n))
+
+    def step(self):
+        """
+        Move every car that may move by its speed, unless the move would run it
+        into the car ahead in its lane or into crossing traffic. Cars that leave
+        the window or the extended bounds are dropped; returns how many.
+        """
+        n = self.count
+        if n == 0:
+            return 0
+        x, y, w, h = self.x[:n], self.y[:n], self.w[:n], self.h[:n]
+        vertical = self.direction[:n] == VERTICAL
+        moving = self.moving[:n].copy()
+
+        dx = np.where(vertical, 0, self.speed[:n]) * moving
+        dy = np.where(vertical, self.speed[:n], 0) * moving
+        new_x, new_y = x + dx, y + dy
+
+        # Same-lane blocking: sort by lane, then by progress along the lane, and
+        # compare each car's proposed front with the current rear of the car ahead
+        sign = np.sign(self.speed[:n]).astype(np.int64)
+        lane_coord = np.where(vertical, x, y).astype(np.int64)
+        pos = np.where(vertical, y, x).astype(np.int64)
+        length = np.where(vertical, h, w).astype(np.int64)
+        new_pos = np.where(vertical, new_y, new_x).astype(np.int64)
+        # Progress grows in the direction of travel; a car spans [rear, front)
+        rear = np.where(sign > 0, pos, -(pos + length))
+        new_front = np.where(sign > 0, new_pos + length, -new_pos)
+        lane_key = self.spawn_direction[:n].astype(np.int64) * 1_000_000 + lane_coord
+        order = np.lexsort((rear, lane_key))
+        same_lane = lane_key[order][1:] == lane_key[order][:-1]
+        blocked_sorted = np.zeros(n, dtype=bool)
+        blocked_sorted[:-1] = same_lane & (new_front[order][:-1] > rear[order][1:])
+        blocked = np.zeros(n, dtype=bool)
+        blocked[order] = blocked_sorted
+
+        # Crossing traffic: only cars near the junction can meet a perpendicular car
+        cx, cy = width // 2, height // 2
+        near = (
+            (new_x < cx + INTERSECTION_MARGIN) & (new_x + w > cx - INTERSECTION_MARGIN)
+            & (new_y < cy + INTERSECTION_MARGIN) & (new_y + h > cy - INTERSECTION_MARGIN)
+        )
+        for axis in (HORIZONTAL, VERTICAL):
+            # Movers across this axis against the cars travelling along it, in its frame
+            movers = np.flatnonzero(near & moving & (self.direction[:n] != axis))
+            others = np.flatnonzero(near & (self.direction[:n] == axis))
+            if len(movers) and len(others):
+                if axis == HORIZONTAL:
+                    cars = (y[others], h[others], x[others], w[others])
+                    queries = (new_y[movers], h[movers], new_x[movers], w[movers])
+                else:
+                    cars = (x[others], w[others], y[others], h[others])
+                    queries = (new_x[movers], w[movers], new_y[movers], h[movers])
+                blocked[movers[lane_overlaps(cars, queries)]] = True
+
+        advance = moving & ~blocked
+        self.x[:n] = np.where(advance, new_x, x)
+        self.y[:n] = np.where(advance, new_y, y)
+
+        # Cars leaving the visible area on their exit side are done, as in Car.is_out_of_bounds
+        exited = (
+            (~vertical & (self.speed[:n] > 0) & (self.x[:n] > width))
+            | (~vertical & (self.speed[:n] < 0) & (self.x[:n] + w < 0))
+            | (vertical & (self.speed[:n] > 0) & (self.y[:n] > height))
+            | (vertical & (self.speed[:n] < 0) & (self.y[:n] + h < 0))
+        )
+        return self._remove(exited | ~self.in_extended_bounds())
+
+    def in_extended_bounds(self):
+        """Batched equivalent of main.is_car_in_extended_bounds."""
+        n = self.count
+        b = self.simulation_bounds
+        vertical = self.direction[:n] == VERTICAL
+        x, y = self.x[:n], self.y[:n]
+        return np.where(
+            vertical,
+            (b['top'] - 50 <= y) & (y <= b['bottom'] + 50),
+            (b['left'] - 50 <= x) & (x <= b['right'] + 50),
+        )
+
+    def cleanup_stalled(self, lights):
+        """Batched equivalent of main.cleanup_stalled_cars. Returns the number of cars removed."""
+        n = self.count
+        if n == 0:
+            return 0
+        x, y, w, h = self.x[:n], self.y[:n], self.w[:n], self.h[:n]
+        sd = self.spawn_direction[:n]
+
+        # Stopped while its own light is green: probably stuck
+        remove = ~self.moving[:n] & self._green_mask(lights, n)
+        remove |= ~self.in_extended_bounds()
+
+        # Near capacity, drop off-screen cars that are already past the junction
+        if n >= self.max_cars * 0.9:
+            off_screen = (x >= width) | (x + w <= 0) | (y >= height) | (y + h <= 0)
+            past_center = np.select(
+                [sd == LEFT_RIGHT, sd == RIGHT_LEFT, sd == UP_DOWN],
+                [x > width / 2, x + w < width / 2, y > height / 2],
+                y + h < height / 2,
+            )
+            remove |= off_screen & past_center
+        return self._remove(remove)
+
+    def _remove(self, mask):
+        """Compact the arrays, dropping the rows where mask is True."""
+        removed = int(mask.sum())
+        if removed == 0:
+            return 0
+        n = self.count
+        keep = ~mask
+        kept = n - removed
+        for name in self._arrays():
+            arr = getattr(self, name)
+            arr[:kept] = arr[:n][keep]
+        self.count = kept
+        return removed
+
+    def positions(self):
+        """Copies of (car_id, x, y) for every car, for interpolating the next drawn frame."""
+        n = self.count
+        return self.car_id[:n].copy(), self.x[:n].copy(), self.y[:n].copy()
+
+    def visible_sprites(self, previous=None, alpha=1.0):
+        """
+        Car sprites for the cars overlapping the window. Sprites are created the
+        first time a car becomes visible and reused while it stays on screen.
+        With `previous` from positions(), cars are drawn `alpha` of the way from
+        there to where they are now; cars spawned since are drawn where they are.
+        """
+        n = self.count
+        x, y, w, h = self.x[:n], self.y[:n], self.w[:n], self.h[:n]
+        if previous is not None and len(previous[0]):
+            # Rows stay in car id order (spawns append, removals compact), so match by binary search
+            ids, previous_x, previous_y = previous
+            rows = np.minimum(np.searchsorted(ids, self.car_id[:n]), len(ids) - 1)
+            known = ids[rows] == self.car_id[:n]
+            x = np.where(known, previous_x[rows] + alpha * (x - previous_x[rows]), x)
+            y = np.where(known, previous_y[rows] + alpha * (y - previous_y[rows]), y)
+        visible = np.flatnonzero((x < width) & (x + w > 0) & (y < height) & (y + h > 0))
+
+        sprites = {}
+        for i in visible:
+            car_id = int(self.car_id[i])
+            car = self.sprites.get(car_id)
+            if car is None:
+                direction = 'vertical' if self.direction[i] == VERTICAL else 'horizontal'
+                car = Car(int(x[i]), int(y[i]), tuple(int(c) for c in self.color[i]), int(self.speed[i]),
+                          direction, SPAWN_DIRECTIONS[self.spawn_direction[i]])
+            else:
+                car.rect.topleft = (int(x[i]), int(y[i]))
+            car.moving = bool(self.moving[i])
+            sprites[car_id] = car
+        self.sprites = sprites
+        return list(sprites.values())
+
+    def lane_numbers(self, start, end):
+        """Lane number (1 or 2) of the cars in rows start to end."""
+        vertical = self.direction[start:end] == VERTICAL
+        across = np.where(vertical, self.x[start:end], self.y[start:end])
+        first = np.array([lane_position(direction, 1) for direction in SPAWN_DIRECTIONS])
+        return np.where(across == first[self.spawn_direction[start:end]], 1, 2)
+
+    def moving_count(self):
+        return int(self.moving[:self.count].sum())